@@ -1,37 +1,254 @@
 import pika
 import json
+import math
+import queue
 import random
 import threading
 import time
+import uuid
+import struct
 import tkinter as tk
+from array import array
 from collections import defaultdict
+from functools import lru_cache
+from contact_store import ContactStore, QueryCache
+import transport
+import metrics
 
-# RabbitMQ connection parameters
-RABBITMQ_HOST = 'localhost'
+# RabbitMQ queues (the server is configured through transport)
 POSITION_TOPIC = 'position'
 QUERY_TOPIC = 'query'
 QUERY_RESPONSE_TOPIC = 'query-response'
 
+# Tracker state feed for GUIs: position deltas every STATE_INTERVAL seconds and
+# a full snapshot every STATE_SNAPSHOT_INTERVAL seconds on a fanout exchange
+STATE_EXCHANGE = 'tracker_state'
+STATE_INTERVAL = 0.2
+STATE_SNAPSHOT_INTERVAL = 5.0
+
+# Batched position frames from the simulator share the position queue with
+# per-person JSON messages and are told apart by content type. Layout:
+# header (version, tick, count, timestamp, id prefix length), the id prefix,
+# then count uint32 person indices, count int16 x and count int16 y.
+FRAME_CONTENT_TYPE = 'application/x-position-frame'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<BIIdB')
+
 # Environment settings
 environment_size = (10, 10)  # Default size, can be changed
+contact_radius = 0  # People within this many cells (Euclidean) are in contact; 0 = same cell only
 positions = {}  # Tracks people's positions
-contacts = defaultdict(list)  # Tracks contacts
+cells = defaultdict(set)  # Occupancy index: cell -> ids of the people in it
+contact_retention = 14 * 24 * 3600  # Seconds of closed contacts kept for queries
+contacts = ContactStore(contact_retention)  # Tracks contacts as (other_id, start, end) intervals
+query_cache = QueryCache(contacts)  # Repeated queries are answered from here until contacts change
+
+log = metrics.get_logger("contact_tracing")
+contact_checks = metrics.counter("contact_checks_total")  # update_position calls
+contact_candidates = metrics.counter("contact_candidates_total")  # people found within contact_radius
+contacts_started = metrics.counter("contacts_started_total")
+
+@lru_cache(maxsize=None)
+def neighbour_offsets(radius):
+    """Cell offsets within `radius` cells of a cell, including the cell itself."""
+    return tuple((dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                 if dx * dx + dy * dy <= radius * radius)
+
+def nearby(position, radius=None):
+    """Yields the ids of everyone within `radius` cells of a position."""
+    x, y = position
+    for dx, dy in neighbour_offsets(contact_radius if radius is None else radius):
+        occupants = cells.get((x + dx, y + dy))
+        if occupants:
+            yield from occupants
+
+def update_position(person_id, new_position, now=None, seen=True):
+    """Moves a person in the occupancy index and records contacts at the new position.
+
+    Only the cells within contact_radius are examined, so the cost depends
+    on how crowded the neighbourhood is, not on the population size.
+    seen=False refreshes contacts without counting as an update from the person.
+    Returns the ids whose contact with this person just started.
+    """
+    old_position = positions.get(person_id)
+    if old_position is not None and old_position != new_position:
+        occupants = cells[old_position]
+        occupants.discard(person_id)
+        if not occupants:
+            del cells[old_position]
+    positions[person_id] = new_position
+    cells[new_position].add(person_id)
+
+    now = time.time() if now is None else now
+    contacted = [other_id for other_id in nearby(new_position) if other_id != person_id]
+    started = contacts.update(person_id, contacted, now, seen)
+    contact_checks.inc()
+    contact_candidates.inc(len(contacted))
+    contacts_started.inc(len(started))
+    return started
+
+def forget(person_ids):
+    """Drops people from the occupancy index; used for people the contact store found idle."""
+    for person_id in person_ids:
+        position = positions.pop(person_id, None)
+        if position is not None:
+            occupants = cells.get(position)
+            if occupants is not None:
+                occupants.discard(person_id)
+                if not occupants:
+                    del cells[position]
 
 def setup_rabbitmq_channel():
     """Sets up a connection and channel for RabbitMQ."""
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    connection = transport.connect()
     channel = connection.channel()
     channel.queue_declare(queue=POSITION_TOPIC)
     channel.queue_declare(queue=QUERY_TOPIC)
     channel.queue_declare(queue=QUERY_RESPONSE_TOPIC)
     return connection, channel
 
+def encode_frame(tick, indices, xs, ys, prefix='sim', timestamp=None):
+    """Encodes the positions of people `prefix + index` as one binary frame.
+
+    indices, xs and ys are NumPy arrays (or anything with matching
+    .astype/.tobytes), all of the same length.
+    """
+    raw_prefix = prefix.encode()
+    header = FRAME_HEADER.pack(FRAME_VERSION, tick, len(indices),
+                               time.time() if timestamp is None else timestamp, len(raw_prefix))
+    return b''.join((header, raw_prefix, indices.astype('<u4').tobytes(),
+                     xs.astype('<i2').tobytes(), ys.astype('<i2').tobytes()))
+
+def decode_frame(body):
+    """Returns (tick, timestamp, [(person_id, (x, y))]) from a position frame."""
+    version, tick, count, timestamp, prefix_length = FRAME_HEADER.unpack_from(body)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported position frame version: {version}")
+    offset = FRAME_HEADER.size
+    prefix = body[offset:offset + prefix_length].decode()
+    offset += prefix_length
+    indices, xs, ys = array('I'), array('h'), array('h')
+    for column, size in ((indices, 4), (xs, 2), (ys, 2)):
+        column.frombytes(body[offset:offset + count * size])
+        offset += count * size
+    return tick, timestamp, [(f"{prefix}{i}", (x, y)) for i, x, y in zip(indices, xs, ys)]
+
+def parse_query(body):
+    """Parses a query message into a request dict, else raises ValueError.
+
+    A body that is not a JSON object is a bare person id. Repeated ids are
+    dropped, keeping the first occurrence.
+    """
+    text = body.decode()
+    request = json.loads(text) if text.startswith('{') else {'id': text}
+    if not isinstance(request, dict) or ('id' not in request and 'ids' not in request):
+        raise ValueError("a query needs 'id' or 'ids'")
+    if 'ids' in request:
+        ids = request['ids']
+        if not isinstance(ids, list) or not ids or not all(isinstance(person_id, str) for person_id in ids):
+            raise ValueError("'ids' must be a non-empty list of strings")
+        request['ids'] = list(dict.fromkeys(ids))
+    elif not isinstance(request['id'], str):
+        raise ValueError("'id' must be a string")
+    since = request.get('since')
+    if since is not None and (isinstance(since, bool) or not isinstance(since, (int, float))
+                              or not math.isfinite(since)):
+        raise ValueError("'since' must be a number")
+    hops = request.get('hops', 1)
+    if isinstance(hops, bool) or not isinstance(hops, int) or hops < 1:
+        raise ValueError("'hops' must be an integer of at least 1")
+    return request
+
+def answer_query(request):
+    """Answers a query request dict.
+
+    {"ids": [...], "since": T, "hops": k} returns the direct contacts of
+    every id and, when hops > 1, a time-respecting trace of everyone
+    reachable within k hops. A bare {"id": ...} is the single-id form.
+    """
+    global query_cache
+    if query_cache.store is not contacts:
+        query_cache = QueryCache(contacts)
+    ids = request['ids'] if 'ids' in request else [request['id']]
+    since = request.get('since')
+    hops = request.get('hops', 1)
+
+    def compute():
+        response = {'contacts': {person_id: contacts.query(person_id, since) for person_id in ids}}
+        if hops > 1:
+            response['trace'] = {person_id: {'hop': hop, 'time': reached, 'via': via}
+                                 for person_id, (hop, reached, via) in contacts.trace(ids, since, hops).items()}
+        return response
+
+    return query_cache.get((tuple(sorted(ids)), since, hops), compute)
+
+class StateFeed:
+    """Publishes the tracker's view of everyone's position on STATE_EXCHANGE.
+
+    People who moved since the last flush are remembered, and flush()
+    publishes one delta holding only their new positions. Every
+    snapshot_interval seconds it publishes a snapshot of everyone instead,
+    so a GUI that joins late or misses a delta catches up on the next one.
+    """
+
+    def __init__(self, channel=None, snapshot_interval=STATE_SNAPSHOT_INTERVAL):
+        self.channel = channel
+        self.snapshot_interval = snapshot_interval
+        self.moved = {}
+        self.seq = 0
+        self.last_snapshot = 0.0
+        if channel is not None:
+            channel.exchange_declare(exchange=STATE_EXCHANGE, exchange_type='fanout')
+
+    def move(self, person_id, position):
+        self.moved[person_id] = position
+
+    def delta(self):
+        """Drains the pending moves into a delta message, or None if nobody moved."""
+        if not self.moved:
+            return None
+        moved, self.moved = self.moved, {}
+        self.seq += 1
+        return {'type': 'delta', 'seq': self.seq, 'positions': moved}
+
+    def snapshot(self):
+        """Everyone's position; pending moves are folded into it."""
+        self.moved = {}
+        self.seq += 1
+        self.last_snapshot = time.monotonic()
+        return {'type': 'snapshot', 'seq': self.seq, 'size': list(environment_size), 'positions': positions}
+
+    def _publish(self, message):
+        if self.channel is not None:
+            self.channel.basic_publish(exchange=STATE_EXCHANGE, routing_key='',
+                                       body=json.dumps(message, separators=(',', ':')),
+                                       properties=pika.BasicProperties(content_type='application/json'))
+
+    def flush(self):
+        """Publishes a snapshot when one is due, otherwise the pending delta."""
+        if time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self._publish(self.snapshot())
+            return
+        message = self.delta()
+        if message is not None:
+            self._publish(message)
+
 def tracker():
     """Tracker listens for position updates and logs contacts between individuals."""
     connection, channel = setup_rabbitmq_channel()
+    state_feed = StateFeed(channel)
+    # People who go silent stop counting as contacts for everyone else too
+    contacts.on_idle = forget
+    metrics.start()
+    metrics.gauge("tracked_people", lambda: len(positions))
+    metrics.gauge("occupied_cells", lambda: len(cells))
+    frame_lag = metrics.histogram("queue_lag_seconds", service="tracker_frames")
     
     def position_callback(ch, method, properties, body):
         """Handles incoming position updates and tracks contacts."""
+        if properties is not None and properties.content_type == FRAME_CONTENT_TYPE:
+            frame_callback(body)
+            return
         data = json.loads(body)
         person_id = data['id']
         new_position = tuple(data['position'])
@@ -39,27 +256,70 @@ def tracker():
         if person_id in positions:
             old_position = positions[person_id]
             if old_position != new_position:
-                print(f"{person_id} moved from {old_position} to {new_position}")
+                log.debug("%s moved from %s to %s", person_id, old_position, new_position)
         else:
-            print(f"{person_id} started at {new_position}")
+            log.debug("%s started at %s", person_id, new_position)
+        state_feed.move(person_id, new_position)
 
-        # Check for contact with other individuals
-        for other_id, pos in positions.items():
-            if other_id != person_id and pos == new_position:
-                contacts[person_id].append((other_id, time.time()))
-                contacts[other_id].append((person_id, time.time()))
-                print(f"Contact recorded: {person_id} <-> {other_id}")
+        # Check for contact with nearby individuals
+        for other_id in update_position(person_id, new_position):
+            log.debug("Contact recorded: %s <-> %s", person_id, other_id)
 
-        positions[person_id] = new_position
+    def frame_callback(body):
+        """Applies a batched frame of simulator positions."""
+        tick, timestamp, updates = decode_frame(body)
+        now = time.time()
+        frame_lag.observe(max(0.0, now - timestamp))
+        new_contacts = 0
+        framed = set()
+        for person_id, new_position in updates:
+            framed.add(person_id)
+            if positions.get(person_id) != new_position:
+                state_feed.move(person_id, new_position)
+            new_contacts += len(update_position(person_id, new_position, now))
+        # Frames only carry people who moved; refresh everyone else still in contact,
+        # so contact durations follow time rather than movement
+        for person_id in [p for p in contacts.active if p not in framed]:
+            position = positions.get(person_id)
+            if position is not None:
+                new_contacts += len(update_position(person_id, position, now, seen=False))
+        log.info("Frame %d: %d positions, %d new contacts", tick, len(updates), new_contacts)
 
     def query_callback(ch, method, properties, body):
         """Handles contact query requests and responds with contact history."""
-        queried_id = body.decode()
-        response = {queried_id: sorted(contacts[queried_id], key=lambda x: x[1], reverse=True)}
-        channel.basic_publish(exchange='', routing_key=QUERY_RESPONSE_TOPIC, body=json.dumps(response))
+        reply_to = properties.reply_to if properties is not None else None
+        try:
+            request = parse_query(body)
+        except ValueError as e:
+            log.warning("Rejecting contact query %r: %s", body, e)
+            if reply_to:
+                channel.basic_publish(exchange='', routing_key=reply_to,
+                                      properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+                                      body=json.dumps({'error': str(e)}))
+            return
+        if reply_to:
+            # Request/reply: the answer goes only to the asker, tagged with its correlation id
+            channel.basic_publish(exchange='', routing_key=reply_to,
+                                  properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+                                  body=json.dumps(answer_query(request)))
+        elif 'ids' in request:
+            # Batch query without a reply queue: answered in full on the shared response queue
+            channel.basic_publish(exchange='', routing_key=QUERY_RESPONSE_TOPIC, body=json.dumps(answer_query(request)))
+        else:
+            # Legacy form: a bare id answered on the shared response queue
+            queried_id = request['id']
+            response = {queried_id: contacts.query(queried_id, request.get('since'))}
+            channel.basic_publish(exchange='', routing_key=QUERY_RESPONSE_TOPIC, body=json.dumps(response))
+
+    channel.basic_consume(queue=POSITION_TOPIC, on_message_callback=metrics.instrument("tracker", position_callback),
+                          auto_ack=True)
+    channel.basic_consume(queue=QUERY_TOPIC, on_message_callback=metrics.instrument("tracker_query", query_callback),
+                          auto_ack=True)
 
-    channel.basic_consume(queue=POSITION_TOPIC, on_message_callback=position_callback, auto_ack=True)
-    channel.basic_consume(queue=QUERY_TOPIC, on_message_callback=query_callback, auto_ack=True)
+    def publish_state():
+        state_feed.flush()
+        connection.call_later(STATE_INTERVAL, publish_state)
+    connection.call_later(STATE_INTERVAL, publish_state)
     print("Tracker running...")
     channel.start_consuming()
 
@@ -75,49 +335,315 @@ def person(person_id, speed):
         x, y = max(0, min(environment_size[0]-1, x+dx)), max(0, min(environment_size[1]-1, y+dy))
         channel.basic_publish(exchange='', routing_key=POSITION_TOPIC, body=json.dumps({'id': person_id, 'position': [x, y]}))
 
-def query(person_id):
-    """Sends a contact query request for a given person and prints the response."""
-    connection, channel = setup_rabbitmq_channel()
-    channel.basic_publish(exchange='', routing_key=QUERY_TOPIC, body=person_id)
-    
-    def response_callback(ch, method, properties, body):
-        """Handles the response from the tracker and prints the contact history."""
-        print(json.loads(body))
-        connection.close()
-        exit()
-    
-    channel.basic_consume(queue=QUERY_RESPONSE_TOPIC, on_message_callback=response_callback, auto_ack=True)
-    print(f"Querying contacts for {person_id}...")
-    channel.start_consuming()
+def simulate(population, tick=1.0, chunk_size=50000, min_speed=0.5, max_speed=2.0, ticks=None, seed=None,
+             publish=True, paced=True):
+    """Simulates a whole population with NumPy arrays instead of one thread per person.
+
+    Each person moves one cell in a random direction every `speed` seconds
+    (speeds drawn uniformly from [min_speed, max_speed]), clamped to
+    environment_size. Each tick, everyone whose position changed is
+    published in position frames of at most chunk_size people. With
+    paced=False ticks run back to back, each still advancing the simulated
+    clock by `tick` seconds.
+    """
+    import numpy as np  # only the simulator needs NumPy
+
+    rng = np.random.default_rng(seed)
+    width, height = environment_size
+    xs = rng.integers(0, width, population, dtype=np.int16)
+    ys = rng.integers(0, height, population, dtype=np.int16)
+    speeds = rng.uniform(min_speed, max_speed, population)
+    next_move = rng.uniform(0, speeds)
+    steps = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int16)
+
+    connection, channel = setup_rabbitmq_channel() if publish else (None, None)
+    properties = pika.BasicProperties(content_type=FRAME_CONTENT_TYPE)
+    moved = np.arange(population, dtype=np.uint32)  # the first frame places everyone
+    number = 0
+    try:
+        while ticks is None or number < ticks:
+            started = time.perf_counter()
+            if number:
+                next_move -= tick
+                moved = np.flatnonzero(next_move <= 0).astype(np.uint32)
+                # At most one step per tick; faster walkers just move every tick
+                next_move[moved] = np.maximum(next_move[moved] + speeds[moved], 0)
+                step = steps[rng.integers(0, 4, len(moved))]
+                xs[moved] = np.clip(xs[moved] + step[:, 0], 0, width - 1)
+                ys[moved] = np.clip(ys[moved] + step[:, 1], 0, height - 1)
+            if publish:
+                for start in range(0, len(moved), chunk_size):
+                    indices = moved[start:start + chunk_size]
+                    channel.basic_publish(exchange='', routing_key=POSITION_TOPIC, properties=properties,
+                                          body=encode_frame(number, indices, xs[indices], ys[indices]))
+            elapsed = time.perf_counter() - started
+            print(f"Tick {number}: {len(moved)} of {population} moved in {elapsed * 1000:.1f} ms")
+            number += 1
+            if publish and paced and elapsed < tick:
+                connection.sleep(tick - elapsed)
+    finally:
+        if connection is not None and connection.is_open:
+            connection.close()
+
+class ContactQueryClient:
+    """Request/reply client for the tracker.
+
+    Replies arrive on a private exclusive queue and are matched to requests
+    by correlation id, so concurrent clients never see each other's answers
+    and one client can have many requests in flight.
+    """
+
+    def __init__(self):
+        self.connection, self.channel = setup_rabbitmq_channel()
+        self.reply_queue = self.channel.queue_declare(queue='', exclusive=True).method.queue
+        self.responses = {}
+        self.channel.basic_consume(queue=self.reply_queue, on_message_callback=self._on_reply, auto_ack=True)
+
+    def _on_reply(self, ch, method, properties, body):
+        self.responses[properties.correlation_id] = json.loads(body)
+
+    def send(self, ids, since=None, hops=1):
+        """Publishes a query for one or many ids and returns its correlation id."""
+        correlation_id = uuid.uuid4().hex
+        request = {'ids': [ids] if isinstance(ids, str) else list(ids), 'since': since, 'hops': hops}
+        self.channel.basic_publish(exchange='', routing_key=QUERY_TOPIC, body=json.dumps(request),
+                                   properties=pika.BasicProperties(reply_to=self.reply_queue,
+                                                                   correlation_id=correlation_id))
+        return correlation_id
+
+    def wait(self, correlation_id, timeout=5.0):
+        """Waits for the reply to one request."""
+        deadline = time.monotonic() + timeout
+        while correlation_id not in self.responses:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No reply to query {correlation_id}")
+            self.connection.process_data_events(time_limit=remaining)
+        return self.responses.pop(correlation_id)
+
+    def query(self, ids, since=None, hops=1, timeout=5.0):
+        return self.wait(self.send(ids, since, hops), timeout)
+
+    def close(self):
+        if self.connection.is_open:
+            self.connection.close()
+
+def query(person_ids, hops=1, since=None):
+    """Sends a contact query for one or more comma-separated ids and prints the response."""
+    client = ContactQueryClient()
+    ids = person_ids.split(',')
+    print(f"Querying contacts for {', '.join(ids)}...")
+    try:
+        print(json.dumps(client.query(ids, since, hops), indent=2))
+    finally:
+        client.close()
+
+class TrackerView:
+    """Canvas view of the tracker state feed.
+
+    A background thread consumes an exclusive queue bound to STATE_EXCHANGE
+    and hands messages to the Tk thread through a thread-safe queue. Each
+    frame only the canvas items of people who moved are touched, and they
+    are moved with coords() instead of being recreated. When there are
+    more than detail_limit people, or cells are too small to draw people
+    in, the view switches to a heatmap with one rectangle per block of
+    cells, coloured by how many people are in it.
+    """
+
+    MAX_FPS = 10
+    MAX_BLOCKS = 100  # heatmap blocks per axis, at most
+    MIN_CELL_PIXELS = 4  # smaller cells are always drawn as a heatmap
+    LABEL_CELL_PIXELS = 20  # ids are written on people only above this cell size
+    HEAT_COLOURS = ("#fff5eb", "#fee6ce", "#fdd0a2", "#fdae6b", "#fd8d3c", "#f16913", "#d94801", "#8c2d04")
+
+    def __init__(self, host=None, max_pixels=800, detail_limit=2000):
+        self.host = host
+        self.max_pixels = max_pixels
+        self.detail_limit = detail_limit
+        self.incoming = queue.Queue()
+        self.stop_event = threading.Event()
+        self.positions = {}
+        self.moved = set()  # people whose position changed since the last frame
+        self.density = defaultdict(int)  # heatmap block -> people in it
+        self.heated = set()  # blocks whose count changed since the last frame
+        self.items = {}  # person -> (oval, text or None), in people mode
+        self.blocks = {}  # block -> rectangle, in heatmap mode
+        self.heatmap = None
+        self.last_seq = None
+
+        self.root = tk.Tk()
+        self.root.title("Contact Tracing GUI")
+        self.canvas = tk.Canvas(self.root, bg="white", highlightthickness=0)
+        self.canvas.pack()
+        self.status = tk.Label(self.root, text="Waiting for tracker state...", anchor="w")
+        self.status.pack(fill=tk.X)
+        self.resize(environment_size)
+
+    def resize(self, size):
+        """Fits a grid of `size` cells into the canvas and regroups the heatmap blocks."""
+        self.size = tuple(size)
+        width, height = self.size
+        self.scale = min(50, self.max_pixels / width, self.max_pixels / height)
+        self.block = -(-max(width, height) // self.MAX_BLOCKS)
+        self.canvas.config(width=round(width * self.scale), height=round(height * self.scale))
+        self.density.clear()
+        for x, y in self.positions.values():
+            self.density[(x // self.block, y // self.block)] += 1
+        self.heatmap = None  # forces a full redraw in whichever mode applies
+
+    def _consume(self):
+        while not self.stop_event.is_set():
+            try:
+                connection = transport.connect(self.host)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=STATE_EXCHANGE, exchange_type='fanout')
+                queue_name = channel.queue_declare(queue='', exclusive=True).method.queue
+                channel.queue_bind(exchange=STATE_EXCHANGE, queue=queue_name)
+                for method, properties, body in channel.consume(queue_name, auto_ack=True, inactivity_timeout=0.5):
+                    if self.stop_event.is_set():
+                        break
+                    if body is not None:
+                        self.incoming.put(json.loads(body))
+                connection.close()
+            except pika.exceptions.AMQPError as e:
+                print(f"Tracker state unavailable ({e}), retrying...")
+                self.stop_event.wait(2)
+
+    def _move(self, person_id, position):
+        old = self.positions.get(person_id)
+        if old == position:
+            return
+        if old is not None:
+            block = (old[0] // self.block, old[1] // self.block)
+            self.density[block] -= 1
+            self.heated.add(block)
+        if position is None:
+            del self.positions[person_id]
+        else:
+            self.positions[person_id] = position
+            block = (position[0] // self.block, position[1] // self.block)
+            self.density[block] += 1
+            self.heated.add(block)
+        self.moved.add(person_id)
+
+    def apply(self, message):
+        """Applies one delta or snapshot from the state feed."""
+        if message['type'] == 'snapshot':
+            if tuple(message['size']) != self.size:
+                self.resize(message['size'])
+            for person_id in [p for p in self.positions if p not in message['positions']]:
+                self._move(person_id, None)
+        for person_id, position in message['positions'].items():
+            self._move(person_id, tuple(position))
+        self.last_seq = message['seq']
+
+    def _draw_person(self, person_id):
+        position = self.positions.get(person_id)
+        item = self.items.get(person_id)
+        if position is None:
+            if item is not None:
+                for part in self.items.pop(person_id):
+                    if part is not None:
+                        self.canvas.delete(part)
+            return
+        x, y = position
+        s = self.scale
+        box = (x * s + s * 0.2, y * s + s * 0.2, x * s + s * 0.8, y * s + s * 0.8)
+        if item is None:
+            oval = self.canvas.create_oval(*box, fill="blue", outline="")
+            text = None
+            if s >= self.LABEL_CELL_PIXELS:
+                text = self.canvas.create_text(x * s + s / 2, y * s + s / 2, text=person_id, fill="white")
+            self.items[person_id] = (oval, text)
+        else:
+            oval, text = item
+            self.canvas.coords(oval, *box)
+            if text is not None:
+                self.canvas.coords(text, x * s + s / 2, y * s + s / 2)
+
+    def _draw_block(self, block):
+        count = self.density.get(block, 0)
+        rectangle = self.blocks.get(block)
+        if count <= 0:
+            self.density.pop(block, None)
+            if rectangle is not None:
+                self.canvas.delete(self.blocks.pop(block))
+            return
+        colour = self.HEAT_COLOURS[min(len(self.HEAT_COLOURS) - 1, count.bit_length() - 1)]
+        if rectangle is None:
+            bx, by = block
+            side = self.block * self.scale
+            self.blocks[block] = self.canvas.create_rectangle(
+                bx * side, by * side, (bx + 1) * side, (by + 1) * side, fill=colour, outline="")
+        else:
+            self.canvas.itemconfig(rectangle, fill=colour)
+
+    def render(self):
+        """Draws the changes since the last frame, or everything after a mode switch."""
+        heatmap = len(self.positions) > self.detail_limit or self.scale < self.MIN_CELL_PIXELS
+        if heatmap != self.heatmap:
+            self.canvas.delete("all")
+            self.items.clear()
+            self.blocks.clear()
+            self.heatmap = heatmap
+            self.moved = set(self.positions)
+            self.heated = set(self.density)
+        if heatmap:
+            for block in self.heated:
+                self._draw_block(block)
+        else:
+            for person_id in self.moved:
+                self._draw_person(person_id)
+        self.moved = set()
+        self.heated = set()
+
+    def refresh(self):
+        # One drain and one incremental redraw per frame, however many messages arrived
+        received = False
+        while True:
+            try:
+                self.apply(self.incoming.get_nowait())
+            except queue.Empty:
+                break
+            received = True
+        if received or self.heatmap is None:
+            self.render()
+            mode = f"heatmap, {self.block}x{self.block} cells per block" if self.heatmap else "people"
+            self.status.config(text=f"{len(self.positions)} people, {self.size[0]}x{self.size[1]} cells, "
+                                    f"{mode}, state #{self.last_seq}")
+        self.root.after(1000 // self.MAX_FPS, self.refresh)
+
+    def run(self):
+        threading.Thread(target=self._consume, daemon=True).start()
+        self.refresh()
+        self.root.mainloop()
+        self.stop_event.set()
 
 def gui():
-    """Graphical User Interface to display the environment and query contact history."""
-    root = tk.Tk()
-    root.title("Contact Tracing GUI")
-    canvas = tk.Canvas(root, width=environment_size[0]*50, height=environment_size[1]*50, bg="white")
-    canvas.pack()
-    
-    def update_display():
-        """Updates the canvas with current positions of people in the environment."""
-        canvas.delete("all")
-        for person_id, (x, y) in positions.items():
-            canvas.create_oval(x*50+10, y*50+10, x*50+40, y*50+40, fill="blue")
-            canvas.create_text(x*50+25, y*50+25, text=person_id, fill="white")
-        root.after(500, update_display)
-    
-    update_display()
-    root.mainloop()
+    """Graphical User Interface to display the environment from the tracker's state feed."""
+    TrackerView().run()
 
 if __name__ == "__main__":
     import sys
+    if "--size" in sys.argv:
+        # --size WIDTHxHEIGHT sets environment_size for any command
+        index = sys.argv.index("--size")
+        width, height = sys.argv[index + 1].lower().split("x")
+        environment_size = (int(width), int(height))
+        del sys.argv[index:index + 2]
     if len(sys.argv) < 2:
-        print("Usage: python script.py [tracker|person|query|gui] [args]")
+        print("Usage: python script.py [--size WIDTHxHEIGHT] [tracker|person|simulate|query|gui] [args]")
     elif sys.argv[1] == "tracker":
+        if len(sys.argv) > 2:
+            contact_radius = int(sys.argv[2])
         tracker()
     elif sys.argv[1] == "person" and len(sys.argv) == 4:
         threading.Thread(target=person, args=(sys.argv[2], float(sys.argv[3]))).start()
-    elif sys.argv[1] == "query" and len(sys.argv) == 3:
-        query(sys.argv[2])
+    elif sys.argv[1] == "simulate" and len(sys.argv) >= 3:
+        simulate(int(sys.argv[2]), float(sys.argv[3]) if len(sys.argv) > 3 else 1.0)
+    elif sys.argv[1] == "query" and 3 <= len(sys.argv) <= 5:
+        query(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+              float(sys.argv[4]) if len(sys.argv) > 4 else None)
     elif sys.argv[1] == "gui":
         gui()
     else:
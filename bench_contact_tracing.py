@@ -0,0 +1,89 @@
+"""Scaling benchmark for contact detection in Contact_tracing.
+
+Places N people at random in a grid sized for a constant density, then
+times random-walk moves through update_position. The per-move cost should
+stay flat as N grows from 100 to 1M. With --compare-scan, the old full
+scan over `positions` is timed as well, for populations up to --scan-limit.
+
+    python bench_contact_tracing.py --sizes 100 1000 10000 100000 1000000 --radius 1
+"""
+import time
+import random
+import argparse
+
+import Contact_tracing as ct
+from contact_store import ContactStore
+
+
+def reset(population, density, radius):
+    side = max(1, int((population / density) ** 0.5))
+    ct.environment_size = (side, side)
+    ct.contact_radius = radius
+    ct.positions.clear()
+    ct.cells.clear()
+    ct.contacts = ContactStore(ct.contact_retention)
+    return side
+
+
+def scan_contacts(person_id, new_position, now):
+    """The previous O(population) contact check, kept for comparison."""
+    contacted = []
+    for other_id, pos in ct.positions.items():
+        if other_id != person_id and pos == new_position:
+            contacted.append(other_id)
+    ct.positions[person_id] = new_position
+    return contacted
+
+
+def run(population, moves, density, radius, seed, scan=False):
+    rng = random.Random(seed)
+    side = reset(population, density, radius)
+    for person_id in range(population):
+        ct.update_position(person_id, (rng.randrange(side), rng.randrange(side)), 0.0)
+
+    steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    plan = []
+    for _ in range(moves):
+        person_id = rng.randrange(population)
+        dx, dy = steps[rng.randrange(4)]
+        plan.append((person_id, dx, dy))
+
+    check = scan_contacts if scan else ct.update_position
+    positions = ct.positions
+    found = 0
+    start = time.perf_counter()
+    for person_id, dx, dy in plan:
+        x, y = positions[person_id]
+        x, y = max(0, min(side - 1, x + dx)), max(0, min(side - 1, y + dy))
+        found += len(check(person_id, (x, y), 1.0))
+    elapsed = time.perf_counter() - start
+    return {"population": population, "grid": side, "moves": moves, "seconds": elapsed,
+            "us_per_move": elapsed / moves * 1e6, "contacts": found, "stored_intervals": len(ct.contacts),
+            "tick_seconds": elapsed / moves * population}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contact detection scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000, 1000000])
+    parser.add_argument("--moves", type=int, default=100000, help="timed moves per population size")
+    parser.add_argument("--density", type=float, default=0.5, help="people per cell")
+    parser.add_argument("--radius", type=int, default=0, help="contact radius in cells")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare-scan", action="store_true", help="also time the old full scan")
+    parser.add_argument("--scan-limit", type=int, default=10000, help="largest population to full-scan")
+    args = parser.parse_args()
+
+    print(f"{'people':>10} {'grid':>6} {'us/move':>9} {'tick s':>9} {'contacts':>10}  method")
+    for population in args.sizes:
+        methods = [("grid", False)]
+        if args.compare_scan and population <= args.scan_limit:
+            methods.append(("scan", True))
+        for name, scan in methods:
+            moves = min(args.moves, 2000) if scan else args.moves
+            r = run(population, moves, args.density, args.radius, args.seed, scan)
+            print(f"{r['population']:>10,} {r['grid']:>6} {r['us_per_move']:>9.2f} {r['tick_seconds']:>9.3f} "
+                  f"{r['contacts']:>10,}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Benchmark and replay harness for the matching engine.
+
+Drives order_matching.process_order directly, without RabbitMQ, from either
+a seeded synthetic order flow or a recorded order log, and reports
+throughput, per-order latency percentiles, peak memory and fill counts.
+
+    python bench_matching.py --orders 200000 --symbols 50 --cross-rate 0.2
+    python bench_matching.py --replay orders.jsonl --output results.json
+    python bench_matching.py --output new.json --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import metrics
+import order_matching
+from order_flow import generate_orders, load_orders
+
+
+class CountingPublisher:
+    """Stands in for TradePublisher and only counts fills."""
+
+    def __init__(self):
+        self.buffer = []
+        self.trades = 0
+        self.quantity = 0
+
+    def publish(self, trade):
+        self.trades += 1
+        self.quantity += trade["quantity"]
+
+    def flush(self):
+        pass
+
+    def flush_if_due(self):
+        pass
+
+
+def _reset_engine():
+    order_matching.order_books.clear()
+    order_matching.journal = None
+    order_matching.depth_feed = None
+    order_matching.next_order_id = 1
+    order_matching.applied.clear()
+    order_matching.trade_publisher = CountingPublisher()
+    return order_matching.trade_publisher
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_benchmark(orders, measure_memory=True):
+    """Runs orders through the engine and returns a results dict."""
+    process_order = order_matching.process_order
+    clock = time.perf_counter_ns
+
+    publisher = _reset_engine()
+    latencies = []
+    append = latencies.append
+    start = clock()
+    for order in orders:
+        t0 = clock()
+        process_order(order)
+        append(clock() - t0)
+    elapsed = (clock() - start) / 1e9
+    latencies.sort()
+
+    results = {
+        "orders": len(latencies),
+        "seconds": round(elapsed, 6),
+        "orders_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_us": {
+            "p50": _percentile(latencies, 0.50) / 1000,
+            "p99": _percentile(latencies, 0.99) / 1000,
+            "p999": _percentile(latencies, 0.999) / 1000,
+            "max": latencies[-1] / 1000 if latencies else 0,
+        },
+        "fills": publisher.trades,
+        "filled_quantity": publisher.quantity,
+        "resting_orders": sum(len(book.orders) for book in order_matching.order_books.values()),
+        "symbols": len(order_matching.order_books),
+    }
+
+    if measure_memory:
+        # Separate pass: tracemalloc would distort the latency figures above
+        _reset_engine()
+        tracemalloc.start()
+        for order in orders:
+            process_order(order)
+        results["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    _reset_engine()
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change against a baseline; returns False on a regression beyond tolerance."""
+    ok = True
+    old_rate, new_rate = baseline["orders_per_sec"], results["orders_per_sec"]
+    change = (new_rate - old_rate) / old_rate if old_rate else 0.0
+    print(f"throughput: {old_rate:,.0f} -> {new_rate:,.0f} orders/sec ({change:+.1%})")
+    if change < -tolerance:
+        ok = False
+    for key in ("p50", "p99", "p999"):
+        old, new = baseline["latency_us"][key], results["latency_us"][key]
+        change = (new - old) / old if old else 0.0
+        print(f"{key}: {old:.2f} -> {new:.2f} us ({change:+.1%})")
+        if key == "p99" and change > tolerance:
+            ok = False
+    if baseline.get("fills") != results.get("fills"):
+        print(f"fills differ: {baseline.get('fills')} -> {results.get('fills')}")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matching engine benchmark")
+    parser.add_argument("--replay", help="recorded order log (.jsonl, journal segment or .csv)")
+    parser.add_argument("--orders", type=int, default=100000, help="synthetic orders after seeding")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=20, help="seeded price levels per side")
+    parser.add_argument("--cross-rate", type=float, default=0.1)
+    parser.add_argument("--cancel-rate", type=float, default=0.0)
+    parser.add_argument("--price-distribution", choices=["uniform", "normal", "exponential"], default="normal")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed throughput / p99 regression before --compare fails")
+    args = parser.parse_args()
+
+    if args.replay:
+        orders = load_orders(args.replay)
+        workload = {"replay": args.replay}
+    else:
+        orders = list(generate_orders(args.orders, args.seed, args.symbols, args.depth, args.cross_rate,
+                                      args.cancel_rate, args.price_distribution))
+        workload = {"seed": args.seed, "orders": args.orders, "symbols": args.symbols, "depth": args.depth,
+                    "cross_rate": args.cross_rate, "cancel_rate": args.cancel_rate,
+                    "price_distribution": args.price_distribution}
+
+    # process_order logs a warning per reject; keep that out of the timings
+    with metrics.quiet_logging():
+        results = run_benchmark(orders, not args.no_memory)
+
+    results["workload"] = workload
+    results["python"] = platform.python_version()
+    results["revision"] = _git_revision()
+    results["timestamp"] = time.time()
+
+    print(f"{results['orders']:,} orders in {results['seconds']:.3f}s: "
+          f"{results['orders_per_sec']:,.0f} orders/sec, {results['fills']:,} fills")
+    latency = results["latency_us"]
+    print(f"latency us: p50 {latency['p50']:.2f}  p99 {latency['p99']:.2f}  p999 {latency['p999']:.2f}")
+    if "peak_memory_bytes" in results:
+        print(f"peak memory: {results['peak_memory_bytes'] / 1e6:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
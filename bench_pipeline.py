@@ -0,0 +1,183 @@
+"""End-to-end runs of the services on the in-process transport.
+
+Starts order_matching and trade_logging, and optionally the contact
+tracker fed by the population simulator, on threads of this process. They
+all talk through transport's local broker. The run feeds them a synthetic
+order flow and waits until every queue is drained and acked. It reports
+end-to-end throughput and, with --profile, the hottest functions across
+all service threads.
+
+    python bench_pipeline.py --orders 50000 --symbols 20
+    python bench_pipeline.py --orders 20000 --population 20000 --ticks 5 --profile
+"""
+import os
+import io
+import sys
+import math
+import time
+import pstats
+import sqlite3
+import argparse
+import cProfile
+import tempfile
+import threading
+import contextlib
+
+import pika
+
+import metrics
+import transport
+import wire_format
+import order_matching
+import trade_logging
+from order_flow import generate_orders
+from bench_matching import _reset_engine
+
+
+def _start(name, target, profiles, profile, *args, **kwargs):
+    """Runs a service on a daemon thread, optionally under its own profiler."""
+    def run():
+        if not profile:
+            target(*args, **kwargs)
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(target, *args, **kwargs)
+        finally:
+            profiles.append(profiler)
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_idle(broker, timeout, settle=0.05):
+    """Waits until no queue holds ready or unacked messages. Returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if broker.idle():
+            # Services may still be inside a callback that is about to publish
+            time.sleep(settle)
+            if broker.idle():
+                return True
+        time.sleep(0.01)
+    return False
+
+
+def run_pipeline(orders, workdir, population=0, ticks=5, grid=None, journal=False, trade_format="json",
+                 profile=False, timeout=300.0):
+    """Runs orders (and a simulated population) through the services; returns a report dict."""
+    transport.use('local')
+    broker = transport.reset_local()
+    _reset_engine()
+    profiles = []
+    trade_content_type = wire_format.BINARY_CONTENT_TYPE if trade_format == "binary" else wire_format.JSON_CONTENT_TYPE
+    db_path = os.path.join(workdir, 'trading.db')
+    threads = [
+        _start("matching", order_matching.setup_rabbitmq, profiles, profile,
+               journal_dir=os.path.join(workdir, 'journal') if journal else None,
+               trade_content_type=trade_content_type),
+        _start("trade_logging", trade_logging.setup_rabbitmq, profiles, profile, path=db_path),
+    ]
+    if population:
+        import Contact_tracing
+        side = grid or max(10, int(math.sqrt(population * 4)))
+        Contact_tracing.environment_size = (side, side)
+        Contact_tracing.positions.clear()
+        Contact_tracing.cells.clear()
+        threads.append(_start("tracker", Contact_tracing.tracker, profiles, profile))
+
+    connection = transport.connect()
+    channel = connection.channel()
+    channel.queue_declare(queue=order_matching.ORDERS_QUEUE, durable=True)
+    content_type = wire_format.JSON_CONTENT_TYPE
+    properties = pika.BasicProperties(content_type=content_type)
+    started = time.perf_counter()
+    simulator = None
+    if population:
+        # Simulated seconds per tick as in a live run, without waiting for them
+        simulator = _start("simulator", Contact_tracing.simulate, profiles, profile,
+                           population, ticks=ticks, seed=1, paced=False)
+        threads.append(simulator)
+    sent = 0
+    for order in orders:
+        channel.basic_publish(exchange='', routing_key=order_matching.ORDERS_QUEUE,
+                              body=wire_format.encode(order, content_type), properties=properties)
+        sent += 1
+    if simulator is not None:
+        # Queues look idle until the simulator has published its frames
+        simulator.join(timeout)
+    published = time.perf_counter()
+    drained = _wait_idle(broker, timeout)
+    finished = time.perf_counter()
+
+    broker.stop_all()
+    connection.close()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    db = sqlite3.connect(db_path)
+    try:
+        logged = db.execute('SELECT count(*) FROM trades').fetchone()[0]
+    finally:
+        db.close()
+    seconds = finished - started
+    report = {
+        "orders": sent,
+        "trades_logged": logged,
+        "publish_seconds": published - started,
+        "seconds": seconds,
+        "orders_per_sec": sent / seconds if seconds else 0.0,
+        "messages_published": broker.published,
+        "messages_delivered": broker.delivered,
+        "drained": drained,
+    }
+    if population:
+        report["population"] = population
+        report["grid"] = Contact_tracing.environment_size
+        report["tracked"] = len(Contact_tracing.positions)
+    if profiles:
+        report["profiles"] = profiles
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process end-to-end pipeline run")
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--cross-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--journal", action="store_true", help="journal the matching engine (in a temp dir)")
+    parser.add_argument("--trade-format", choices=["json", "binary"], default="json")
+    parser.add_argument("--population", type=int, default=0, help="also run the tracker with this many people")
+    parser.add_argument("--ticks", type=int, default=5, help="simulator ticks with --population")
+    parser.add_argument("--grid", type=int, help="grid side with --population (default: about 4 cells a person)")
+    parser.add_argument("--profile", action="store_true", help="profile every service thread")
+    parser.add_argument("--top", type=int, default=25, help="functions shown with --profile")
+    parser.add_argument("--verbose", action="store_true", help="keep the services' own output")
+    args = parser.parse_args()
+
+    orders = generate_orders(args.orders, seed=args.seed, symbols=args.symbols, cross_rate=args.cross_rate)
+    with tempfile.TemporaryDirectory() as workdir:
+        with contextlib.ExitStack() as quiet:
+            if not args.verbose:
+                # Banners and per-message warnings from the services would be timed too
+                quiet.enter_context(contextlib.redirect_stdout(io.StringIO()))
+                quiet.enter_context(metrics.quiet_logging())
+            report = run_pipeline(orders, workdir, args.population, args.ticks, args.grid, args.journal,
+                                  args.trade_format, args.profile)
+
+    if not report["drained"]:
+        print("Timed out before every queue was drained", file=sys.stderr)
+    print(f"{report['orders']:,} orders -> {report['trades_logged']:,} trades logged in {report['seconds']:.2f}s "
+          f"({report['orders_per_sec']:,.0f} orders/sec end to end; publishing took {report['publish_seconds']:.2f}s)")
+    if "population" in report:
+        grid = report["grid"]
+        print(f"Tracker: {report['tracked']:,} of {report['population']:,} people on a {grid[0]}x{grid[1]} grid")
+    print(f"Broker: {report['messages_published']:,} messages published, {report['messages_delivered']:,} delivered")
+    if "profiles" in report:
+        stats = pstats.Stats(*report["profiles"])
+        stats.sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compares encode/decode cost and message size of the JSON and binary wire formats.
+
+    python bench_wire_format.py --number 200000
+"""
+import json
+import timeit
+import argparse
+
+import wire_format
+
+SAMPLES = {
+    "order": {"type": "buy", "stock": "AAPL", "price": 187.25, "quantity": 300, "id": 1048576},
+    "cancel": {"type": "cancel", "stock": "AAPL", "id": 1048576},
+    "trade": {"stock": "TSLA", "price": 242.5, "quantity": 100, "buy_order_id": 1048577,
+              "sell_order_id": 1048520},
+}
+SAMPLES["trade batch x10"] = [SAMPLES["trade"]] * 10
+
+
+def measure(name, message, number):
+    json_body = json.dumps(message).encode()
+    binary_body = wire_format.encode(message, wire_format.BINARY_CONTENT_TYPE)
+    assert wire_format.decode(binary_body, wire_format.BINARY_CONTENT_TYPE) == json.loads(json_body)
+
+    def per_message_ns(statement):
+        return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e9
+
+    return {
+        "message": name,
+        "json_bytes": len(json_body),
+        "binary_bytes": len(binary_body),
+        "json_encode_ns": per_message_ns(lambda: json.dumps(message).encode()),
+        "binary_encode_ns": per_message_ns(lambda: wire_format.encode(message, wire_format.BINARY_CONTENT_TYPE)),
+        "json_decode_ns": per_message_ns(lambda: wire_format.decode(json_body, wire_format.JSON_CONTENT_TYPE)),
+        "binary_decode_ns": per_message_ns(lambda: wire_format.decode(binary_body,
+                                                                      wire_format.BINARY_CONTENT_TYPE)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wire format microbenchmark")
+    parser.add_argument("--number", type=int, default=100000, help="iterations per timing")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = [measure(name, message, args.number) for name, message in SAMPLES.items()]
+    print(f"{'message':<16}{'bytes json/bin':>16}{'encode ns json/bin':>22}{'decode ns json/bin':>22}")
+    for r in results:
+        print(f"{r['message']:<16}{r['json_bytes']:>8}/{r['binary_bytes']:<7}"
+              f"{r['json_encode_ns']:>12.0f}/{r['binary_encode_ns']:<9.0f}"
+              f"{r['json_decode_ns']:>12.0f}/{r['binary_decode_ns']:<9.0f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
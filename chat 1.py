@@ -1,26 +1,27 @@
 import pika
 import sys
 import threading
-import time
+import transport
+from chat import CHAT_EXCHANGE, HISTORY_ON_JOIN, make_message, encode_message, decode_message, format_message
 
 class ChatApplication:
-    def __init__(self, username, room="general", host="localhost"):
+    def __init__(self, username, room="general", host=None):
         self.username = username
         self.room = room
         self.host = host
         self.should_stop = threading.Event()  # Flag for graceful shutdown
+        self.seen = set()  # ids shown from history, skipped if they also arrive live
         self.setup_rabbitmq()
 
     def setup_rabbitmq(self):
         """Establish RabbitMQ connection and setup exchange/queue"""
         try:
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=self.host))
+            self.connection = transport.connect(self.host)
             self.channel = self.connection.channel()
             
             # Topic exchange for multiple rooms
             self.channel.exchange_declare(
-                exchange="chat_rooms",
+                exchange=CHAT_EXCHANGE,
                 exchange_type="topic",
                 durable=False)  # Changed to non-durable for simplicity
             
@@ -30,32 +31,48 @@ class ChatApplication:
             
             # Bind to specified room
             self.channel.queue_bind(
-                exchange="chat_rooms",
+                exchange=CHAT_EXCHANGE,
                 queue=self.queue_name,
                 routing_key=self.room)
             
+            print(f"\n[{self.username}] Joined room: '{self.room}'")
+            # Bound first, so nothing said while the history is fetched is missed
+            self.show_history()
+            
             # Start message consumer thread
             self.consumer_thread = threading.Thread(
                 target=self.receive_messages,
                 daemon=True)
             self.consumer_thread.start()
             
-            print(f"\n[{self.username}] Joined room: '{self.room}'")
             print("Type messages below (Ctrl+C or /exit to quit):")
             
         except pika.exceptions.AMQPConnectionError as e:
             print(f"Failed to connect to RabbitMQ: {e}")
             sys.exit(1)
 
+    def show_history(self):
+        """Prints the room's recent messages from the history service, if it is running"""
+        from chat_history import fetch_history
+        answer = fetch_history(self.connection, self.channel, {"room": self.room, "last": HISTORY_ON_JOIN})
+        if answer is None or "error" in answer:
+            return
+        for message in answer["messages"]:
+            self.seen.add(message["id"])
+            print(format_message(message))
+
     def receive_messages(self):
         """Handle incoming messages"""
         def callback(ch, method, properties, body):
             if self.should_stop.is_set():
                 return
-            message = body.decode()
+            message = decode_message(body, method.routing_key)
+            if message["id"] in self.seen:
+                self.seen.discard(message["id"])
+                return
             # Skip echoing your own messages
-            if not message.startswith(f"[{self.username}]"):
-                print(f"\r{message}\n> ", end="", flush=True)
+            if message["user"] != self.username:
+                print(f"\r{format_message(message)}\n> ", end="", flush=True)
         
         try:
             self.channel.basic_consume(
@@ -70,12 +87,11 @@ class ChatApplication:
     def send_message(self, message):
         """Publish message to chat room"""
         try:
-            timestamp = time.strftime("%H:%M:%S")
-            formatted_msg = f"[{timestamp}] [{self.username}] {message}"
             self.channel.basic_publish(
-                exchange="chat_rooms",
+                exchange=CHAT_EXCHANGE,
                 routing_key=self.room,
-                body=formatted_msg)
+                properties=pika.BasicProperties(content_type="application/json"),
+                body=encode_message(make_message(self.room, self.username, message)))
         except Exception as e:
             print(f"Failed to send message: {e}")
 
@@ -95,7 +111,7 @@ def main():
     
     username = sys.argv[1]
     room = sys.argv[2] if len(sys.argv) > 2 else "general"
-    host = sys.argv[3] if len(sys.argv) > 3 else "localhost"
+    host = sys.argv[3] if len(sys.argv) > 3 else None
     
     chat = ChatApplication(username, room, host)
     
@@ -1,22 +1,87 @@
 import pika
 import sys
+import json
+import math
+import time
+import uuid
 import threading
+import transport
+
+CHAT_EXCHANGE = 'chat_rooms'
+HISTORY_ON_JOIN = 20  # messages replayed from the history service when joining
+
+def make_message(room, username, text):
+    """A chat message: {"id", "room", "user", "ts", "text"}."""
+    return {"id": uuid.uuid4().hex, "room": room, "user": username, "ts": time.time(), "text": text}
+
+def encode_message(message):
+    return json.dumps(message, separators=(",", ":"))
+
+def decode_message(body, room=None):
+    """Parses a message body; plain-text bodies from older clients become messages with no user.
+
+    `room` (the routing key) overrides any room in the body. A missing or
+    malformed ts becomes the time of receipt, and a user that is not a
+    string becomes None.
+    """
+    text = body.decode() if isinstance(body, bytes) else body
+    if text.startswith("{"):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and "text" in message:
+            message.setdefault("id", uuid.uuid4().hex)
+            if room is not None or not isinstance(message.get("room"), str):
+                message["room"] = room
+            if not isinstance(message.get("user"), str):
+                message["user"] = None
+            ts = message.get("ts")
+            if isinstance(ts, bool) or not isinstance(ts, (int, float)) or not math.isfinite(ts):
+                message["ts"] = time.time()
+            return message
+    return {"id": uuid.uuid4().hex, "room": room, "user": None, "ts": time.time(), "text": text}
+
+def format_message(message):
+    stamp = time.strftime("%H:%M:%S", time.localtime(message["ts"]))
+    if message["user"] is None:
+        return f"[{stamp}] {message['text']}"
+    return f"[{stamp}] [{message['user']}] {message['text']}"
 
 class ChatClient:
-    def __init__(self, username, room="general"):
+    """One user in one room.
+
+    join_room() connects and starts a consumer thread, which hands every
+    message from someone else to receive_callback (a message dict; the
+    default prints it). The connection belongs to the consumer thread, so
+    send_message() and close() hand their work to it with
+    add_callback_threadsafe instead of touching the channel directly.
+    """
+
+    def __init__(self, username, room="general", host=None, port=None):
         self.username = username
         self.room = room
-        self.setup_rabbitmq()
+        self.host = host
+        self.port = port
+        self.receive_callback = self.print_message
+        self.seen = set()  # ids already shown, so replayed history and live messages don't repeat
+        self.connection = None
+        self.consumer_thread = None
         
+    def print_message(self, message):
+        print(f"\r{format_message(message)}\nYou: ", end="", flush=True)
+
+    def join_room(self):
+        self.setup_rabbitmq()
+
     def setup_rabbitmq(self):
         # Connect to RabbitMQ (use 'rabbitmq' when in Docker Compose)
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
+        self.connection = transport.connect(self.host, self.port)
         self.channel = self.connection.channel()
         
         # Create topic exchange
         self.channel.exchange_declare(
-            exchange='chat_rooms', 
+            exchange=CHAT_EXCHANGE,
             exchange_type='topic')
         
         # Create temporary queue
@@ -25,36 +90,59 @@ class ChatClient:
         
         # Bind to room
         self.channel.queue_bind(
-            exchange='chat_rooms',
+            exchange=CHAT_EXCHANGE,
             queue=self.queue_name,
             routing_key=self.room)
         
+        # Bound first, so nothing said while the history is fetched is missed
+        self.show_history()
+        
         # Start message consumer thread
-        threading.Thread(target=self.receive_messages, daemon=True).start()
+        self.consumer_thread = threading.Thread(target=self.receive_messages, daemon=True)
+        self.consumer_thread.start()
+    
+    def show_history(self):
+        from chat_history import fetch_history
+        answer = fetch_history(self.connection, self.channel, {"room": self.room, "last": HISTORY_ON_JOIN})
+        if answer is None or "error" in answer:
+            return  # no history service running
+        for message in answer["messages"]:
+            self.seen.add(message["id"])
+            self.receive_callback(message)
     
     def receive_messages(self):
         def callback(ch, method, properties, body):
-            message = body.decode()
-            if not message.startswith(f"{self.username}:"):
-                print(f"\r{message}\nYou: ", end="", flush=True)
+            message = decode_message(body, method.routing_key)
+            if message["id"] in self.seen:
+                self.seen.discard(message["id"])
+                return
+            if message["user"] != self.username:
+                self.receive_callback(message)
         
         self.channel.basic_consume(
             queue=self.queue_name,
             on_message_callback=callback,
             auto_ack=True)
         
-        print(f"\nJoined room '{self.room}'. Start chatting (Ctrl+C to exit)...")
         self.channel.start_consuming()
     
     def send_message(self, message):
-        full_message = f"{self.username}: {message}"
-        self.channel.basic_publish(
-            exchange='chat_rooms',
+        """Publishes a message from any thread and returns it as a message dict."""
+        message = make_message(self.room, self.username, message)
+        body = encode_message(message)
+        self.connection.add_callback_threadsafe(lambda: self.channel.basic_publish(
+            exchange=CHAT_EXCHANGE,
             routing_key=self.room,
-            body=full_message)
+            properties=pika.BasicProperties(content_type='application/json'),
+            body=body))
+        return message
     
     def close(self):
-        self.connection.close()
+        if self.consumer_thread is not None and self.consumer_thread.is_alive():
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+            self.consumer_thread.join(timeout=2)
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -65,6 +153,8 @@ if __name__ == "__main__":
     room = sys.argv[2] if len(sys.argv) > 2 else "general"
     
     client = ChatClient(username, room)
+    client.join_room()
+    print(f"\nJoined room '{room}'. Start chatting (Ctrl+C to exit)...")
     
     try:
         while True:
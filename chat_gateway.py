@@ -0,0 +1,390 @@
+"""Asyncio chat gateway: many user sessions over a few AMQP connections.
+
+The gateway keeps a small pool of connections and channels. Each room that
+has at least one local session gets exactly one queue bound to the
+chat_rooms exchange, whichever channel the room hashes to. Incoming room
+messages are fanned out to the local sessions in-process through bounded
+asyncio queues. Broker-side state and connection count therefore grow with
+the number of rooms, not with the number of users. Recent room history is
+fetched from the chat_history service over one shared reply queue.
+
+    python chat_gateway.py chat alice general
+    python chat_gateway.py demo --users 2000 --rooms 50
+"""
+import sys
+import json
+import time
+import uuid
+import zlib
+import asyncio
+import argparse
+import threading
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+import transport
+from chat import CHAT_EXCHANGE, make_message, encode_message, decode_message, format_message
+from chat_history import HISTORY_REQUESTS
+
+SESSION_BACKLOG = 1000  # messages buffered per session before the oldest are dropped
+JSON_PROPERTIES = pika.BasicProperties(content_type='application/json')
+
+
+def _waiter(loop):
+    """A future plus a pika-style callback that resolves it with the callback's first argument."""
+    future = loop.create_future()
+
+    def done(result=None, *args):
+        if not future.done():
+            future.set_result(result)
+    return future, done
+
+
+class Room:
+    __slots__ = ("name", "channel", "queue", "consumer_tag", "sessions", "ready")
+
+    def __init__(self, name, channel):
+        self.name = name
+        self.channel = channel
+        self.queue = None
+        self.consumer_tag = None
+        self.sessions = set()
+        self.ready = None
+
+
+class ChatSession:
+    """One user's view of the gateway.
+
+    Message dicts from the user's rooms are read with receive() or
+    `async for message in session`. A session that falls more
+    than `backlog` messages behind loses the oldest ones instead of
+    holding up the rest of the room.
+    """
+
+    def __init__(self, gateway, username, backlog=SESSION_BACKLOG):
+        self.gateway = gateway
+        self.username = username
+        self.rooms = set()
+        self.inbox = asyncio.Queue(backlog)
+        self.dropped = 0
+
+    def deliver(self, message):
+        if message["user"] == self.username:
+            return  # skip echoing your own messages
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            self.dropped += 1
+        self.inbox.put_nowait(message)
+
+    async def join(self, room):
+        await self.gateway.join(self, room)
+
+    async def leave(self, room):
+        await self.gateway.leave(self, room)
+
+    def send(self, room, text):
+        message = make_message(room, self.username, text)
+        self.gateway.publish(room, encode_message(message))
+        return message
+
+    async def history(self, room, last=50, before=None):
+        """The last messages of a room, oldest first; see ChatGateway.history."""
+        return await self.gateway.history({"room": room, "last": last, "before": before})
+
+    async def receive(self):
+        """Waits for the next message dict."""
+        return await self.inbox.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.receive()
+
+    async def close(self):
+        for room in list(self.rooms):
+            await self.leave(room)
+
+
+class ChatGateway:
+    """Hosts chat sessions over `connections` x `channels_per_connection` AMQP channels.
+
+    Use as `async with ChatGateway() as gateway:` and create sessions with
+    gateway.session(username).
+    """
+
+    def __init__(self, host=None, connections=2, channels_per_connection=4):
+        self.host = host
+        self.connection_count = connections
+        self.channels_per_connection = channels_per_connection
+        self.connections = []
+        self.channels = []
+        self.rooms = {}
+        self.replies = {}  # correlation id -> future of a history request
+        self.reply_queue = None
+        self.published = 0
+        self.received = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _connect(self, loop):
+        future = loop.create_future()
+
+        def opened(connection):
+            if not future.done():
+                future.set_result(connection)
+
+        def failed(connection, error):
+            if not future.done():
+                future.set_exception(pika.exceptions.AMQPConnectionError(error))
+
+        def closed(connection, reason):
+            if connection in self.connections:
+                print(f"Gateway connection closed: {reason}")
+
+        AsyncioConnection(transport.parameters(self.host), on_open_callback=opened,
+                          on_open_error_callback=failed, on_close_callback=closed, custom_ioloop=loop)
+        return future
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(self.connection_count):
+            connection = await self._connect(loop)
+            self.connections.append(connection)
+            for _ in range(self.channels_per_connection):
+                future, done = _waiter(loop)
+                connection.channel(on_open_callback=done)
+                self.channels.append(await future)
+        future, done = _waiter(loop)
+        self.channels[0].exchange_declare(exchange=CHAT_EXCHANGE, exchange_type='topic', callback=done)
+        await future
+        future, done = _waiter(loop)
+        self.channels[0].queue_declare(queue='', exclusive=True, auto_delete=True, callback=done)
+        self.reply_queue = (await future).method.queue
+        future, done = _waiter(loop)
+        self.channels[0].basic_consume(queue=self.reply_queue, auto_ack=True, callback=done,
+                                       on_message_callback=self._on_reply)
+        await future
+
+    def _channel_for(self, room):
+        # A room always uses the same channel, so its messages stay in order
+        return self.channels[zlib.crc32(room.encode()) % len(self.channels)]
+
+    def session(self, username, backlog=SESSION_BACKLOG):
+        return ChatSession(self, username, backlog)
+
+    def _dispatch(self, room, body):
+        self.received += 1
+        message = decode_message(body, room.name)
+        for session in list(room.sessions):
+            session.deliver(message)
+
+    def _on_reply(self, ch, method, properties, body):
+        future = self.replies.pop(properties.correlation_id, None)
+        if future is not None and not future.done():
+            future.set_result(json.loads(body))
+
+    async def history(self, request, timeout=2.0):
+        """Sends a replay request (see chat_history) and returns its messages.
+
+        Returns an empty list if the history service does not answer in time.
+        """
+        correlation_id = uuid.uuid4().hex
+        future = self.replies[correlation_id] = asyncio.get_running_loop().create_future()
+        self.channels[0].basic_publish(
+            exchange='', routing_key=HISTORY_REQUESTS, body=json.dumps(request),
+            properties=pika.BasicProperties(reply_to=self.reply_queue, correlation_id=correlation_id))
+        try:
+            answer = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.replies.pop(correlation_id, None)
+            return []
+        return answer.get("messages", [])
+
+    async def _subscribe(self, room):
+        loop = asyncio.get_running_loop()
+        future, done = _waiter(loop)
+        room.channel.queue_declare(queue='', exclusive=True, auto_delete=True, callback=done)
+        room.queue = (await future).method.queue
+        future, done = _waiter(loop)
+        room.channel.queue_bind(queue=room.queue, exchange=CHAT_EXCHANGE, routing_key=room.name, callback=done)
+        await future
+        future, done = _waiter(loop)
+        room.consumer_tag = room.channel.basic_consume(
+            queue=room.queue, auto_ack=True, callback=done,
+            on_message_callback=lambda ch, method, properties, body: self._dispatch(room, body))
+        await future
+
+    async def _unsubscribe(self, room):
+        loop = asyncio.get_running_loop()
+        future, done = _waiter(loop)
+        room.channel.basic_cancel(room.consumer_tag, callback=done)
+        await future
+        future, done = _waiter(loop)
+        room.channel.queue_delete(queue=room.queue, callback=done)
+        await future
+
+    async def join(self, session, name):
+        room = self.rooms.get(name)
+        if room is None:
+            # The first local member subscribes the room; everyone else shares its queue
+            room = self.rooms[name] = Room(name, self._channel_for(name))
+            room.ready = asyncio.ensure_future(self._subscribe(room))
+            room.ready.add_done_callback(lambda ready: self._forget_failed(room, ready))
+        room.sessions.add(session)
+        session.rooms.add(name)
+        try:
+            await room.ready
+        except BaseException:
+            room.sessions.discard(session)
+            session.rooms.discard(name)
+            raise
+
+    def _forget_failed(self, room, ready):
+        # A failed subscription must not stay cached, or every later join to the room would fail too
+        if (ready.cancelled() or ready.exception() is not None) and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+
+    async def leave(self, session, name):
+        room = self.rooms.get(name)
+        session.rooms.discard(name)
+        if room is None or session not in room.sessions:
+            return
+        room.sessions.discard(session)
+        if not room.sessions:
+            del self.rooms[name]
+            await room.ready
+            await self._unsubscribe(room)
+
+    def publish(self, room, body):
+        self._channel_for(room).basic_publish(exchange=CHAT_EXCHANGE, routing_key=room, body=body,
+                                              properties=JSON_PROPERTIES)
+        self.published += 1
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        waiters = []
+        connections, self.connections = self.connections, []
+        for connection in connections:
+            if connection.is_open:
+                future, done = _waiter(loop)
+                connection.add_on_close_callback(done)
+                connection.close()
+                waiters.append(future)
+        await asyncio.gather(*waiters)
+        self.channels = []
+        self.rooms = {}
+
+
+async def chat(username, room, host):
+    """Interactive chat with one session, like chat.py."""
+    loop = asyncio.get_running_loop()
+    async with ChatGateway(host, connections=1, channels_per_connection=1) as gateway:
+        session = gateway.session(username)
+        await session.join(room)
+        shown = set()
+        for message in await session.history(room, 20):
+            shown.add(message["id"])
+            print(format_message(message))
+        print(f"Joined room '{room}'. Start chatting (Ctrl+C to exit)...")
+
+        async def show():
+            async for message in session:
+                if message["id"] in shown:
+                    shown.discard(message["id"])
+                    continue
+                print(f"\r{format_message(message)}\nYou: ", end="", flush=True)
+        printer = asyncio.ensure_future(show())
+        lines = asyncio.Queue()
+
+        def read_stdin():
+            # A daemon thread rather than an executor, so a pending input() never blocks shutdown
+            try:
+                while True:
+                    line = input("You: ")
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+            except (EOFError, KeyboardInterrupt):
+                try:
+                    loop.call_soon_threadsafe(lines.put_nowait, None)
+                except RuntimeError:
+                    pass  # the loop is already closed
+            except RuntimeError:
+                pass  # the loop closed while a line was being read
+        threading.Thread(target=read_stdin, name="chat-stdin", daemon=True).start()
+        try:
+            while True:
+                message = await lines.get()
+                if message is None:
+                    break
+                session.send(room, message)
+        finally:
+            printer.cancel()
+
+
+async def demo(users, rooms, messages, host, connections, channels):
+    """Hosts `users` sessions spread over `rooms` rooms and has each send `messages` messages."""
+    async with ChatGateway(host, connections, channels) as gateway:
+        sessions = [gateway.session(f"user{i}") for i in range(users)]
+        started = time.perf_counter()
+        await asyncio.gather(*(session.join(f"room{i % rooms}") for i, session in enumerate(sessions)))
+        print(f"{users} sessions joined {len(gateway.rooms)} rooms over {len(gateway.connections)} connections "
+              f"and {len(gateway.channels)} channels in {time.perf_counter() - started:.2f}s")
+
+        members = [0] * rooms
+        for i in range(users):
+            members[i % rooms] += 1
+        expected = sum(messages * n * (n - 1) for n in members)  # everyone but the sender
+        started = time.perf_counter()
+        for n in range(messages):
+            for i, session in enumerate(sessions):
+                session.send(f"room{i % rooms}", f"message {n}")
+        delivered = 0
+        last_progress = time.perf_counter()
+        while delivered < expected and time.perf_counter() - last_progress < 5:
+            await asyncio.sleep(0.05)
+            for session in sessions:
+                while not session.inbox.empty():
+                    session.inbox.get_nowait()
+                    delivered += 1
+                    last_progress = time.perf_counter()
+        elapsed = time.perf_counter() - started
+        dropped = sum(session.dropped for session in sessions)
+        print(f"Published {gateway.published}, received {gateway.received} from the broker, "
+              f"delivered {delivered} of {expected} to sessions ({dropped} dropped) in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio chat gateway")
+    parser.add_argument("--host", help="RabbitMQ host (default: $RABBITMQ_HOST or localhost)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    chat_parser = commands.add_parser("chat", help="chat interactively as one user")
+    chat_parser.add_argument("username")
+    chat_parser.add_argument("room", nargs="?", default="general")
+    demo_parser = commands.add_parser("demo", help="host many simulated sessions")
+    demo_parser.add_argument("--users", type=int, default=1000)
+    demo_parser.add_argument("--rooms", type=int, default=20)
+    demo_parser.add_argument("--messages", type=int, default=5, help="messages sent by each user")
+    demo_parser.add_argument("--connections", type=int, default=2)
+    demo_parser.add_argument("--channels", type=int, default=4, help="channels per connection")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "chat":
+            asyncio.run(chat(args.username, args.room, args.host))
+        else:
+            asyncio.run(demo(args.users, args.rooms, args.messages, args.host, args.connections, args.channels))
+    except KeyboardInterrupt:
+        print("\nDisconnecting...")
+    except pika.exceptions.AMQPConnectionError as e:
+        print(f"Failed to connect to RabbitMQ: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 import tkinter as tk
 from tkinter import scrolledtext
-from chat import ChatApplication  # Your existing chat implementation
+import queue
+from chat import ChatClient, format_message  # Your existing chat implementation
 
 class ChatGUI:
-    def __init__(self, username, room_name, host='localhost', port=5672):
-        self.chat = ChatApplication(username, room_name, host, port)
+    MAX_FPS = 20           # cap on how often the message area is updated
+    MAX_LINES = 2000       # scrollback kept in the message area
+
+    def __init__(self, username, room_name, host=None, port=None):
+        self.chat = ChatClient(username, room_name, host, port)
+        # The consumer thread only queues lines; Tk is touched from its own thread alone
+        self.incoming = queue.Queue()
         self.root = tk.Tk()
         self.setup_ui()
-        self.chat.receive_callback = self.display_message
+        self.chat.receive_callback = lambda message: self.incoming.put(format_message(message))
         self.chat.join_room()
         
     def setup_ui(self):
-        self.root.title(f"Chat - {self.chat.username}")
+        self.root.title(f"Chat - {self.chat.username} in {self.chat.room}")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
         # Message display
         self.message_area = scrolledtext.ScrolledText(self.root, state='disabled')
@@ -31,12 +38,39 @@ class ChatGUI:
             self.entry.delete(0, tk.END)
             
     def display_message(self, message):
-        self.message_area.config(state='normal')
-        self.message_area.insert(tk.END, message + "\n")
-        self.message_area.config(state='disabled')
-        self.message_area.see(tk.END)
+        self.incoming.put(message)
+        
+    def drain(self):
+        """Returns the lines queued since the last frame, at most MAX_LINES of them."""
+        lines = []
+        while True:
+            try:
+                lines.append(self.incoming.get_nowait())
+            except queue.Empty:
+                return lines[-self.MAX_LINES:]
+        
+    def refresh(self):
+        # All lines that arrived since the last frame go in with one insert
+        lines = self.drain()
+        if lines:
+            at_bottom = self.message_area.yview()[1] >= 1.0
+            self.message_area.config(state='normal')
+            self.message_area.insert(tk.END, "\n".join(lines) + "\n")
+            excess = int(self.message_area.index('end-1c').split('.')[0]) - 1 - self.MAX_LINES
+            if excess > 0:
+                self.message_area.delete('1.0', f'{excess + 1}.0')
+            self.message_area.config(state='disabled')
+            if at_bottom:
+                # Only follow new messages if the user hasn't scrolled up to read
+                self.message_area.see(tk.END)
+        self.root.after(1000 // self.MAX_FPS, self.refresh)
+        
+    def close(self):
+        self.chat.close()
+        self.root.destroy()
         
     def run(self):
+        self.refresh()
         self.root.mainloop()
 
 if __name__ == "__main__":
@@ -47,8 +81,8 @@ if __name__ == "__main__":
         
     username = sys.argv[1]
     room_name = sys.argv[2]
-    host = sys.argv[3] if len(sys.argv) > 3 else 'localhost'
-    port = int(sys.argv[4]) if len(sys.argv) > 4 else 5672
+    host = sys.argv[3] if len(sys.argv) > 3 else None
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else None
     
     gui = ChatGUI(username, room_name, host, port)
     gui.run()
@@ -0,0 +1,374 @@
+"""Chat room history: a bounded in-memory ring per room over an append-only log.
+
+Every message published to the chat_rooms exchange is appended to one
+shared log file (one JSON message per line) and gets the next sequence
+number of its room. Each room has an offset index file of fixed-size
+(log offset, message id) records, so any message of a room is one seek
+away. The last ring_size messages of every room are also kept in memory.
+Message ids older than the ring are looked up in ids.db, a SQLite table of
+(room, message id) -> seq that is rebuilt from the index files whenever it
+falls behind them. Replays are served from the ring when they fit and from
+the index otherwise, in time proportional to the page, never by scanning
+the log.
+
+Replay requests go to the chat_history_requests queue, and the answer is
+sent to their reply_to queue:
+    {"room": "general", "last": 50}                  the newest 50 messages
+    {"room": "general", "last": 50, "before": id}    the 50 before message id
+    {"room": "general", "since": id, "limit": 50}    up to 50 after message id
+
+    python chat_history.py serve
+    python chat_history.py last general 20
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import struct
+import sqlite3
+import argparse
+from array import array
+from collections import deque
+from urllib.parse import quote, unquote
+
+import pika
+
+import transport
+from chat import CHAT_EXCHANGE, decode_message
+
+HISTORY_QUEUE = 'chat_history'
+HISTORY_REQUESTS = 'chat_history_requests'
+HISTORY_DIR = 'chat_history'
+RING_SIZE = 500
+PAGE_LIMIT = 500  # most messages returned by one request
+INDEX_RECORD = struct.Struct('<Q16s')  # log offset, message id (uuid bytes)
+
+
+def _id_bytes(message_id):
+    return uuid.UUID(message_id).bytes
+
+
+class RoomHistory:
+    __slots__ = ("name", "offsets", "ids", "ring", "index")
+
+    def __init__(self, name, ring_size):
+        self.name = name
+        self.offsets = array('Q')  # seq -> log offset
+        self.ids = {}  # message id -> seq, for the messages in the ring
+        self.ring = deque(maxlen=ring_size)  # (seq, message) for the newest messages
+        self.index = None
+
+
+class ChatHistory:
+    """Stores chat messages and answers replay requests."""
+
+    def __init__(self, directory=HISTORY_DIR, ring_size=RING_SIZE):
+        self.directory = directory
+        self.ring_size = ring_size
+        self.rooms = {}
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, 'messages.log')
+        self.log = open(self.log_path, 'ab')
+        self.reader = open(self.log_path, 'rb')
+        self.unflushed = False
+        self.seqs = sqlite3.connect(os.path.join(directory, 'ids.db'))
+        # ids.db is repaired from the index files on startup, so it need not survive a power loss
+        self.seqs.execute('PRAGMA journal_mode=WAL')
+        self.seqs.execute('PRAGMA synchronous=OFF')
+        self.seqs.execute('CREATE TABLE IF NOT EXISTS ids (room TEXT, id BLOB, seq INTEGER, '
+                          'PRIMARY KEY (room, id)) WITHOUT ROWID')
+        self.pending_ids = []  # (room, id bytes, seq) not yet in ids.db
+        self.recover()
+
+    def _index_path(self, room):
+        return os.path.join(self.directory, quote(room, safe='') + '.idx')
+
+    def _room(self, name):
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = RoomHistory(name, self.ring_size)
+            room.index = open(self._index_path(name), 'ab')
+        return room
+
+    def recover(self):
+        """Loads every room index, then indexes any log lines the indexes are missing.
+
+        Index files are flushed independently, so one room's index can lag
+        behind another's. The log is rescanned from the lowest last offset
+        of any room (from the start if an index is empty), and a line is
+        only indexed if it lies past its own room's last record. ids.db
+        drops ids the indexes lost and is refilled from any index it lags.
+        """
+        log_size = os.path.getsize(self.log_path)
+        scan_from = None
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.idx'):
+                continue
+            path = os.path.join(self.directory, filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_RECORD.size
+            room = self._room(unquote(filename[:-len('.idx')]))
+            raw_ids = []
+            for offset, raw_id in INDEX_RECORD.iter_unpack(data[:usable]):
+                if offset >= log_size:
+                    usable = len(room.offsets) * INDEX_RECORD.size
+                    break
+                room.offsets.append(offset)
+                raw_ids.append(raw_id)
+            if usable != len(data):
+                # A torn record, or records for log lines that never made it to disk
+                with open(path, 'r+b') as f:
+                    f.truncate(usable)
+            with self.seqs:
+                self.seqs.execute('DELETE FROM ids WHERE room = ? AND seq >= ?', (room.name, len(raw_ids)))
+                known, = self.seqs.execute('SELECT count(*) FROM ids WHERE room = ?', (room.name,)).fetchone()
+                if known < len(raw_ids):
+                    self.seqs.executemany('INSERT OR REPLACE INTO ids VALUES (?, ?, ?)',
+                                          ((room.name, raw_id, seq) for seq, raw_id in enumerate(raw_ids)))
+            for seq in range(max(0, len(room.offsets) - self.ring_size), len(room.offsets)):
+                message = self._read(room, seq)
+                room.ids[message['id']] = seq
+                room.ring.append((seq, message))
+            last_offset = room.offsets[-1] if room.offsets else 0
+            scan_from = last_offset if scan_from is None else min(scan_from, last_offset)
+        if log_size:
+            self.reader.seek(scan_from or 0)
+            tail = self.reader.tell()
+            for line in self.reader:
+                if not line.endswith(b'\n'):
+                    # Torn final line: drop it
+                    self.log.truncate(tail)
+                    self.log.seek(tail)
+                    break
+                message = json.loads(line)
+                room = self.rooms.get(message['room'])
+                if room is None or not room.offsets or tail > room.offsets[-1]:
+                    self._index(message, tail)
+                tail += len(line)
+            self.flush()
+
+    def _index(self, message, offset):
+        room = self._room(message['room'])
+        seq = len(room.offsets)
+        room.offsets.append(offset)
+        room.ids[message['id']] = seq
+        raw_id = _id_bytes(message['id'])
+        room.index.write(INDEX_RECORD.pack(offset, raw_id))
+        self.pending_ids.append((room.name, raw_id, seq))
+        message['seq'] = seq
+        if room.ring and len(room.ring) == room.ring.maxlen:
+            # ids only covers the ring; older ids are looked up in ids.db
+            room.ids.pop(room.ring[0][1]['id'], None)
+        room.ring.append((seq, message))
+        return seq
+
+    def append(self, message):
+        """Appends a message dict and returns its sequence number in its room."""
+        try:
+            _id_bytes(message['id'])
+        except (KeyError, TypeError, ValueError):
+            message = dict(message, id=uuid.uuid4().hex)
+        room = self.rooms.get(message['room'])
+        if room is not None and message['id'] in room.ids:
+            return room.ids[message['id']]  # redelivered
+        message = {key: message[key] for key in ('id', 'room', 'user', 'ts', 'text')}
+        offset = self.log.tell()
+        self.log.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        self.unflushed = True
+        return self._index(message, offset)
+
+    def flush(self):
+        """Writes buffered messages and index records to disk."""
+        self.log.flush()
+        for room in self.rooms.values():
+            room.index.flush()
+        if self.pending_ids:
+            with self.seqs:
+                self.seqs.executemany('INSERT OR REPLACE INTO ids VALUES (?, ?, ?)', self.pending_ids)
+            self.pending_ids = []
+        self.unflushed = False
+
+    def _read(self, room, seq):
+        if self.unflushed:
+            self.flush()
+        self.reader.seek(room.offsets[seq])
+        message = json.loads(self.reader.readline())
+        message['seq'] = seq
+        return message
+
+    def _seq_of(self, room, message_id):
+        """Sequence number of a message id in a room; raises KeyError if it is not there."""
+        seq = room.ids.get(message_id)
+        if seq is not None:
+            return seq
+        # Older than the ring
+        raw_id = _id_bytes(message_id)
+        if self.unflushed:
+            self.flush()
+        row = self.seqs.execute('SELECT seq FROM ids WHERE room = ? AND id = ?', (room.name, raw_id)).fetchone()
+        if row is None:
+            raise KeyError(message_id)
+        return row[0]
+
+    def _page(self, room, start, end):
+        """Messages start..end-1 of a room, from the ring where possible."""
+        ring_start = room.ring[0][0] if room.ring else len(room.offsets)
+        if start >= ring_start:
+            return [room.ring[seq - ring_start][1] for seq in range(start, end)]
+        return [self._read(room, seq) for seq in range(start, end)]
+
+    def last(self, room_name, count, before=None):
+        """The newest `count` messages, or the `count` before message id `before`, oldest first."""
+        room = self.rooms.get(room_name)
+        if room is None:
+            return [], False
+        end = len(room.offsets) if before is None else self._seq_of(room, before)
+        start = max(0, end - min(count, PAGE_LIMIT))
+        return self._page(room, start, end), start > 0
+
+    def since(self, room_name, message_id, limit):
+        """Up to `limit` messages after message id `message_id`, oldest first."""
+        room = self.rooms.get(room_name)
+        if room is None:
+            return [], False
+        start = self._seq_of(room, message_id) + 1
+        end = min(len(room.offsets), start + min(limit, PAGE_LIMIT))
+        return self._page(room, start, end), end < len(room.offsets)
+
+    def answer(self, request):
+        """Answers a replay request dict; malformed requests get {'error': ...}."""
+        if not isinstance(request, dict) or not isinstance(request.get('room'), str):
+            return {'error': "A history request needs a 'room'"}
+        room = request['room']
+        for key in ('last', 'limit'):
+            if key in request and (isinstance(request[key], bool) or not isinstance(request[key], int)):
+                return {'room': room, 'error': f"'{key}' must be an integer"}
+        for key in ('before', 'since'):
+            if request.get(key) is not None and not isinstance(request[key], str):
+                return {'room': room, 'error': f"'{key}' must be a message id"}
+        try:
+            if request.get('since') is not None:
+                messages, more = self.since(room, request['since'], request.get('limit', PAGE_LIMIT))
+            else:
+                messages, more = self.last(room, request.get('last', 50), request.get('before'))
+        except KeyError as e:
+            return {'room': room, 'error': f"Unknown message id: {e.args[0]}"}
+        except ValueError:
+            return {'room': room, 'error': "Malformed message id"}
+        return {'room': room, 'messages': messages, 'more': more}
+
+    def close(self):
+        self.flush()
+        self.log.close()
+        self.reader.close()
+        self.seqs.close()
+        for room in self.rooms.values():
+            room.index.close()
+
+
+def declare_history(channel):
+    """Declares the history queue (bound to every room) and the request queue."""
+    channel.exchange_declare(exchange=CHAT_EXCHANGE, exchange_type='topic')
+    channel.queue_declare(queue=HISTORY_QUEUE, durable=True)
+    channel.queue_bind(exchange=CHAT_EXCHANGE, queue=HISTORY_QUEUE, routing_key='#')
+    channel.queue_declare(queue=HISTORY_REQUESTS)
+
+
+def fetch_history(connection, channel, request, timeout=2.0):
+    """Sends one replay request and waits for the answer on a private queue.
+
+    Returns the answer dict, or None if the history service did not reply in time.
+    """
+    reply = transport.call(connection, channel, HISTORY_REQUESTS, json.dumps(request), timeout)
+    return json.loads(reply[1]) if reply is not None else None
+
+
+def serve(host=None, directory=HISTORY_DIR, flush_delay=0.2):
+    """Runs the history service: records every room message and answers replay requests."""
+    history = ChatHistory(directory)
+    connection = transport.connect(host)
+    channel = connection.channel()
+    declare_history(channel)
+    transport.set_prefetch(channel, 1000)
+    pending = []
+
+    def on_message(ch, method, properties, body):
+        history.append(decode_message(body, method.routing_key))
+        pending.append(method.delivery_tag)
+
+    def flush_and_ack():
+        # Messages are acked only after they are in the log
+        if pending:
+            history.flush()
+            channel.basic_ack(delivery_tag=pending[-1], multiple=True)
+            pending.clear()
+
+    def on_request(ch, method, properties, body):
+        flush_and_ack()
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            request = None
+            print(f"Malformed history request {body!r}: {e}")
+        answer = history.answer(request)
+        if properties.reply_to:
+            channel.basic_publish(exchange='', routing_key=properties.reply_to, body=json.dumps(answer),
+                                  properties=pika.BasicProperties(correlation_id=properties.correlation_id))
+
+    def flush_timer():
+        flush_and_ack()
+        connection.call_later(flush_delay, flush_timer)
+
+    channel.basic_consume(queue=HISTORY_QUEUE, on_message_callback=on_message)
+    channel.basic_consume(queue=HISTORY_REQUESTS, on_message_callback=on_request, auto_ack=True)
+    connection.call_later(flush_delay, flush_timer)
+    print(f"History service running ({sum(len(r.offsets) for r in history.rooms.values())} "
+          f"messages in {len(history.rooms)} rooms)...")
+    try:
+        channel.start_consuming()
+    finally:
+        if connection.is_open:
+            flush_and_ack()
+            connection.close()
+        history.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat room history service")
+    parser.add_argument("--host", help="RabbitMQ host (default: $RABBITMQ_HOST or localhost)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the history service")
+    serve_parser.add_argument("--dir", default=HISTORY_DIR)
+    last_parser = commands.add_parser("last", help="print the newest messages of a room")
+    last_parser.add_argument("room")
+    last_parser.add_argument("count", type=int, nargs="?", default=20)
+    last_parser.add_argument("--before", help="message id to page back from")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            serve(args.host, args.dir)
+        except KeyboardInterrupt:
+            pass
+        return
+    connection = transport.connect(args.host)
+    try:
+        answer = fetch_history(connection, connection.channel(),
+                               {'room': args.room, 'last': args.count, 'before': args.before})
+    finally:
+        connection.close()
+    if answer is None:
+        print("History service did not reply")
+        sys.exit(1)
+    if 'error' in answer:
+        print(answer['error'])
+        sys.exit(1)
+    for message in answer['messages']:
+        stamp = time.strftime("%H:%M:%S", time.localtime(message['ts']))
+        print(f"{message['id']}  [{stamp}] [{message['user']}] {message['text']}")
+
+
+if __name__ == "__main__":
+    main()
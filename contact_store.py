@@ -0,0 +1,224 @@
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+class ContactHistory:
+    """Closed contact intervals of one person, in the order they ended."""
+    __slots__ = ("ends", "intervals")
+
+    def __init__(self):
+        self.ends = []
+        self.intervals = []
+
+    def append(self, other_id, start, end):
+        if self.ends and end < self.ends[-1]:
+            # Closed after the fact (an idle sweep), so it may belong before later ends
+            index = bisect_right(self.ends, end)
+            self.ends.insert(index, end)
+            self.intervals.insert(index, (other_id, start, end))
+            return
+        self.ends.append(end)
+        self.intervals.append((other_id, start, end))
+
+    def evict(self, cutoff):
+        """Drops intervals that ended before cutoff."""
+        index = bisect_left(self.ends, cutoff)
+        if index:
+            del self.ends[:index]
+            del self.intervals[:index]
+
+    def since(self, start_time):
+        """Intervals that ended at or after start_time, most recent first."""
+        index = bisect_left(self.ends, start_time)
+        return self.intervals[index:][::-1]
+
+
+class ContactStore:
+    """Contact history kept as (other_id, start, end) intervals.
+
+    While two people stay in contact their interval stays open and each
+    update only moves its end forward. An interval is closed when an update
+    shows they are apart again, or by a periodic sweep once one of the two
+    has sent no update for `idle_timeout` seconds (it then ends when the
+    contact was last confirmed). Closed intervals are stored per person in
+    end-time order, so "contacts since T" is a bisection. Intervals that
+    ended more than `retention` seconds ago are evicted, which keeps memory
+    proportional to the people seen within idle_timeout, their active
+    contacts and the retention window, not to the number of position
+    messages.
+
+    If `on_idle` is set, the sweep calls it with the ids of the people it
+    found idle, so an owner can forget their positions as well.
+    """
+
+    def __init__(self, retention=14 * 24 * 3600, idle_timeout=600):
+        self.retention = retention
+        self.idle_timeout = idle_timeout
+        self.active = {}   # person -> {other: [start, end]}
+        self.history = {}  # person -> ContactHistory
+        self.last_seen = {}  # person -> time of their last update
+        self.last_sweep = None
+        self.on_idle = None
+        self.version = 0  # bumped whenever an interval opens or closes
+
+    def _close(self, person_id, other_id, interval, end):
+        self.version += 1
+        start, _ = interval
+        for a, b in ((person_id, other_id), (other_id, person_id)):
+            history = self.history.get(a)
+            if history is None:
+                history = self.history[a] = ContactHistory()
+            history.append(b, start, end)
+            others = self.active.get(a)
+            if others is not None:
+                others.pop(b, None)
+                if not others:
+                    del self.active[a]
+
+    def update(self, person_id, contacted, now, seen=True):
+        """Records that person_id is currently in contact with exactly `contacted`.
+
+        With seen=False the update only refreshes contacts and does not
+        count as word from the person for the idle sweep.
+        Returns the ids whose contact with person_id just started.
+        """
+        if seen:
+            self.last_seen[person_id] = now
+        started = []
+        contacted = set(contacted)
+        others = self.active.get(person_id)
+        if others:
+            for other_id in [o for o in others if o not in contacted]:
+                self._close(person_id, other_id, others[other_id], now)
+            others = self.active.get(person_id)
+        for other_id in contacted:
+            if others is not None and other_id in others:
+                others[other_id][1] = now
+                continue
+            self.version += 1
+            interval = [now, now]
+            # Both sides share one interval object so either update extends it
+            self.active.setdefault(person_id, {})[other_id] = interval
+            self.active.setdefault(other_id, {})[person_id] = interval
+            others = self.active[person_id]
+            started.append(other_id)
+        if self.last_sweep is None or now - self.last_sweep >= min(self.retention / 10, self.idle_timeout / 2):
+            self.sweep(now)
+        return started
+
+    def query(self, person_id, since=None):
+        """Contacts of a person as [(other_id, start, end)], most recent first.
+
+        Open intervals come first. With `since`, only contacts that
+        lasted until `since` or later are returned.
+        """
+        result = []
+        others = self.active.get(person_id)
+        if others:
+            for other_id, (start, end) in sorted(others.items(), key=lambda item: item[1][1], reverse=True):
+                if since is None or end >= since:
+                    result.append((other_id, start, end))
+        history = self.history.get(person_id)
+        if history is not None:
+            result.extend(history.since(since) if since is not None else history.intervals[::-1])
+        return result
+
+    def trace(self, start_ids, since=None, hops=2):
+        """Time-respecting breadth-first trace over the contact graph.
+
+        Starting from start_ids at time `since`, a contact (other, start,
+        end) of a reached person can only pass exposure on if it ended at
+        or after that person was reached, and reaches `other` at
+        max(start, reach time). Returns {person_id: (hop, reach time, via)}
+        for everyone reached within `hops` steps, excluding the start ids.
+        """
+        since = float("-inf") if since is None else since
+        reached = {person_id: (0, since, None) for person_id in start_ids}
+        frontier = {person_id: since for person_id in start_ids}
+        for hop in range(1, hops + 1):
+            next_frontier = {}
+            for person_id, reach_time in frontier.items():
+                for other_id, start, end in self.query(person_id, reach_time):
+                    other_time = max(start, reach_time)
+                    best = reached.get(other_id)
+                    if best is None or other_time < best[1]:
+                        # hop, time and via always describe the same path
+                        reached[other_id] = (hop, other_time, person_id)
+                        next_frontier[other_id] = other_time
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        for person_id in start_ids:
+            reached.pop(person_id, None)
+        return reached
+
+    def sweep(self, now):
+        """Closes the contacts of people idle for idle_timeout and evicts old history.
+
+        Returns the ids of the people found idle; they are forgotten until
+        they send another update.
+        """
+        cutoff = now - self.idle_timeout
+        idle = [person_id for person_id, seen in self.last_seen.items() if seen < cutoff]
+        for person_id in idle:
+            del self.last_seen[person_id]
+            others = self.active.get(person_id)
+            if others:
+                for other_id, interval in list(others.items()):
+                    self._close(person_id, other_id, interval, interval[1])
+        self.evict(now)
+        if idle and self.on_idle is not None:
+            self.on_idle(idle)
+        return idle
+
+    def evict(self, now):
+        """Drops closed intervals older than the retention window."""
+        cutoff = now - self.retention
+        for person_id in list(self.history):
+            history = self.history[person_id]
+            history.evict(cutoff)
+            if not history.ends:
+                del self.history[person_id]
+        self.last_sweep = now
+
+    def __len__(self):
+        """Number of stored intervals, counting each open interval once per side."""
+        return (sum(len(h.ends) for h in self.history.values())
+                + sum(len(others) for others in self.active.values()))
+
+
+class QueryCache:
+    """LRU cache of query results, tied to a ContactStore's version.
+
+    Every cached answer is dropped as soon as a contact opens or closes.
+    Answers are also dropped after `ttl` seconds, since the end times of
+    ongoing contacts move without changing the version.
+    """
+
+    def __init__(self, store, max_entries=1024, ttl=1.0):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = store.version
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        if self.store.version != self.version:
+            self.entries.clear()
+            self.version = self.store.version
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = compute()
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
@@ -0,0 +1,143 @@
+import pika
+import json
+import time
+from order_book import BUY, SELL
+
+DEPTH_EXCHANGE = 'market_depth'
+
+
+def routing_key(stock):
+    return f"depth.{stock}"
+
+
+class DepthFeed:
+    """Publishes aggregated L2 depth for the books of one matching process.
+
+    Books touched since the last flush are remembered. flush() publishes one
+    delta per touched book holding only the price levels that changed
+    ([price, quantity], quantity 0 meaning the level is gone). Each symbol
+    has its own sequence number. Periodic full snapshots carry the
+    sequence of the last delta they include so subscribers can resync.
+    The epoch changes whenever the engine restarts and the sequences
+    start over.
+    """
+
+    def __init__(self, channel=None, snapshot_interval=5.0):
+        self.channel = channel
+        self.snapshot_interval = snapshot_interval
+        self.epoch = int(time.time() * 1000)
+        self.seqs = {}
+        self.dirty = {}
+        self.last_snapshot = 0.0
+        if channel is not None:
+            channel.exchange_declare(exchange=DEPTH_EXCHANGE, exchange_type='topic')
+
+    def track(self, book):
+        """Starts recording level changes on a book."""
+        if book.changed is None:
+            book.changed = set()
+
+    def touch(self, book):
+        """Marks a book as having (possibly) changed since the last flush."""
+        if book.changed:
+            self.dirty[book.stock] = book
+
+    def delta(self, book):
+        """Drains a book's changed levels into a delta message, or None if nothing changed."""
+        if not book.changed:
+            return None
+        bids, asks = [], []
+        for side, price in book.changed:
+            level = [price, book.level_quantity(side, price)]
+            (bids if side == BUY else asks).append(level)
+        book.changed.clear()
+        seq = self.seqs.get(book.stock, 0) + 1
+        self.seqs[book.stock] = seq
+        return {"type": "delta", "stock": book.stock, "epoch": self.epoch, "seq": seq,
+                "bids": bids, "asks": asks}
+
+    def snapshot(self, book):
+        """Full depth of a book; pending changes are folded into it."""
+        book.changed.clear()
+        self.dirty.pop(book.stock, None)
+        return {"type": "snapshot", "stock": book.stock, "epoch": self.epoch,
+                "seq": self.seqs.get(book.stock, 0),
+                "bids": [list(level) for level in book.depth(BUY)],
+                "asks": [list(level) for level in book.depth(SELL)]}
+
+    def _publish(self, message):
+        if self.channel is not None:
+            self.channel.basic_publish(exchange=DEPTH_EXCHANGE, routing_key=routing_key(message["stock"]),
+                                       body=json.dumps(message, separators=(",", ":")),
+                                       properties=pika.BasicProperties(content_type='application/json'))
+
+    def flush(self):
+        """Publishes a delta for every book changed since the last flush."""
+        dirty, self.dirty = self.dirty, {}
+        for book in dirty.values():
+            message = self.delta(book)
+            if message is not None:
+                self._publish(message)
+
+    def publish_snapshots(self, books):
+        """Publishes a snapshot of every book and starts tracking any new ones."""
+        self.flush()
+        for book in books:
+            self.track(book)
+            self._publish(self.snapshot(book))
+        self.last_snapshot = time.monotonic()
+
+    def snapshot_due(self):
+        return time.monotonic() - self.last_snapshot >= self.snapshot_interval
+
+    def publish_snapshots_if_due(self, books):
+        """Publishes snapshots for late joiners if snapshot_interval has passed. Returns True if it did."""
+        if not self.snapshot_due():
+            return False
+        self.publish_snapshots(books)
+        return True
+
+
+class DepthView:
+    """Subscriber-side depth for one symbol, kept in sync from DepthFeed messages.
+
+    Deltas are applied in sequence. If a delta is missing, the view is
+    marked stale and ignores deltas until the next snapshot arrives.
+    """
+
+    def __init__(self, stock):
+        self.stock = stock
+        self.bids = {}
+        self.asks = {}
+        self.epoch = None
+        self.seq = None
+        self.stale = True
+
+    def apply(self, message):
+        """Applies a delta or snapshot. Returns True if the view changed."""
+        if message["type"] == "snapshot":
+            self.bids = {price: quantity for price, quantity in message["bids"]}
+            self.asks = {price: quantity for price, quantity in message["asks"]}
+            self.epoch = message["epoch"]
+            self.seq = message["seq"]
+            self.stale = False
+            return True
+        if self.stale or message["epoch"] != self.epoch or message["seq"] <= self.seq:
+            return False
+        if message["seq"] != self.seq + 1:
+            self.stale = True
+            return False
+        for side, levels in ((self.bids, message["bids"]), (self.asks, message["asks"])):
+            for price, quantity in levels:
+                if quantity:
+                    side[price] = quantity
+                else:
+                    side.pop(price, None)
+        self.seq = message["seq"]
+        return True
+
+    def top(self, levels=5):
+        """Returns ([(price, qty)] bids best first, [(price, qty)] asks best first)."""
+        bids = sorted(self.bids.items(), reverse=True)[:levels]
+        asks = sorted(self.asks.items())[:levels]
+        return bids, asks
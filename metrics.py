@@ -0,0 +1,422 @@
+"""Process-wide metrics, rate-limited logging and a sampling profiler.
+
+Services count messages, time their callbacks and record queue lag with
+instrument(), and keep domain metrics (matching depth, SQLite flush
+times, contact checks) with counter(), gauge() and histogram(). Metrics
+are always collected; they are cheap enough for the hot paths. start()
+exposes them as configured by environment variables:
+
+    PBT_METRICS_PORT=9100   text endpoint: GET /metrics, and GET /profile,
+                            /profile/start, /profile/stop for the profiler
+    PBT_METRICS_DUMP=10     dump every metric (with rates) to stderr every 10 s
+    PBT_PROFILE=1           start the sampling profiler straight away
+    PBT_LOG_LEVEL=DEBUG     level of the loggers from get_logger()
+
+On POSIX, SIGUSR2 also switches the profiler on and off.
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import traceback
+import contextlib
+from bisect import bisect_left
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Header carrying the publisher's time.time(), for queue lag
+SENT_AT = 'sent_at'
+
+LOG_RATE = 10.0  # log lines per second allowed per logger before suppression
+BUCKETS = tuple(1e-6 * 2 ** i for i in range(28))  # 1 us .. ~134 s
+
+_registry = {}  # (name, labels) -> metric
+_registry_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Counter:
+    """A value that only goes up. Updated by the thread that owns it; reads may be a moment stale."""
+    kind = 'counter'
+    __slots__ = ("name", "labels", "value")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, (), self.value)]
+
+
+class Gauge:
+    """A value that is set, or computed by `function` when metrics are read."""
+    kind = 'gauge'
+    __slots__ = ("name", "labels", "value", "function")
+
+    def __init__(self, name, labels, function=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                self.value = self.function()
+            except RuntimeError:
+                pass  # the owner changed a container mid-read; keep the last value
+        return [(self.name, (), self.value)]
+
+
+class Histogram:
+    """Distribution of durations in seconds, in power-of-two buckets from 1 us."""
+    kind = 'summary'
+    __slots__ = ("name", "labels", "counts", "count", "sum", "max")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, capped at the largest observation."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def time(self):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self)
+
+    def samples(self):
+        return ([(self.name, (("quantile", q),), self.quantile(q)) for q in (0.5, 0.9, 0.99)]
+                + [(self.name + "_max", (), self.max), (self.name + "_sum", (), self.sum),
+                   (self.name + "_count", (), self.count)])
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def _get(cls, name, labels, *args):
+    key = _key(name, labels)
+    metric = _registry.get(key)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(key)
+            if metric is None:
+                metric = _registry[key] = cls(name, key[1], *args)
+    return metric
+
+
+def counter(name, **labels):
+    return _get(Counter, name, labels)
+
+
+def gauge(name, function=None, **labels):
+    metric = _get(Gauge, name, labels)
+    if function is not None:
+        metric.function = function
+    return metric
+
+
+def histogram(name, **labels):
+    return _get(Histogram, name, labels)
+
+
+def stamp(properties):
+    """Adds the publish time to a message's properties, for queue lag. Returns them."""
+    headers = properties.headers or {}
+    headers[SENT_AT] = time.time()
+    properties.headers = headers
+    return properties
+
+
+def instrument(service, callback):
+    """Wraps a pika consumer callback with message count, latency and queue lag metrics."""
+    messages = counter("messages_total", service=service)
+    latency = histogram("callback_seconds", service=service)
+    lag = histogram("queue_lag_seconds", service=service)
+
+    def instrumented(ch, method, properties, body):
+        started = time.perf_counter()
+        headers = properties.headers if properties is not None else None
+        if headers:
+            sent_at = headers.get(SENT_AT)
+            if sent_at is not None:
+                lag.observe(max(0.0, time.time() - sent_at))
+        try:
+            return callback(ch, method, properties, body)
+        finally:
+            messages.inc()
+            latency.observe(time.perf_counter() - started)
+    return instrumented
+
+
+def render(rates=None):
+    """All metrics as text, one `name{labels} value` line each.
+
+    With a dict `rates`, counters also show their per-second rate since
+    the previous call that passed the same dict.
+    """
+    now = time.monotonic()
+    lines = []
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: (m.name, m.labels))
+    last_name = None
+    for metric in metrics:
+        if metric.name != last_name:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            last_name = metric.name
+        for name, extra, value in metric.samples():
+            line = f"{name}{_label_text(metric.labels, extra)} {value:.6g}"
+            if rates is not None and metric.kind == 'counter':
+                key = (metric.name, metric.labels)
+                previous = rates.get(key)
+                if previous is not None and now > previous[0]:
+                    line += f"  ({(value - previous[1]) / (now - previous[0]):,.1f}/s)"
+                rates[key] = (now, value)
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+# Logging
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records per second (bursts of the same size).
+
+    Dropped records are counted, and the next record let through says how
+    many were suppressed. Messages are only formatted for records that pass.
+    Errors always pass, so a flood of warnings cannot hide them.
+    """
+
+    def __init__(self, rate=LOG_RATE):
+        super().__init__()
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.suppressed = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1 and record.levelno < logging.ERROR:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        if self.suppressed:
+            record.msg = f"{record.msg} ({self.suppressed} similar messages suppressed)"
+            self.suppressed = 0
+        return True
+
+
+_logging_configured = False
+
+
+def get_logger(name, rate=LOG_RATE):
+    """A leveled logger whose output below ERROR is rate limited."""
+    global _logging_configured
+    if not _logging_configured:
+        logging.basicConfig(level=os.environ.get('PBT_LOG_LEVEL', 'INFO').upper(),
+                            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        _logging_configured = True
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, RateLimitFilter) for f in logger.filters):
+        logger.addFilter(RateLimitFilter(rate))
+    return logger
+
+
+@contextlib.contextmanager
+def quiet_logging(level=logging.WARNING):
+    """Drops log records at `level` and below, from every thread, while the block runs."""
+    previous = logging.root.manager.disable
+    logging.disable(level)
+    try:
+        yield
+    finally:
+        logging.disable(previous)
+
+
+# Sampling profiler
+
+class SamplingProfiler:
+    """Samples the stacks of every other thread at a fixed interval.
+
+    Stacks are tallied in collapsed form ("outer;inner;leaf" with a count),
+    which flame graph tools read directly. Costs nothing while stopped.
+    """
+
+    def __init__(self, interval=0.005, depth=40):
+        self.interval = interval
+        self.depth = depth
+        self.stacks = _Tally()
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = traceback.extract_stack(frame, limit=self.depth)
+                self.stacks[";".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                                     for entry in stack)] += 1
+            self.samples += 1
+
+    def report(self, top=50):
+        """The most sampled stacks, collapsed, most frequent first."""
+        state = "running" if self.running else "stopped"
+        lines = [f"# {self.samples} samples every {self.interval * 1000:.1f} ms, profiler {state}"]
+        lines += [f"{stack} {count}" for stack, count in self.stacks.most_common(top)]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        self.stacks.clear()
+        self.samples = 0
+
+
+profiler = SamplingProfiler()
+
+
+# Exposure
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/metrics'):
+            body = render()
+        elif path == '/profile':
+            body = profiler.report()
+        elif path == '/profile/start':
+            profiler.reset()
+            profiler.start()
+            body = "profiler started\n"
+        elif path == '/profile/stop':
+            profiler.stop()
+            body = profiler.report()
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would otherwise flood stderr
+
+
+def serve(port, host='127.0.0.1'):
+    """Serves /metrics and the profiler endpoints on a background thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_every(seconds, stream=None):
+    """Writes every metric, with counter rates, to stream (default stderr) every `seconds`."""
+    def run():
+        rates = {}
+        render(rates)
+        while True:
+            time.sleep(seconds)
+            (stream or sys.stderr).write(render(rates))
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+
+
+_started = False
+
+
+def start():
+    """Starts whatever exposure the environment asks for. Safe to call more than once."""
+    global _started
+    if _started:
+        return
+    _started = True
+    port = os.environ.get('PBT_METRICS_PORT')
+    if port:
+        serve(int(port))
+    dump = os.environ.get('PBT_METRICS_DUMP')
+    if dump:
+        dump_every(float(dump))
+    if os.environ.get('PBT_PROFILE'):
+        profiler.start()
+    if hasattr(signal, 'SIGUSR2'):
+        try:
+            signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=profiler.toggle).start())
+        except ValueError:
+            pass  # not the main thread
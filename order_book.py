@@ -0,0 +1,235 @@
+from bisect import bisect_left, insort
+
+BUY = "buy"
+SELL = "sell"
+
+
+class Order:
+    """A resting order. Orders at one price form an intrusive doubly linked list."""
+    __slots__ = ("order_id", "side", "price", "quantity", "seq", "level", "prev", "next")
+
+    def __init__(self, order_id, side, price, quantity, seq=0):
+        self.order_id = order_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.seq = seq
+        self.level = None
+        self.prev = None
+        self.next = None
+
+    def __repr__(self):
+        return f"Order({self.order_id!r}, {self.side}, {self.price}, {self.quantity})"
+
+
+class PriceLevel:
+    """FIFO queue of orders at a single price, with the aggregated quantity."""
+    __slots__ = ("price", "head", "tail", "total_quantity", "count")
+
+    def __init__(self, price):
+        self.price = price
+        self.head = None
+        self.tail = None
+        self.total_quantity = 0
+        self.count = 0
+
+    def append(self, order):
+        order.level = self
+        order.prev = self.tail
+        order.next = None
+        if self.tail is None:
+            self.head = order
+        else:
+            self.tail.next = order
+        self.tail = order
+        self.total_quantity += order.quantity
+        self.count += 1
+
+    def remove(self, order):
+        if order.prev is None:
+            self.head = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.tail = order.prev
+        else:
+            order.next.prev = order.prev
+        self.total_quantity -= order.quantity
+        self.count -= 1
+        order.level = order.prev = order.next = None
+
+    def __iter__(self):
+        order = self.head
+        while order is not None:
+            yield order
+            order = order.next
+
+
+class OrderBook:
+    """Price-time priority order book for one stock.
+
+    Each side keeps a dict of price -> PriceLevel plus a sorted list of
+    priority keys (price for bids, -price for asks) so that the best level
+    is always the last element. Orders are indexed by id, so cancels and
+    reductions are O(1) unless they empty a level: dropping the best level
+    is O(1), any other level costs a list delete (O(levels on that side)),
+    as does adding a new level.
+
+    If `changed` is a set, every (side, price) whose aggregated quantity
+    changes is added to it, so depth consumers can work per changed level.
+    """
+
+    def __init__(self, stock, track_changes=False):
+        self.stock = stock
+        self.levels = {BUY: {}, SELL: {}}
+        self.keys = {BUY: [], SELL: []}
+        self.orders = {}
+        self.seq = 0
+        self.changed = set() if track_changes else None
+
+    @staticmethod
+    def _key(side, price):
+        return price if side == BUY else -price
+
+    def best_level(self, side):
+        keys = self.keys[side]
+        if not keys:
+            return None
+        return self.levels[side][self._key(side, keys[-1])]
+
+    def best_bid(self):
+        keys = self.keys[BUY]
+        return keys[-1] if keys else None
+
+    def best_ask(self):
+        keys = self.keys[SELL]
+        return -keys[-1] if keys else None
+
+    def add(self, order_id, side, price, quantity):
+        """Rests a new order at the back of its price level."""
+        if order_id in self.orders:
+            raise ValueError(f"Duplicate order id: {order_id}")
+        if side not in self.levels:
+            raise ValueError(f"Unknown order side: {side}")
+        if quantity <= 0:
+            raise ValueError(f"Order quantity must be positive: {quantity}")
+        self.seq += 1
+        order = Order(order_id, side, price, quantity, self.seq)
+        levels = self.levels[side]
+        level = levels.get(price)
+        if level is None:
+            level = levels[price] = PriceLevel(price)
+            insort(self.keys[side], self._key(side, price))
+        level.append(order)
+        self.orders[order_id] = order
+        if self.changed is not None:
+            self.changed.add((side, price))
+        return order
+
+    def _unlink(self, order):
+        level = order.level
+        level.remove(order)
+        del self.orders[order.order_id]
+        if self.changed is not None:
+            self.changed.add((order.side, level.price))
+        if level.count == 0:
+            self._drop_level(order.side, level.price)
+
+    def _drop_level(self, side, price):
+        del self.levels[side][price]
+        keys = self.keys[side]
+        key = self._key(side, price)
+        # Emptied levels are almost always the best one, which is the last key
+        if keys[-1] == key:
+            keys.pop()
+        else:
+            del keys[bisect_left(keys, key)]
+
+    def cancel(self, order_id):
+        """Removes a resting order. Returns the order, or None if it is not resting."""
+        order = self.orders.get(order_id)
+        if order is not None:
+            self._unlink(order)
+        return order
+
+    def reduce(self, order_id, quantity):
+        """Reduces a resting order's quantity in place, keeping its time priority."""
+        if quantity <= 0:
+            raise ValueError(f"Reduce quantity must be positive: {quantity}")
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        if quantity >= order.quantity:
+            self._unlink(order)
+            order.quantity = 0
+            return order
+        order.quantity -= quantity
+        order.level.total_quantity -= quantity
+        if self.changed is not None:
+            self.changed.add((order.side, order.price))
+        return order
+
+    def match(self):
+        """Crosses the book and returns the resulting trades.
+
+        Trades execute at the price of the order that rested first.
+        """
+        trades = []
+        bid_keys = self.keys[BUY]
+        ask_keys = self.keys[SELL]
+        while bid_keys and ask_keys and bid_keys[-1] >= -ask_keys[-1]:
+            buy = self.levels[BUY][bid_keys[-1]].head
+            sell = self.levels[SELL][-ask_keys[-1]].head
+            traded_quantity = min(buy.quantity, sell.quantity)
+            trade_price = buy.price if buy.seq < sell.seq else sell.price
+            trades.append({
+                "stock": self.stock,
+                "price": trade_price,
+                "quantity": traded_quantity,
+                "buy_order_id": buy.order_id,
+                "sell_order_id": sell.order_id
+            })
+            for order in (buy, sell):
+                if order.quantity == traded_quantity:
+                    self._unlink(order)
+                    order.quantity = 0
+                else:
+                    order.quantity -= traded_quantity
+                    order.level.total_quantity -= traded_quantity
+                    if self.changed is not None:
+                        self.changed.add((order.side, order.price))
+        return trades
+
+    def depth(self, side, levels=None):
+        """Returns [(price, total_quantity)] from the best level outwards."""
+        keys = self.keys[side]
+        book = self.levels[side]
+        selected = keys if levels is None else keys[-levels:]
+        result = []
+        for key in reversed(selected):
+            level = book[self._key(side, key)]
+            result.append((level.price, level.total_quantity))
+        return result
+
+    def level_quantity(self, side, price):
+        """Aggregated quantity resting at a price, 0 if the level is empty."""
+        level = self.levels[side].get(price)
+        return level.total_quantity if level is not None else 0
+
+    def snapshot(self):
+        """Returns the resting orders as [[id, side, price, quantity]] in priority order."""
+        orders = []
+        for side in (BUY, SELL):
+            book = self.levels[side]
+            for key in reversed(self.keys[side]):
+                for order in book[self._key(side, key)]:
+                    orders.append([order.order_id, side, order.price, order.quantity])
+        return {"stock": self.stock, "orders": orders}
+
+    @classmethod
+    def restore(cls, data):
+        """Rebuilds a book from snapshot(); time priority within each level is kept."""
+        book = cls(data["stock"])
+        for order_id, side, price, quantity in data["orders"]:
+            book.add(order_id, side, price, quantity)
+        return book
@@ -0,0 +1,102 @@
+"""Order flows for driving the matching engine.
+
+Seeded synthetic flows and readers for recorded order logs, shared by
+order_placement's bulk mode and the benchmarks.
+"""
+import csv
+import json
+import random
+
+
+def _price_offset(rng, distribution, depth):
+    """Distance from the touch in ticks, >= 0, for a passive order."""
+    if distribution == "uniform":
+        return rng.randrange(depth)
+    if distribution == "normal":
+        return min(depth - 1, int(abs(rng.gauss(0, depth / 3))))
+    if distribution == "exponential":
+        return min(depth - 1, int(rng.expovariate(3.0 / depth)))
+    raise ValueError(f"Unknown price distribution: {distribution}")
+
+
+def generate_orders(count, seed=1, symbols=10, depth=20, cross_rate=0.1, cancel_rate=0.0,
+                    price_distribution="normal", mid_price=100.0, tick=0.01, max_quantity=100, first_id=1):
+    """Yields a reproducible synthetic order flow.
+
+    Each symbol's book is first seeded with `depth` passive levels per side.
+    After that, a `cross_rate` share of orders is priced through the
+    opposite touch. The rest rest inside the book at an offset drawn from
+    `price_distribution`. A `cancel_rate` share cancels a random earlier
+    order.
+    """
+    rng = random.Random(seed)
+    names = [f"SYM{i:04d}" for i in range(symbols)]
+    next_id = first_id
+    live_ids = {name: [] for name in names}
+
+    def order(order_type, stock, ticks_from_mid):
+        nonlocal next_id
+        price = round(mid_price + ticks_from_mid * tick, 6)
+        result = {"type": order_type, "stock": stock, "price": price,
+                  "quantity": rng.randint(1, max_quantity), "id": next_id}
+        live_ids[stock].append(next_id)
+        next_id += 1
+        return result
+
+    for stock in names:
+        for level in range(depth):
+            yield order("buy", stock, -1 - level)
+            yield order("sell", stock, 1 + level)
+
+    for _ in range(count):
+        stock = names[rng.randrange(symbols)]
+        roll = rng.random()
+        if roll < cancel_rate and live_ids[stock]:
+            ids = live_ids[stock]
+            index = rng.randrange(len(ids))
+            ids[index], ids[-1] = ids[-1], ids[index]
+            yield {"type": "cancel", "stock": stock, "id": ids.pop()}
+            continue
+        side = "buy" if rng.random() < 0.5 else "sell"
+        sign = -1 if side == "buy" else 1
+        if roll < cancel_rate + cross_rate:
+            # Priced through the other side: sweeps up to a few levels
+            yield order(side, stock, -sign * (1 + rng.randrange(3)))
+        else:
+            yield order(side, stock, sign * (1 + _price_offset(rng, price_distribution, depth)))
+
+
+def iter_orders(path):
+    """Streams orders from a recorded order log.
+
+    Accepts JSON lines of order messages, journal segments written by
+    order_journal (only "order" records are used) and CSV files with
+    type,stock,price,quantity[,id] columns.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                order = {"type": row["type"], "stock": row["stock"]}
+                if row.get("price"):
+                    order["price"] = float(row["price"])
+                if row.get("quantity"):
+                    order["quantity"] = int(row["quantity"])
+                if row.get("id"):
+                    order["id"] = int(row["id"]) if row["id"].isdigit() else row["id"]
+                yield order
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "op" in record:
+                if record["op"] == "order":
+                    yield record["order"]
+            else:
+                yield record
+
+
+def load_orders(path):
+    return list(iter_orders(path))
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+
+SNAPSHOT_PREFIX = "snapshot-"
+SEGMENT_PREFIX = "journal-"
+
+
+def _encode(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class Journal:
+    """Append-only journal of engine events with group commit and snapshots.
+
+    Records are buffered by append() and made durable together by commit(),
+    which costs one write and one fsync however many records are pending.
+    A snapshot captures the state after a given sequence number and starts
+    a new journal segment, so recovery only replays records written since
+    the latest snapshot.
+    """
+
+    def __init__(self, directory, snapshot_every=100000):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        self.seq = 0
+        self.committed_seq = 0
+        self.snapshot_seq = 0
+        self.pending = []
+        self.file = None
+
+    def _path(self, prefix, seq, suffix):
+        return os.path.join(self.directory, f"{prefix}{seq:012d}{suffix}")
+
+    def _list(self, prefix):
+        """Returns [(seq, path)] for files with the given prefix, oldest first."""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and not name.endswith(".tmp"):
+                seq = int(name[len(prefix):].split(".")[0])
+                found.append((seq, os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def _fsync_directory(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _open_segment(self, start_seq):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self._path(SEGMENT_PREFIX, start_seq, ".log"), "a", encoding="utf-8")
+        self._fsync_directory()
+
+    def recover(self):
+        """Loads the latest snapshot and the journal records written after it.
+
+        Returns (snapshot_state or None, [records]) and leaves the journal
+        ready to append after the last intact record. A torn final line from
+        a crash mid-write is truncated away.
+        """
+        state = None
+        snapshots = self._list(SNAPSHOT_PREFIX)
+        if snapshots:
+            self.snapshot_seq, path = snapshots[-1]
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+
+        records = []
+        last_seq = self.snapshot_seq
+        for start_seq, path in self._list(SEGMENT_PREFIX):
+            with open(path, "rb") as f:
+                data = f.read()
+            good = 0
+            for line in data.splitlines(keepends=True):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+                if record["seq"] > last_seq:
+                    records.append(record)
+                    last_seq = record["seq"]
+            if good < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+                    os.fsync(f.fileno())
+
+        self.seq = self.committed_seq = last_seq
+        self._open_segment(self.seq + 1)
+        return state, records
+
+    def append(self, record):
+        """Buffers a record and returns its sequence number."""
+        self.seq += 1
+        record["seq"] = self.seq
+        self.pending.append(_encode(record))
+        return self.seq
+
+    def commit(self):
+        """Writes and fsyncs all pending records. Returns True if any were written."""
+        if not self.pending:
+            return False
+        if self.file is None:
+            self._open_segment(self.seq - len(self.pending) + 1)
+        self.file.write("".join(self.pending))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+        self.committed_seq = self.seq
+        return True
+
+    def snapshot_due(self):
+        return self.committed_seq - self.snapshot_seq >= self.snapshot_every
+
+    def snapshot(self, state):
+        """Durably stores state as of the last committed record and rolls the journal."""
+        self.commit()
+        seq = self.committed_seq
+        path = self._path(SNAPSHOT_PREFIX, seq, ".json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(state, seq=seq, taken_at=time.time()), f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._open_segment(seq + 1)
+
+        # Everything before the new snapshot is no longer needed for recovery
+        for old_seq, old_path in self._list(SNAPSHOT_PREFIX):
+            if old_seq < seq:
+                os.remove(old_path)
+        for start_seq, old_path in self._list(SEGMENT_PREFIX):
+            if start_seq <= seq:
+                os.remove(old_path)
+        self._fsync_directory()
+        self.snapshot_seq = seq
+
+    def close(self):
+        self.commit()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
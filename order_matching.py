@@ -1,88 +1,434 @@
-import pika
+import os
 import json
-from heapq import heappush, heappop
+import math
+import zlib
+import struct
+import wire_format
+import transport
+import metrics
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from order_book import OrderBook, BUY, SELL
+from order_journal import Journal
+from market_depth import DepthFeed
+from trade_publisher import TradePublisher
 
-# Initializes order books for multiple stocks
-order_books = {
-    "AAPL": {"buy_orders": [], "sell_orders": []},
-    "TSLA": {"buy_orders": [], "sell_orders": []}
-}
+ORDERS_QUEUE = 'orders'
+JOURNAL_DIR = 'journal'
+
+# Order books by stock, registered on first use
+order_books = {}
+
+# Publishes fills; created by setup_rabbitmq or on first use
+trade_publisher = None
+
+# Journal of accepted orders, cancels and fills; None disables persistence
+journal = None
+
+# Publishes L2 depth deltas and snapshots; None disables the feed
+depth_feed = None
+
+# Set while the journal is replayed, so nothing is re-journaled or re-published
+_replaying = False
+
+# Next id handed out to orders that arrive without one
+next_order_id = 1
+
+# Keys of recently applied orders (AMQP message id, else client order id), so an
+# order redelivered after a crash between journal commit and ack is not applied twice
+DEDUPE_WINDOW = 100000
+applied = OrderedDict()
+
+log = metrics.get_logger("order_matching")
+trades_matched = metrics.counter("trades_total")
+commit_seconds = metrics.histogram("journal_commit_seconds")
+
+def register_symbol(stock):
+    """Returns the order book for a stock, creating it if needed."""
+    book = order_books.get(stock)
+    if book is None:
+        book = order_books[stock] = OrderBook(stock)
+        if depth_feed is not None:
+            depth_feed.track(book)
+    return book
+
+def shard_for(stock, shards):
+    # crc32 rather than hash() so every process agrees on the shard
+    return zlib.crc32(stock.encode()) % shards
+
+def shard_queue(shard):
+    return f"{ORDERS_QUEUE}.{shard}"
 
 def match_orders(stock):
-    buy_orders = order_books[stock]["buy_orders"]
-    sell_orders = order_books[stock]["sell_orders"]
-
-    while buy_orders and sell_orders:
-        # Gets the highest buy order and lowest sell order
-        highest_buy = heappop(buy_orders)
-        lowest_sell = heappop(sell_orders)
-
-        if -highest_buy["price"] >= lowest_sell["price"]:
-            traded_quantity = min(highest_buy["quantity"], lowest_sell["quantity"])
-            trade_price = lowest_sell["price"]
-
-            trade = {
-                "stock": stock,
-                "price": trade_price,
-                "quantity": traded_quantity
-            }
-            publish_trade(trade)
-
-            highest_buy["quantity"] -= traded_quantity
-            lowest_sell["quantity"] -= traded_quantity
-
-            if highest_buy["quantity"] > 0:
-                heappush(buy_orders, highest_buy)
-            if lowest_sell["quantity"] > 0:
-                heappush(sell_orders, lowest_sell)
-        else:
-            # Prices don't match, reinsert orders back into the book and break
-            heappush(buy_orders, highest_buy)
-            heappush(sell_orders, lowest_sell)
-            break
+    # Crosses the book in price-time priority and publishes every fill
+    for trade in order_books[stock].match():
+        if journal is not None and not _replaying:
+            journal.append({"op": "fill", "trade": trade})
+        publish_trade(trade)
 
-def process_order(order):
+def _journal(order, message_id=None):
+    if journal is not None and not _replaying:
+        record = {"op": "order", "order": order}
+        if message_id is not None:
+            record["message_id"] = message_id
+        journal.append(record)
+
+def _dedupe_key(order, message_id=None):
+    """Identifies an order message across redeliveries, or None if it cannot be.
+
+    Cancels are idempotent anyway; reduces without a message id cannot be told apart.
+    """
+    if message_id is not None:
+        return f"msg:{message_id}"
+    if order["type"] in (BUY, SELL) and order.get("id") is not None:
+        return f"id:{order['id']!r}"
+    return None
+
+def _remember(key):
+    if key is not None:
+        applied[key] = None
+        if len(applied) > DEDUPE_WINDOW:
+            applied.popitem(last=False)
+
+def validate_order(order):
+    """Returns the order if it is well formed, else raises ValueError."""
+    if not isinstance(order, dict):
+        raise ValueError("order is not an object")
+    order_type = order.get("type")
+    if order_type not in (BUY, SELL, "cancel", "reduce"):
+        raise ValueError(f"unknown order type {order_type!r}")
+    if not isinstance(order.get("stock"), str) or not order["stock"]:
+        raise ValueError("missing stock")
+    if order_type in (BUY, SELL):
+        price = order.get("price")
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or not math.isfinite(price):
+            raise ValueError(f"bad price {price!r}")
+    elif order.get("id") is None:
+        raise ValueError(f"{order_type} without an order id")
+    order_id = order.get("id")
+    if order_id is not None and (isinstance(order_id, bool) or not isinstance(order_id, (int, str))):
+        raise ValueError(f"bad order id {order_id!r}")
+    if order_type != "cancel":
+        quantity = order.get("quantity")
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            raise ValueError(f"bad quantity {quantity!r}")
+    return order
+
+def process_order(order, message_id=None):
+    global next_order_id
+    key = _dedupe_key(order, message_id)
+    if key is not None and key in applied:
+        log.info("Skipping already applied order: %s", order)
+        return
     stock = order["stock"]
-    if order["type"] == "buy":
-        heappush(order_books[stock]["buy_orders"], {
-            "price": -order["price"],
-            "quantity": order["quantity"],
-            "order_id": order.get("id", None)
-        })
-    elif order["type"] == "sell":
-        heappush(order_books[stock]["sell_orders"], {
-            "price": order["price"],
-            "quantity": order["quantity"],
-            "order_id": order.get("id", None)
-        })
-
-    match_orders(stock)
+    book = register_symbol(stock)
+    order_type = order["type"]
+
+    if order_type in (BUY, SELL):
+        order_id = order.get("id")
+        if order_id is None:
+            order_id = next_order_id
+            order = dict(order, id=order_id)
+        if isinstance(order_id, int) and order_id >= next_order_id:
+            next_order_id = order_id + 1
+        try:
+            book.add(order_id, order_type, order["price"], order["quantity"])
+        except ValueError as e:
+            log.warning("Rejected order: %s", e)
+            return
+        # Journaled with its assigned id so a replay rebuilds the same book
+        _journal(order, message_id)
+        _remember(key)
+        match_orders(stock)
+    elif order_type == "cancel":
+        if book.cancel(order["id"]) is None:
+            log.warning("Cancel rejected, order not resting: %s", order['id'])
+        else:
+            _journal(order, message_id)
+            _remember(key)
+    elif order_type == "reduce":
+        try:
+            reduced = book.reduce(order["id"], order["quantity"])
+        except ValueError as e:
+            log.warning("Reduce rejected: %s", e)
+            return
+        if reduced is None:
+            log.warning("Reduce rejected, order not resting: %s", order['id'])
+        else:
+            _journal(order, message_id)
+            _remember(key)
+    else:
+        log.warning("Unknown order type: %s", order_type)
 
 def publish_trade(trade):
-    print(f"Attempting to publish trade: {trade}")  # Debug print
+    global trade_publisher
+    if _replaying:
+        return
+    if trade_publisher is None:
+        trade_publisher = TradePublisher()
+    trades_matched.inc()
+    trade_publisher.publish(trade)
 
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    channel = connection.channel()
-    channel.queue_declare(queue='trades', durable=True)
+def snapshot_state():
+    return {"next_order_id": next_order_id,
+            "applied": list(applied),
+            "books": [book.snapshot() for book in order_books.values()]}
+
+def recover(directory, snapshot_every=100000):
+    """Rebuilds the books from the latest snapshot plus the journal tail.
+
+    Fills journaled after the last confirmed publish are published again,
+    so a crash between the journal commit and the broker confirm does not
+    lose them (consumers may see such a batch twice).
+    """
+    global journal, next_order_id, _replaying
+    journal = Journal(directory, snapshot_every)
+    state, records = journal.recover()
+    order_books.clear()
+    applied.clear()
+    if state is not None:
+        next_order_id = state["next_order_id"]
+        applied.update(dict.fromkeys(state.get("applied", ())))
+        for data in state["books"]:
+            order_books[data["stock"]] = OrderBook.restore(data)
 
-    channel.basic_publish(exchange='', routing_key='trades', body=json.dumps(trade))
-    print(f"Trade published: {trade}")
-    connection.close()
+    published_seq = journal.snapshot_seq
+    fills = []
+    _replaying = True
+    try:
+        for record in records:
+            op = record["op"]
+            if op == "order":
+                process_order(record["order"], record.get("message_id"))
+            elif op == "fill":
+                fills.append(record)
+            elif op == "published":
+                published_seq = max(published_seq, record["upto"])
+    finally:
+        _replaying = False
+
+    for record in fills:
+        if record["seq"] > published_seq:
+            publish_trade(record["trade"])
+    print(f"Recovered {len(order_books)} books from snapshot {journal.snapshot_seq} "
+          f"and {len(records)} journal records")
+
+def commit():
+    """Makes journaled events durable, then publishes fills. Returns when both are done."""
+    with commit_seconds.time():
+        journal.commit()
+    if trade_publisher.buffer:
+        trade_publisher.flush()
+        # Rides along with the next group commit; only used to skip republishing
+        journal.append({"op": "published", "upto": journal.committed_seq})
+    if journal.snapshot_due():
+        journal.snapshot(snapshot_state())
+    if depth_feed is not None:
+        depth_feed.flush()
 
 def callback(ch, method, properties, body):
-    order = json.loads(body.decode())  # Fix: Use json.loads()
-    print(f"Received order: {order}")
-    process_order(order)
+    """Applies one order message. Returns False if it was malformed and has been rejected."""
+    try:
+        order = validate_order(wire_format.decode(body, wire_format.content_type_of(properties)))
+    except (ValueError, struct.error) as e:
+        # Requeueing would redeliver it forever; dead-lettered if the queue has a DLX
+        log.warning("Rejecting malformed order %r: %s", body, e)
+        ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+        return False
+    log.debug("Received order: %s", order)
+    process_order(order, getattr(properties, "message_id", None))
+    if depth_feed is not None:
+        depth_feed.touch(register_symbol(order["stock"]))
+    if journal is None:
+        # Fills from this order go out as one confirmed batch
+        trade_publisher.flush_if_due()
+        if depth_feed is not None:
+            depth_feed.flush()
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    return True
+
+def setup_rabbitmq(queue=ORDERS_QUEUE, flush_delay=0.0, journal_dir=JOURNAL_DIR,
+                   group_size=256, group_delay=0.005, snapshot_every=100000, depth_snapshot_interval=5.0,
+                   trade_content_type=wire_format.JSON_CONTENT_TYPE):
+    """Consumes orders from a queue.
 
-def setup_rabbitmq():
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    With a journal, deliveries are acked in groups: up to group_size orders
+    (or group_delay seconds of them) share one fsync, and the ack is only
+    sent once that write is durable. Depth deltas go out with each group
+    (or each order without a journal), and full depth snapshots every
+    depth_snapshot_interval seconds.
+
+    An order redelivered after a crash between the fsync and the ack is
+    recognised by its message id or client order id and skipped. Malformed
+    messages are rejected without requeueing.
+    """
+    global trade_publisher, depth_feed
+    metrics.start()
+    # Matching depth, computed only when metrics are read
+    metrics.gauge("order_books", lambda: len(order_books))
+    metrics.gauge("resting_orders", lambda: sum(len(book.orders) for book in list(order_books.values())))
+    metrics.gauge("price_levels", lambda: sum(len(book.levels[BUY]) + len(book.levels[SELL])
+                                              for book in list(order_books.values())))
+    connection = transport.connect()
     channel = connection.channel()
-    channel.queue_declare(queue='orders', durable=True)
-    channel.basic_consume(queue='orders', on_message_callback=callback, auto_ack=True)
-    print("Waiting for orders...")
-    channel.start_consuming()
+    channel.queue_declare(queue=queue, durable=True)
+    # With a journal, fills may only leave in commit(), after the orders behind them are durable
+    trade_publisher = TradePublisher(connection, max_batch=float('inf') if journal_dir is not None else 500,
+                                     max_delay=flush_delay, content_type=trade_content_type)
+    depth_feed = DepthFeed(connection.channel(), depth_snapshot_interval)
+    if journal_dir is not None:
+        recover(os.path.join(journal_dir, queue), snapshot_every)
+        trade_publisher.flush()
+    # Lets subscribers sync straight away, including to recovered books
+    depth_feed.publish_snapshots(list(order_books.values()))
 
-if __name__ == "__main__":
-    setup_rabbitmq()
+    # Checked more often than the interval so a late timer does not skip a whole period
+    depth_check_interval = min(depth_snapshot_interval, 1.0)
+
+    def depth_snapshot_timer():
+        depth_feed.publish_snapshots_if_due(list(order_books.values()))
+        connection.call_later(depth_check_interval, depth_snapshot_timer)
+    connection.call_later(depth_check_interval, depth_snapshot_timer)
+
+    transport.set_prefetch(channel, max(group_size * 2, 1))
+
+    unacked = []
+
+    def commit_and_ack():
+        if unacked:
+            commit()
+            channel.basic_ack(delivery_tag=unacked[-1], multiple=True)
+            unacked.clear()
+
+    def on_order(ch, method, properties, body):
+        if callback(ch, method, properties, body) and journal is not None:
+            unacked.append(method.delivery_tag)
+            if len(unacked) >= group_size:
+                commit_and_ack()
+
+    if journal is not None:
+        def commit_timer():
+            commit_and_ack()
+            connection.call_later(group_delay, commit_timer)
+        connection.call_later(group_delay, commit_timer)
+    elif flush_delay > 0:
+        # Batches spanning several orders still leave within flush_delay when order flow stops
+        def flush_timer():
+            trade_publisher.flush_if_due()
+            connection.call_later(flush_delay, flush_timer)
+        connection.call_later(flush_delay, flush_timer)
+
+    channel.basic_consume(queue=queue, on_message_callback=metrics.instrument("order_matching", on_order))
+    print(f"Waiting for orders on '{queue}'...")
+    try:
+        channel.start_consuming()
+    finally:
+        if connection.is_open:
+            commit_and_ack()
+            trade_publisher.close()
+            connection.close()
+        if journal is not None:
+            journal.close()
 
+def run_worker(shard, flush_delay=0.0, journal_dir=JOURNAL_DIR, trade_content_type=wire_format.JSON_CONTENT_TYPE):
+    """Matches the symbols of one shard, with its own books, journal and trade publisher."""
+    try:
+        setup_rabbitmq(shard_queue(shard), flush_delay, journal_dir, trade_content_type=trade_content_type)
+    except KeyboardInterrupt:
+        pass
 
+def run_router(shards, prefetch=256, batch_size=128, batch_delay=0.005):
+    """Forwards orders from the shared queue to the shard owning their symbol.
+
+    A single router consumer keeps each symbol's orders in arrival order, and
+    each shard queue has one worker, so per-symbol ordering is preserved.
+    Forwards are published in a transaction that is committed once per batch
+    (batch_size orders or batch_delay seconds), and the batch's orders are
+    only acked, with one multiple ack, after the commit succeeded.
+    """
+    connection = transport.connect()
+    channel = connection.channel()
+    channel.queue_declare(queue=ORDERS_QUEUE, durable=True)
+    for shard in range(shards):
+        channel.queue_declare(queue=shard_queue(shard), durable=True)
+    transport.set_prefetch(channel, prefetch)
+    # A blocking channel waits for each publisher confirm in turn; one tx.commit covers the whole batch
+    forward = connection.channel()
+    forward.tx_select()
+    pending = []  # delivery tags of the orders in the uncommitted batch
+
+    def commit_batch():
+        if pending:
+            forward.tx_commit()
+            channel.basic_ack(delivery_tag=pending[-1], multiple=True)
+            pending.clear()
+
+    def route(ch, method, properties, body):
+        try:
+            stock = wire_format.message_stock(body, wire_format.content_type_of(properties))
+        except (ValueError, KeyError, TypeError, struct.error):
+            log.warning("Dropping malformed order: %r", body)
+        else:
+            forward.basic_publish(exchange='', routing_key=shard_queue(shard_for(stock, shards)), body=body,
+                                  properties=properties)
+        pending.append(method.delivery_tag)
+        if len(pending) >= batch_size:
+            commit_batch()
+
+    def batch_timer():
+        commit_batch()
+        connection.call_later(batch_delay, batch_timer)
+
+    connection.call_later(batch_delay, batch_timer)
+    metrics.start()
+    channel.basic_consume(queue=ORDERS_QUEUE, on_message_callback=metrics.instrument("order_router", route))
+    print(f"Routing orders to {shards} shards...")
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if connection.is_open:
+            connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Order matching engine")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="number of matching worker processes (0 = single process on 'orders')")
+    parser.add_argument("--role", choices=["all", "router", "worker"], default="all",
+                        help="run the router, one worker, or both (default)")
+    parser.add_argument("--shard", type=int, default=0, help="shard served by --role worker")
+    parser.add_argument("--flush-delay", type=float, default=0.0,
+                        help="seconds fills may wait to be batched with later orders (without a journal)")
+    parser.add_argument("--journal-dir", default=JOURNAL_DIR, help="directory for journals and snapshots")
+    parser.add_argument("--no-journal", action="store_true", help="keep order books in memory only")
+    parser.add_argument("--trade-format", choices=["json", "binary"], default="json",
+                        help="encoding of published trades (orders are decoded by content type)")
+    args = parser.parse_args()
+    journal_dir = None if args.no_journal else args.journal_dir
+    trade_content_type = (wire_format.BINARY_CONTENT_TYPE if args.trade_format == "binary"
+                          else wire_format.JSON_CONTENT_TYPE)
+
+    if args.shards <= 0:
+        setup_rabbitmq(flush_delay=args.flush_delay, journal_dir=journal_dir, trade_content_type=trade_content_type)
+    elif args.role == "router":
+        run_router(args.shards)
+    elif args.role == "worker":
+        run_worker(args.shard, args.flush_delay, journal_dir, trade_content_type)
+    else:
+        workers = [multiprocessing.Process(target=run_worker,
+                                           args=(shard, args.flush_delay, journal_dir, trade_content_type),
+                                           daemon=True)
+                   for shard in range(args.shards)]
+        for worker in workers:
+            worker.start()
+        try:
+            run_router(args.shards)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,242 @@
 import pika
-import json
+import time
+import uuid
+import itertools
+import argparse
+import wire_format
+import transport
+import metrics
 
-def place_order(order_type, stock, price, quantitiy):
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    channel = connection.channel()
-    channel.queue_declare(queue='orders', durable=True)
+ORDERS_QUEUE = 'orders'
 
+def _declare_orders(channel):
+    channel.queue_declare(queue=ORDERS_QUEUE, durable=True)
+
+def _get_channel(host=None):
+    # Connection shared by every place_order call on this thread
+    return transport.pooled_channel('orders', host, _declare_orders)
+
+def place_order(order_type, stock, price, quantitiy, content_type=wire_format.JSON_CONTENT_TYPE):
     order = {
         "type": order_type,
         "stock": stock,
         "price": price,
         "quantity": quantitiy
     }
-    channel.basic_publish(exchange='', routing_key='orders', body=json.dumps(order))
+    body = wire_format.encode(order, content_type)
+    # The message id lets the engine drop this order if it is ever redelivered
+    properties = metrics.stamp(pika.BasicProperties(content_type=content_type, message_id=uuid.uuid4().hex))
+    try:
+        _get_channel().basic_publish(exchange='', routing_key=ORDERS_QUEUE, body=body, properties=properties)
+    except pika.exceptions.AMQPConnectionError:
+        # The pooled connection went away (e.g. idle heartbeat timeout); retry once on a fresh one
+        close()
+        _get_channel().basic_publish(exchange='', routing_key=ORDERS_QUEUE, body=body, properties=properties)
     print(f"Order placed: {order}")
-    connection.close()
-
-while True:
-    order_type = input("Enter order type (buy/sell): ")
-    stock = input("Enter stock symbol (e.g., AAPL, TSLA): ")
-    price = float(input("Enter price: "))
-    quantity = int(input("Enter quantity: "))
-    place_order(order_type, stock, price, quantity)
+
+def close():
+    """Closes the pooled connection."""
+    transport.close_pooled()
+
+class BulkSender:
+    """Streams many orders over one channel without waiting on each publish.
+
+    Publishes are paced to `rate` orders/sec (unlimited if None). With
+    `confirm`, publisher confirms are tracked asynchronously: up to
+    `max_outstanding` orders may be unconfirmed at a time, and the delay
+    from publish to confirm is recorded per order.
+    """
+
+    def __init__(self, orders, rate=None, confirm=False, content_type=wire_format.JSON_CONTENT_TYPE,
+                 host=None, max_outstanding=10000, chunk=500):
+        self.orders = iter(orders)
+        self.rate = rate
+        self.confirm = confirm
+        self.content_type = content_type
+        self.host = host
+        self.max_outstanding = max_outstanding
+        self.chunk = chunk
+        self.properties = pika.BasicProperties(content_type=content_type,
+                                               delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE)
+        self.connection = None
+        self.channel = None
+        self.sent = 0
+        self.acked = 0
+        self.nacked = 0
+        self.unconfirmed = {}  # delivery tag -> publish time
+        self.confirm_latencies = []
+        self.exhausted = False
+        self.scheduled = False
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        """Sends every order and returns a report dict."""
+        # Asynchronous confirms need pika's SelectConnection, so this always talks to RabbitMQ
+        self.connection = pika.SelectConnection(transport.parameters(self.host),
+                                                on_open_callback=self._on_open,
+                                                on_open_error_callback=self._on_open_error,
+                                                on_close_callback=self._on_closed)
+        self.connection.ioloop.start()
+        return self.report()
+
+    def _on_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_open_error(self, connection, error):
+        print(f"Failed to connect to RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def _on_closed(self, connection, reason):
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.queue_declare(queue=ORDERS_QUEUE, durable=True, callback=self._on_declared)
+
+    def _on_declared(self, frame):
+        if self.confirm:
+            self.channel.confirm_delivery(self._on_confirm)
+        self.started = time.monotonic()
+        self._send()
+
+    def _schedule(self, delay):
+        if not self.scheduled:
+            self.scheduled = True
+            self.connection.ioloop.call_later(delay, self._send)
+
+    def _send(self):
+        self.scheduled = False
+        now = time.monotonic()
+        budget = self.chunk
+        if self.rate:
+            budget = min(budget, int(self.rate * (now - self.started)) + 1 - self.sent)
+        if self.confirm:
+            budget = min(budget, self.max_outstanding - len(self.unconfirmed))
+
+        for _ in range(max(budget, 0)):
+            order = next(self.orders, None)
+            if order is None:
+                self.exhausted = True
+                break
+            self.channel.basic_publish(exchange='', routing_key=ORDERS_QUEUE,
+                                       body=wire_format.encode(order, self.content_type),
+                                       properties=self.properties)
+            self.sent += 1
+            if self.confirm:
+                self.unconfirmed[self.sent] = time.monotonic()
+
+        if self.exhausted:
+            self._finish_if_done()
+        elif self.confirm and len(self.unconfirmed) >= self.max_outstanding:
+            pass  # resumed by _on_confirm
+        elif self.rate and budget <= 0:
+            # Ahead of schedule: wait until the next order is due
+            self._schedule(max((self.sent + 1) / self.rate - (now - self.started), 0.001))
+        else:
+            # Yield to the ioloop so frames get written and confirms read
+            self._schedule(0)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        acked = method.NAME == 'Basic.Ack'
+        now = time.monotonic()
+        if method.multiple:
+            tags = []
+            for tag in self.unconfirmed:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag]
+        blocked = len(self.unconfirmed) >= self.max_outstanding
+        for tag in tags:
+            sent_at = self.unconfirmed.pop(tag, None)
+            if sent_at is None:
+                continue
+            if acked:
+                self.acked += 1
+                self.confirm_latencies.append(now - sent_at)
+            else:
+                self.nacked += 1
+        if self.exhausted:
+            self._finish_if_done()
+        elif blocked:
+            self._schedule(0)
+
+    def _finish_if_done(self):
+        if self.confirm and self.unconfirmed:
+            return
+        if self.finished is None:
+            self.finished = time.monotonic()
+            self.connection.close()
+
+    def report(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        report = {"sent": self.sent, "seconds": elapsed,
+                  "send_rate": self.sent / elapsed if elapsed > 0 else 0.0}
+        if self.confirm:
+            latencies = sorted(self.confirm_latencies)
+            report.update(acked=self.acked, nacked=self.nacked, unconfirmed=len(self.unconfirmed))
+            if latencies:
+                report["confirm_latency_ms"] = {
+                    "p50": latencies[len(latencies) // 2] * 1000,
+                    "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                    "max": latencies[-1] * 1000,
+                }
+        return report
+
+def interactive():
+    while True:
+        order_type = input("Enter order type (buy/sell): ")
+        stock = input("Enter stock symbol (e.g., AAPL, TSLA): ")
+        price = float(input("Enter price: "))
+        quantity = int(input("Enter quantity: "))
+        place_order(order_type, stock, price, quantity)
+
+def main():
+    parser = argparse.ArgumentParser(description="Place orders interactively or in bulk")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--file", help="stream orders from a .csv or .jsonl file")
+    source.add_argument("--generate", type=int, metavar="N", help="send N synthetic orders")
+    parser.add_argument("--rate", type=float, help="target orders/sec (default: as fast as possible)")
+    parser.add_argument("--confirm", action="store_true", help="use publisher confirms and report their latency")
+    parser.add_argument("--format", choices=["json", "binary"], default="json")
+    parser.add_argument("--symbols", type=int, default=10, help="symbols for --generate")
+    parser.add_argument("--cross-rate", type=float, default=0.1, help="aggressive order share for --generate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--host", help="RabbitMQ host (default: $RABBITMQ_HOST or localhost)")
+    args = parser.parse_args()
+
+    if args.file is None and args.generate is None:
+        try:
+            interactive()
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            close()
+        return
+
+    # Imported lazily: only bulk mode needs the order readers and generator
+    from order_flow import iter_orders, generate_orders
+    if args.file:
+        orders = iter_orders(args.file)
+    else:
+        # Time-based ids keep repeated runs from colliding in the engine's books. The
+        # book-seeding orders come first and count towards N, so exactly N are sent.
+        orders = itertools.islice(generate_orders(args.generate, seed=args.seed, symbols=args.symbols,
+                                                  cross_rate=args.cross_rate, first_id=int(time.time()) * 1000000),
+                                  args.generate)
+    content_type = wire_format.BINARY_CONTENT_TYPE if args.format == "binary" else wire_format.JSON_CONTENT_TYPE
+
+    report = BulkSender(orders, args.rate, args.confirm, content_type, args.host).run()
+    print(f"Sent {report['sent']:,} orders in {report['seconds']:.2f}s ({report['send_rate']:,.0f} orders/sec)")
+    if args.confirm:
+        print(f"Confirmed {report['acked']:,}, nacked {report['nacked']:,}, "
+              f"unconfirmed {report['unconfirmed']:,}")
+        if "confirm_latency_ms" in report:
+            latency = report["confirm_latency_ms"]
+            print(f"Confirm latency ms: p50 {latency['p50']:.2f}  p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import uuid
+
+import pytest
+
+from chat import decode_message, make_message
+from chat_history import ChatHistory, INDEX_RECORD
+
+
+def fill(history, room, count):
+    return [history.append(make_message(room, "alice", f"{room} {n}")) for n in range(count)]
+
+
+def texts(messages):
+    return [message["text"] for message in messages]
+
+
+def test_last_and_since_page_through_a_room(tmp_path):
+    history = ChatHistory(str(tmp_path), ring_size=5)
+    fill(history, "general", 12)
+    messages, more = history.last("general", 3)
+    assert texts(messages) == ["general 9", "general 10", "general 11"] and more
+    older, _ = history.last("general", 3, before=messages[0]["id"])
+    assert texts(older) == ["general 6", "general 7", "general 8"]
+    # Ids older than the ring are found through the index file
+    oldest, more = history.last("general", 3, before=older[0]["id"])
+    assert texts(oldest) == ["general 3", "general 4", "general 5"]
+    newer, more = history.since("general", oldest[0]["id"], 2)
+    assert texts(newer) == ["general 4", "general 5"] and more
+    history.close()
+
+
+def test_ids_are_bounded_by_the_ring(tmp_path):
+    history = ChatHistory(str(tmp_path), ring_size=5)
+    fill(history, "general", 50)
+    assert len(history.rooms["general"].ids) == 5
+    history.close()
+
+
+def test_recover_reindexes_a_room_whose_index_lagged(tmp_path):
+    history = ChatHistory(str(tmp_path), ring_size=4)
+    fill(history, "a", 3)
+    fill(history, "b", 3)
+    fill(history, "a", 2)
+    fill(history, "b", 2)
+    history.close()
+    # Room a's index lost its last four records; b's index is complete
+    path = os.path.join(tmp_path, "a.idx")
+    with open(path, "r+b") as f:
+        f.truncate(INDEX_RECORD.size)
+
+    history = ChatHistory(str(tmp_path), ring_size=4)
+    assert len(history.rooms["a"].offsets) == 5
+    assert len(history.rooms["b"].offsets) == 5
+    assert texts(history.last("a", 10)[0]) == ["a 0", "a 1", "a 2", "a 0", "a 1"]
+    assert texts(history.last("b", 10)[0]) == ["b 0", "b 1", "b 2", "b 0", "b 1"]
+    history.close()
+
+
+def test_recover_drops_a_torn_log_line(tmp_path):
+    history = ChatHistory(str(tmp_path))
+    fill(history, "a", 2)
+    history.close()
+    with open(os.path.join(tmp_path, "messages.log"), "ab") as f:
+        f.write(b'{"id":"')
+    history = ChatHistory(str(tmp_path))
+    assert texts(history.last("a", 10)[0]) == ["a 0", "a 1"]
+    history.append(make_message("a", "bob", "after"))
+    history.close()
+    assert texts(ChatHistory(str(tmp_path)).last("a", 10)[0]) == ["a 0", "a 1", "after"]
+
+
+def test_redelivered_messages_are_stored_once(tmp_path):
+    history = ChatHistory(str(tmp_path))
+    message = make_message("a", "alice", "hi")
+    assert history.append(message) == history.append(dict(message)) == 0
+    assert len(history.rooms["a"].offsets) == 1
+    history.close()
+
+
+@pytest.mark.parametrize("request_", [
+    None, [], {}, {"room": 1}, {"room": "a", "last": "ten"}, {"room": "a", "before": 5},
+    {"room": "a", "since": "not-a-uuid"}, {"room": "a", "since": uuid.uuid4().hex},
+])
+def test_malformed_requests_get_an_error(tmp_path, request_):
+    history = ChatHistory(str(tmp_path))
+    fill(history, "a", 2)
+    assert "error" in history.answer(request_)
+    history.close()
+
+
+def test_old_ids_are_found_after_restart_and_rebuilt_lookup(tmp_path):
+    history = ChatHistory(str(tmp_path), ring_size=3)
+    fill(history, "a", 10)
+    first = history.last("a", 10)[0][0]
+    history.close()
+    history = ChatHistory(str(tmp_path), ring_size=3)
+    assert texts(history.since("a", first["id"], 2)[0]) == ["a 1", "a 2"]
+    history.close()
+    # A lost ids.db is refilled from the index files
+    for name in os.listdir(tmp_path):
+        if name.startswith("ids.db"):
+            os.remove(os.path.join(tmp_path, name))
+    history = ChatHistory(str(tmp_path), ring_size=3)
+    assert texts(history.since("a", first["id"], 2)[0]) == ["a 1", "a 2"]
+    history.close()
+
+
+def test_stored_messages_take_the_room_from_the_routing_key(tmp_path):
+    history = ChatHistory(str(tmp_path))
+    history.append(decode_message(b'{"text": "x", "room": null}', "general"))
+    history.append(decode_message(b'{"text": "y", "room": "other", "ts": "now", "user": ["bob"]}', "general"))
+    messages = history.last("general", 10)[0]
+    assert texts(messages) == ["x", "y"]
+    assert all(isinstance(message["ts"], float) and message["user"] is None for message in messages)
+    assert "other" not in history.rooms
+    history.close()
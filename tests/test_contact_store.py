@@ -0,0 +1,111 @@
+from contact_store import ContactStore
+
+
+def test_intervals_open_extend_and_close():
+    store = ContactStore()
+    assert store.update("a", ["b"], 10) == ["b"]
+    assert store.update("b", ["a"], 15) == []
+    assert store.query("a") == [("b", 10, 15)]
+    assert store.update("a", [], 20) == []
+    assert store.query("a") == [("b", 10, 20)]
+    assert store.query("b") == [("a", 10, 20)]
+    assert store.active == {}
+    assert store.update("a", ["b"], 30) == ["b"]
+    assert store.query("a") == [("b", 30, 30), ("b", 10, 20)]
+
+
+def test_query_since_filters_by_end():
+    store = ContactStore()
+    store.update("a", ["b"], 10)
+    store.update("a", ["c"], 20)
+    store.update("a", [], 30)
+    store.update("a", ["d"], 40)
+    assert [c[0] for c in store.query("a")] == ["d", "c", "b"]
+    assert [c[0] for c in store.query("a", since=25)] == ["d", "c"]
+    assert [c[0] for c in store.query("a", since=41)] == []
+
+
+def test_version_changes_only_when_intervals_open_or_close():
+    store = ContactStore()
+    store.update("a", ["b"], 1)
+    version = store.version
+    store.update("a", ["b"], 2)
+    assert store.version == version
+    store.update("a", [], 3)
+    assert store.version > version
+
+
+def test_evict_drops_intervals_past_retention():
+    store = ContactStore(retention=100)
+    store.update("a", ["b"], 0)
+    store.update("a", [], 5)
+    store.update("c", ["d"], 50)
+    assert len(store) == 4
+    store.evict(106)
+    assert store.query("a") == [] and "a" not in store.history
+    assert store.query("c") == [("d", 50, 50)]
+
+
+def test_idle_people_have_their_contacts_closed():
+    store = ContactStore(idle_timeout=60)
+    forgotten = []
+    store.on_idle = forgotten.extend
+    store.update("a", ["b"], 0)
+    store.update("b", ["a"], 10)
+    store.update("c", ["d"], 20)
+    store.update("d", [], 25)
+    # Nobody in the a-b pair reports again; c keeps updating on its own
+    for now in range(30, 200, 10):
+        store.update("c", [], now)
+    assert sorted(forgotten) == ["a", "b", "d"]
+    assert "a" not in store.active and "b" not in store.active
+    assert store.query("a") == [("b", 0, 10)]
+    assert set(store.last_seen) == {"c"}
+    # History stays in end order, so since-queries still bisect correctly
+    assert [c[0] for c in store.query("c", since=21)] == ["d"]
+
+
+def test_refresh_without_seen_does_not_keep_people_alive():
+    store = ContactStore(idle_timeout=60)
+    store.update("a", ["b"], 0)
+    store.update("b", ["a"], 0)
+    for now in range(10, 100, 10):
+        store.update("b", ["a"], now, seen=False)
+    assert store.active == {}
+    assert store.query("a") == [("b", 0, 90)]
+
+
+def test_trace_respects_time_and_hops():
+    store = ContactStore()
+    store.update("a", ["b"], 10)
+    store.update("a", [], 20)
+    # c met b after b met a, so exposure passes on; d met b before
+    store.update("b", ["c"], 30)
+    store.update("b", [], 40)
+    store.update("d", ["b"], 1)
+    store.update("d", [], 5)
+    store.update("c", ["e"], 50)
+    store.update("c", [], 60)
+    assert store.trace(["a"], since=0, hops=1) == {"b": (1, 10, "a")}
+    assert store.trace(["a"], since=0, hops=3) == {"b": (1, 10, "a"), "c": (2, 30, "b"), "e": (3, 50, "c")}
+
+
+def test_trace_keeps_hop_and_via_consistent_when_a_later_hop_is_earlier():
+    store = ContactStore()
+    # a meets x late, but reaches x earlier through b
+    store.update("a", ["b"], 1)
+    store.update("a", [], 2)
+    store.update("b", ["x"], 3)
+    store.update("b", [], 4)
+    store.update("a", ["x"], 100)
+    store.update("a", [], 101)
+    reached = store.trace(["a"], since=0, hops=2)
+    assert reached["x"] == (2, 3, "b")
+    hop, _, via = reached["x"]
+    assert reached[via][0] == hop - 1
+
+
+def test_trace_accepts_repeated_start_ids():
+    store = ContactStore()
+    store.update("a", ["b"], 10)
+    assert store.trace(["a", "a"], hops=2) == {"b": (1, 10, "a")}
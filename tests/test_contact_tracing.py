@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import Contact_tracing
+from contact_store import ContactStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = ContactStore()
+    monkeypatch.setattr(Contact_tracing, "contacts", store)
+    return store
+
+
+def query(request):
+    return Contact_tracing.answer_query(Contact_tracing.parse_query(json.dumps(request).encode()))
+
+
+def test_repeated_ids_are_answered_once(store):
+    store.update("a", ["b"], 10)
+    store.update("b", ["c"], 20)
+    assert Contact_tracing.parse_query(b'{"ids": ["a", "a"], "hops": 2}')["ids"] == ["a"]
+    response = query({"ids": ["a", "a"], "hops": 2})
+    assert list(response["contacts"]) == ["a"]
+    assert response["trace"] == {"b": {"hop": 1, "time": 10, "via": "a"},
+                                 "c": {"hop": 2, "time": 20, "via": "b"}}
+
+
+def test_bare_id_is_a_single_id_query():
+    assert Contact_tracing.parse_query(b"a") == {"id": "a"}
+
+
+@pytest.mark.parametrize("body", [
+    b'{"ids": [1, "a"]}',
+    b'{"ids": [["x"]]}',
+    b'{"ids": []}',
+    b'{"ids": "a"}',
+    b'{"id": 7}',
+    b'{"ids": ["a"], "since": "yesterday"}',
+    b'{"ids": ["a"], "since": NaN}',
+    b'{"ids": ["a"], "hops": 0}',
+    b'{"ids": ["a"], "hops": 1.5}',
+    b'{"ids": ["a"], "hops": true}',
+    b'{"since": 10}',
+    b'{"ids": ["a"',
+    b'\xff',
+])
+def test_malformed_queries_are_rejected(body):
+    with pytest.raises(ValueError):
+        Contact_tracing.parse_query(body)
@@ -0,0 +1,68 @@
+from market_depth import DepthFeed, DepthView
+from order_book import OrderBook, BUY, SELL
+
+
+def snapshot(seq, bids=(), asks=(), epoch="e1"):
+    return {"type": "snapshot", "stock": "AAPL", "epoch": epoch, "seq": seq, "bids": list(bids), "asks": list(asks)}
+
+
+def delta(seq, bids=(), asks=(), epoch="e1"):
+    return {"type": "delta", "stock": "AAPL", "epoch": epoch, "seq": seq, "bids": list(bids), "asks": list(asks)}
+
+
+def test_deltas_before_a_snapshot_are_ignored():
+    view = DepthView("AAPL")
+    assert view.apply(delta(1, bids=[(10.0, 5)])) is False
+    assert view.top() == ([], [])
+
+
+def test_deltas_update_and_remove_levels():
+    view = DepthView("AAPL")
+    assert view.apply(snapshot(3, bids=[(10.0, 5)], asks=[(11.0, 2)]))
+    assert view.apply(delta(4, bids=[(10.0, 0), (9.5, 1)], asks=[(10.5, 4)]))
+    assert view.top() == ([(9.5, 1)], [(10.5, 4), (11.0, 2)])
+    assert view.seq == 4
+
+
+def test_old_and_foreign_epoch_deltas_are_ignored():
+    view = DepthView("AAPL")
+    view.apply(snapshot(3, bids=[(10.0, 5)]))
+    assert view.apply(delta(3, bids=[(10.0, 1)])) is False
+    assert view.apply(delta(4, bids=[(10.0, 1)], epoch="e2")) is False
+    assert view.top() == ([(10.0, 5)], [])
+    assert not view.stale
+
+
+def test_sequence_gap_marks_view_stale_until_resync():
+    view = DepthView("AAPL")
+    view.apply(snapshot(1, bids=[(10.0, 5)]))
+    assert view.apply(delta(3, bids=[(10.0, 1)])) is False
+    assert view.stale
+    # Later deltas, even the missing one, wait for the next snapshot
+    assert view.apply(delta(2, bids=[(10.0, 2)])) is False
+    assert view.apply(delta(4, bids=[(10.0, 3)])) is False
+    assert view.top() == ([(10.0, 5)], [])
+
+    assert view.apply(snapshot(4, bids=[(10.0, 3)], asks=[(12.0, 1)], epoch="e2"))
+    assert not view.stale
+    assert view.apply(delta(5, asks=[(12.0, 0)], epoch="e2"))
+    assert view.top() == ([(10.0, 3)], [])
+
+
+def test_view_resyncs_from_feed_after_a_lost_delta():
+    feed = DepthFeed()
+    book = OrderBook("AAPL")
+    feed.track(book)
+    view = DepthView("AAPL")
+    assert view.apply(feed.snapshot(book))
+    book.add(1, BUY, 100, 5)
+    assert view.apply(feed.delta(book))
+    book.add(2, SELL, 101, 2)
+    feed.delta(book)  # lost in transit
+    book.add(3, BUY, 99, 1)
+    assert view.apply(feed.delta(book)) is False
+    assert view.stale
+    assert view.apply(feed.snapshot(book))
+    book.add(4, SELL, 102, 3)
+    assert view.apply(feed.delta(book))
+    assert view.top() == (book.depth(BUY), book.depth(SELL))
@@ -0,0 +1,21 @@
+import logging
+
+import metrics
+
+
+def record(level):
+    return logging.LogRecord("test", level, __file__, 1, "message", None, None)
+
+
+def test_rate_limit_applies_to_warnings_but_not_errors():
+    rate_filter = metrics.RateLimitFilter(rate=2)
+    assert [rate_filter.filter(record(logging.WARNING)) for _ in range(4)] == [True, True, False, False]
+    assert rate_filter.filter(record(logging.ERROR))
+    assert rate_filter.suppressed == 0  # the error reported the two dropped warnings
+
+
+def test_quiet_logging_restores_the_previous_level():
+    with metrics.quiet_logging():
+        assert not logging.getLogger("test").isEnabledFor(logging.WARNING)
+        assert logging.getLogger("test").isEnabledFor(logging.ERROR)
+    assert logging.getLogger("test").isEnabledFor(logging.WARNING)
@@ -0,0 +1,88 @@
+import pytest
+
+from order_book import OrderBook, BUY, SELL
+
+
+def test_best_prices_and_depth():
+    book = OrderBook("AAPL")
+    book.add(1, BUY, 100, 5)
+    book.add(2, BUY, 101, 3)
+    book.add(3, SELL, 103, 4)
+    book.add(4, SELL, 102, 2)
+    book.add(5, BUY, 101, 1)
+    assert book.best_bid() == 101
+    assert book.best_ask() == 102
+    assert book.depth(BUY) == [(101, 4), (100, 5)]
+    assert book.depth(SELL, levels=1) == [(102, 2)]
+    assert book.match() == []
+
+
+def test_match_at_resting_price_in_time_priority():
+    book = OrderBook("AAPL")
+    book.add(1, SELL, 100, 2)
+    book.add(2, SELL, 100, 2)
+    book.add(3, SELL, 99, 1)
+    book.add(4, BUY, 101, 4)
+    trades = book.match()
+    assert [(t["price"], t["quantity"], t["sell_order_id"]) for t in trades] == [(99, 1, 3), (100, 2, 1), (100, 1, 2)]
+    assert all(t["buy_order_id"] == 4 for t in trades)
+    assert book.best_bid() is None
+    assert book.depth(SELL) == [(100, 1)]
+    assert book.orders[2].quantity == 1
+
+
+def test_incoming_order_trades_at_resting_bid():
+    book = OrderBook("AAPL")
+    book.add(1, BUY, 105, 3)
+    book.add(2, SELL, 100, 3)
+    assert [t["price"] for t in book.match()] == [105]
+    assert book.orders == {}
+
+
+def test_cancel_and_reduce_keep_priority_and_levels():
+    book = OrderBook("AAPL", track_changes=True)
+    book.add(1, BUY, 100, 5)
+    book.add(2, BUY, 100, 5)
+    book.add(3, BUY, 99, 5)
+    book.reduce(1, 2)
+    assert book.level_quantity(BUY, 100) == 8
+    assert book.cancel(3).order_id == 3
+    assert book.depth(BUY) == [(100, 8)]
+    assert book.cancel(3) is None
+    assert book.reduce(2, 10).quantity == 0
+    book.add(4, SELL, 100, 3)
+    trades = book.match()
+    assert [(t["buy_order_id"], t["quantity"]) for t in trades] == [(1, 3)]
+    assert (BUY, 99) in book.changed
+
+
+@pytest.mark.parametrize("quantity", [0, -1])
+def test_non_positive_quantities_are_rejected(quantity):
+    book = OrderBook("AAPL")
+    with pytest.raises(ValueError):
+        book.add(1, BUY, 100, quantity)
+    book.add(2, BUY, 100, 5)
+    with pytest.raises(ValueError):
+        book.reduce(2, quantity)
+    assert book.orders[2].quantity == 5
+    assert book.level_quantity(BUY, 100) == 5
+
+
+def test_duplicate_ids_and_unknown_sides_are_rejected():
+    book = OrderBook("AAPL")
+    book.add(1, BUY, 100, 1)
+    with pytest.raises(ValueError):
+        book.add(1, SELL, 101, 1)
+    with pytest.raises(ValueError):
+        book.add(2, "hold", 101, 1)
+
+
+def test_snapshot_restore_round_trip():
+    book = OrderBook("AAPL")
+    book.add(1, BUY, 100, 5)
+    book.add(2, BUY, 100, 3)
+    book.add(3, SELL, 102, 4)
+    restored = OrderBook.restore(book.snapshot())
+    assert restored.snapshot() == book.snapshot()
+    restored.add(4, SELL, 100, 6)
+    assert [t["buy_order_id"] for t in restored.match()] == [1, 2]
@@ -0,0 +1,55 @@
+import os
+
+from order_journal import Journal, SEGMENT_PREFIX
+
+
+def test_recover_replays_committed_records(tmp_path):
+    journal = Journal(str(tmp_path))
+    assert journal.recover() == (None, [])
+    journal.append({"op": "order", "n": 1})
+    journal.append({"op": "order", "n": 2})
+    journal.commit()
+    journal.append({"op": "order", "n": 3})  # never committed
+    journal.file.close()
+
+    state, records = Journal(str(tmp_path)).recover()
+    assert state is None
+    assert [(r["seq"], r["n"]) for r in records] == [(1, 1), (2, 2)]
+
+
+def test_recover_truncates_torn_tail(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.recover()
+    for n in range(3):
+        journal.append({"op": "order", "n": n})
+    journal.commit()
+    journal.file.close()
+    segment = [name for name in os.listdir(tmp_path) if name.startswith(SEGMENT_PREFIX)][0]
+    path = os.path.join(tmp_path, segment)
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b'{"op":"order","n":3,"se')
+
+    journal = Journal(str(tmp_path))
+    state, records = journal.recover()
+    assert [r["n"] for r in records] == [0, 1, 2]
+    assert os.path.getsize(path) == intact
+    assert journal.append({"op": "order", "n": 3}) == 4
+    journal.close()
+    assert [r["seq"] for r in Journal(str(tmp_path)).recover()[1]] == [1, 2, 3, 4]
+
+
+def test_snapshot_rolls_the_journal(tmp_path):
+    journal = Journal(str(tmp_path), snapshot_every=2)
+    journal.recover()
+    journal.append({"op": "order", "n": 1})
+    journal.append({"op": "order", "n": 2})
+    journal.commit()
+    assert journal.snapshot_due()
+    journal.snapshot({"books": ["state"]})
+    journal.append({"op": "order", "n": 3})
+    journal.close()
+
+    state, records = Journal(str(tmp_path)).recover()
+    assert state["books"] == ["state"] and state["seq"] == 2
+    assert [r["n"] for r in records] == [3]
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+import order_matching
+import transport
+
+
+class FakePublisher:
+    def __init__(self):
+        self.buffer = []
+        self.trades = []
+
+    def publish(self, trade):
+        self.buffer.append(trade)
+
+    def flush(self):
+        self.trades += self.buffer
+        self.buffer = []
+
+    def flush_if_due(self):
+        self.flush()
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.rejected = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.rejected.append((delivery_tag, requeue))
+
+
+@pytest.fixture
+def engine():
+    order_matching.order_books.clear()
+    order_matching.applied.clear()
+    order_matching.journal = None
+    order_matching.depth_feed = None
+    order_matching.next_order_id = 1
+    order_matching.trade_publisher = FakePublisher()
+    yield order_matching
+    if order_matching.journal is not None:
+        order_matching.journal.close()
+        order_matching.journal = None
+
+
+def deliver(channel, tag, order, message_id=None):
+    method = SimpleNamespace(delivery_tag=tag, redelivered=False)
+    properties = SimpleNamespace(content_type="application/json", message_id=message_id)
+    body = order if isinstance(order, bytes) else json.dumps(order).encode()
+    return order_matching.callback(channel, method, properties, body)
+
+
+def test_redelivery_after_crash_is_not_applied_twice(engine, tmp_path):
+    engine.recover(str(tmp_path))
+    engine.process_order({"type": "sell", "stock": "AAPL", "price": 10.0, "quantity": 5, "id": 1})
+    engine.process_order({"type": "buy", "stock": "AAPL", "price": 10.0, "quantity": 2, "id": 2})
+    engine.process_order({"type": "reduce", "stock": "AAPL", "id": 1, "quantity": 1}, message_id="r1")
+    engine.commit()
+    engine.journal.commit()  # the "published" marker, so recovery does not republish the fill
+    assert len(engine.trade_publisher.trades) == 1
+    # Crash after the fsync, before the ack: the broker redelivers all three
+    engine.journal.file.close()
+    engine.journal = None
+    engine.trade_publisher = FakePublisher()
+
+    engine.recover(str(tmp_path))
+    engine.process_order({"type": "sell", "stock": "AAPL", "price": 10.0, "quantity": 5, "id": 1})
+    engine.process_order({"type": "buy", "stock": "AAPL", "price": 10.0, "quantity": 2, "id": 2})
+    engine.process_order({"type": "reduce", "stock": "AAPL", "id": 1, "quantity": 1}, message_id="r1")
+    engine.commit()
+    assert engine.trade_publisher.trades == []
+    assert engine.order_books["AAPL"].depth("sell") == [(10.0, 2)]
+
+
+def test_dedupe_window_survives_snapshots(engine, tmp_path):
+    engine.recover(str(tmp_path))
+    engine.process_order({"type": "buy", "stock": "AAPL", "price": 10.0, "quantity": 1, "id": 7})
+    engine.journal.snapshot(engine.snapshot_state())
+    engine.journal.close()
+    engine.recover(str(tmp_path))
+    engine.process_order({"type": "buy", "stock": "AAPL", "price": 10.0, "quantity": 1, "id": 7})
+    assert engine.order_books["AAPL"].depth("buy") == [(10.0, 1)]
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b"[1, 2]",
+    json.dumps({"type": "buy", "stock": "AAPL", "price": 10.0}).encode(),
+    json.dumps({"type": "hold", "stock": "AAPL", "price": 10.0, "quantity": 1}).encode(),
+    json.dumps({"type": "cancel", "stock": "AAPL"}).encode(),
+    json.dumps({"type": "buy", "stock": "AAPL", "price": float("nan"), "quantity": 1}).encode(),
+    json.dumps({"type": "sell", "stock": "AAPL", "price": float("inf"), "quantity": 1}).encode(),
+    json.dumps({"type": "cancel", "stock": "AAPL", "id": True}).encode(),
+    json.dumps({"type": "reduce", "stock": "AAPL", "id": [1], "quantity": 1}).encode(),
+])
+def test_malformed_orders_are_rejected_without_requeue(engine, body):
+    channel = FakeChannel()
+    assert deliver(channel, 1, body) is False
+    assert channel.rejected == [(1, False)]
+    assert channel.acked == []
+
+
+def test_well_formed_order_is_acked(engine):
+    channel = FakeChannel()
+    assert deliver(channel, 1, {"type": "buy", "stock": "AAPL", "price": 10.0, "quantity": 1}) is True
+    assert channel.acked == [1]
+    assert engine.order_books["AAPL"].best_bid() == 10.0
+
+
+@pytest.fixture
+def local_broker():
+    previous = transport.TRANSPORT
+    transport.use('local')
+    yield transport.reset_local()
+    transport.TRANSPORT = previous
+
+
+def test_router_forwards_batches_in_order(local_broker):
+    connection = transport.connect()
+    channel = connection.channel()
+    channel.queue_declare(queue=order_matching.ORDERS_QUEUE, durable=True)
+    for i in range(10):
+        order = {"type": "buy", "stock": "AAPL" if i % 2 else "MSFT", "price": 10.0 + i, "quantity": 1}
+        channel.basic_publish(exchange='', routing_key=order_matching.ORDERS_QUEUE, body=json.dumps(order).encode(),
+                              properties=pika.BasicProperties(content_type="application/json"))
+    channel.basic_publish(exchange='', routing_key=order_matching.ORDERS_QUEUE, body=b"not json")
+
+    router = threading.Thread(target=order_matching.run_router, args=(2,), kwargs={"batch_size": 4})
+    router.start()
+    deadline = time.monotonic() + 5
+    while not local_broker.idle(order_matching.ORDERS_QUEUE) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    local_broker.stop_all()
+    router.join(5)
+
+    assert local_broker.idle(order_matching.ORDERS_QUEUE)
+    forwarded = {}
+    for shard in range(2):
+        for _, _, _, body, _ in local_broker.queues[order_matching.shard_queue(shard)].messages:
+            order = json.loads(body)
+            forwarded.setdefault(order["stock"], []).append(order["price"])
+    assert forwarded == {"MSFT": [10.0, 12.0, 14.0, 16.0, 18.0], "AAPL": [11.0, 13.0, 15.0, 17.0, 19.0]}
+    connection.close()
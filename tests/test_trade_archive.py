@@ -0,0 +1,119 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import trade_archive
+from trade_archive import DAY, TradeArchive, compact
+from trade_logging import connect
+
+TODAY = 20000 * DAY
+
+
+def insert(db_path, rows):
+    connection = connect(db_path)
+    with connection:
+        connection.executemany('INSERT INTO trades (stock, price, quantity, ts) VALUES (?, ?, ?, ?)', rows)
+    connection.close()
+
+
+def remaining(db_path):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute('SELECT count(*) FROM trades').fetchone()[0]
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "trading.db"), str(tmp_path / "archive")
+
+
+def test_compact_moves_closed_days(paths):
+    db_path, archive_dir = paths
+    # Two trades share a timestamp, as trades from one logged batch do
+    insert(db_path, [("AAPL", 10.0, 1, TODAY - DAY + 5), ("AAPL", 10.0, 1, TODAY - DAY + 5),
+                     ("AAPL", 20.0, 2, TODAY - DAY + 1), ("AAPL", 30.0, 1, TODAY + 1)])
+    assert compact(db_path, archive_dir, before=TODAY) == 3
+    assert remaining(db_path) == 1
+    archive = TradeArchive(archive_dir, db_path)
+    ts, price, quantity = archive.load("AAPL", end=TODAY)
+    assert list(price) == [20.0, 10.0, 10.0]
+    assert archive.vwap("AAPL") == pytest.approx((40 + 10 + 10 + 30) / 5)
+    assert compact(db_path, archive_dir, before=TODAY) == 0
+
+
+def test_compact_after_crash_before_delete_does_not_duplicate(paths, monkeypatch):
+    db_path, archive_dir = paths
+    insert(db_path, [("AAPL", 10.0, 1, TODAY - DAY + 1), ("AAPL", 12.0, 3, TODAY - DAY + 2)])
+    write_day = trade_archive._write_day
+
+    def write_then_crash(*args):
+        write_day(*args)
+        raise SystemExit("crash before the DELETE")
+
+    monkeypatch.setattr(trade_archive, "_write_day", write_then_crash)
+    with pytest.raises(SystemExit):
+        compact(db_path, archive_dir, before=TODAY)
+    assert remaining(db_path) == 2
+    monkeypatch.setattr(trade_archive, "_write_day", write_day)
+
+    assert compact(db_path, archive_dir, before=TODAY) == 0
+    assert remaining(db_path) == 0
+    archive = TradeArchive(archive_dir, None)
+    assert len(archive.load("AAPL")[0]) == 2
+    assert archive.vwap("AAPL") == pytest.approx(46 / 4)
+
+
+def test_late_trades_merge_into_an_archived_day(paths):
+    db_path, archive_dir = paths
+    insert(db_path, [("AAPL", 10.0, 1, TODAY - DAY + 10)])
+    compact(db_path, archive_dir, before=TODAY)
+    insert(db_path, [("AAPL", 11.0, 1, TODAY - DAY + 5)])
+    assert compact(db_path, archive_dir, before=TODAY) == 1
+    ts, price, quantity = TradeArchive(archive_dir, None).load("AAPL")
+    assert list(price) == [11.0, 10.0]
+    assert np.all(np.diff(ts) >= 0)
+
+
+def test_crash_between_day_swap_renames_restores_old_day(paths, monkeypatch):
+    db_path, archive_dir = paths
+    insert(db_path, [("AAPL", 10.0, 1, TODAY - DAY + 10)])
+    compact(db_path, archive_dir, before=TODAY)
+    insert(db_path, [("AAPL", 11.0, 1, TODAY - DAY + 5)])
+    replace = os.replace
+    calls = []
+
+    def replace_then_crash(src, dst):
+        calls.append(dst)
+        if len(calls) == 2:
+            raise SystemExit("crash between the renames")
+        replace(src, dst)
+
+    monkeypatch.setattr(trade_archive.os, "replace", replace_then_crash)
+    with pytest.raises(SystemExit):
+        compact(db_path, archive_dir, before=TODAY)
+    monkeypatch.setattr(trade_archive.os, "replace", replace)
+    day = os.path.join(archive_dir, "AAPL", trade_archive.day_name(TODAY // DAY - 1))
+    assert not os.path.exists(day) and os.path.exists(day + ".old")
+
+    # Readers fall back to the old day until the next compaction restores it
+    assert list(TradeArchive(archive_dir, None).load("AAPL")[1]) == [10.0]
+    assert compact(db_path, archive_dir, before=TODAY) == 1
+    assert not os.path.exists(day + ".old")
+    assert list(TradeArchive(archive_dir, None).load("AAPL")[1]) == [11.0, 10.0]
+
+
+def test_leftover_old_day_is_removed(paths):
+    db_path, archive_dir = paths
+    insert(db_path, [("AAPL", 10.0, 1, TODAY - DAY + 10)])
+    compact(db_path, archive_dir, before=TODAY)
+    day = os.path.join(archive_dir, "AAPL", trade_archive.day_name(TODAY // DAY - 1))
+    os.makedirs(day + ".old")
+    assert TradeArchive(archive_dir, None).days("AAPL") == [TODAY // DAY - 1]
+    insert(db_path, [("AAPL", 11.0, 1, TODAY - DAY + 5)])
+    assert compact(db_path, archive_dir, before=TODAY) == 1
+    assert not os.path.exists(day + ".old")
+    assert list(TradeArchive(archive_dir, None).load("AAPL")[1]) == [11.0, 10.0]
@@ -0,0 +1,92 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import trade_logging
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.rejected = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.rejected.append((delivery_tag, requeue))
+
+
+@pytest.fixture
+def writer(tmp_path):
+    trade_logging._writer = trade_logging.TradeWriter(str(tmp_path / "trades.db"), max_batch=100)
+    yield trade_logging._writer
+    trade_logging._writer.close()
+    trade_logging._writer = None
+
+
+def deliver(channel, tag, message):
+    method = SimpleNamespace(delivery_tag=tag)
+    properties = SimpleNamespace(content_type="application/json")
+    body = message if isinstance(message, bytes) else json.dumps(message).encode()
+    trade_logging.log_trade(channel, method, properties, body)
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    b"42",
+    [{"stock": "AAPL", "price": 10.0, "quantity": 1}, "trade"],
+    {"stock": "AAPL", "quantity": 1},
+    {"stock": "AAPL", "price": 10.0},
+    {"price": 10.0, "quantity": 1},
+    {"stock": "AAPL", "price": float("nan"), "quantity": 1},
+    {"stock": "AAPL", "price": 10.0, "quantity": True},
+])
+def test_malformed_trades_are_rejected_without_requeue(writer, body):
+    channel = FakeChannel()
+    deliver(channel, 1, body)
+    assert channel.rejected == [(1, False)]
+    assert writer.rows == []
+
+
+def test_trades_are_acked_after_their_batch_commits(writer):
+    channel = FakeChannel()
+    deliver(channel, 1, [{"stock": "AAPL", "price": 10.0, "quantity": 2},
+                         {"stock": "AAPL", "price": 11.0, "quantity": 1}])
+    deliver(channel, 2, b"not json")
+    deliver(channel, 3, {"stock": "MSFT", "price": 20.0, "quantity": 5})
+    assert channel.acked == []
+    trade_logging.flush_and_ack(channel)
+    assert channel.acked == [(3, True)]
+    assert channel.rejected == [(2, False)]
+    count, = writer.connection.execute("SELECT count(*) FROM trades").fetchone()
+    assert count == 3
+
+
+def test_rollup_builds_candles_for_every_interval():
+    rows = [("AAPL", 10.0, 2, 120.0), ("AAPL", 12.0, 1, 120.5), ("AAPL", 9.0, 3, 121.0), ("MSFT", 50.0, 1, 130.0)]
+    candles, latest = trade_logging.rollup(rows)
+    by_key = {candle[:3]: candle[3:] for candle in candles}
+    # open, high, low, close, volume, notional, trades
+    assert by_key[("AAPL", 1, 120)] == (10.0, 12.0, 10.0, 12.0, 3, 32.0, 2)
+    assert by_key[("AAPL", 1, 121)] == (9.0, 9.0, 9.0, 9.0, 3, 27.0, 1)
+    assert by_key[("AAPL", 60, 2)] == (10.0, 12.0, 9.0, 9.0, 6, 59.0, 3)
+    assert by_key[("AAPL", 3600, 0)] == by_key[("AAPL", 60, 2)]
+    assert by_key[("MSFT", 60, 2)] == (50.0, 50.0, 50.0, 50.0, 1, 50.0, 1)
+    assert len(candles) == 7
+    assert sorted(latest) == [("AAPL", 9.0, 3, 121.0), ("MSFT", 50.0, 1, 130.0)]
+
+
+def test_flush_merges_batches_into_existing_candles(writer):
+    writer.rows = [("AAPL", 10.0, 2, 120.0), ("AAPL", 12.0, 1, 125.0)]
+    writer.flush()
+    writer.rows = [("AAPL", 8.0, 4, 130.0), ("AAPL", 11.0, 1, 185.0)]
+    writer.flush()
+    rows = writer.connection.execute(
+        'SELECT bucket, open, high, low, close, volume, notional, trades FROM candles '
+        'WHERE stock = ? AND interval = 60 ORDER BY bucket', ("AAPL",)).fetchall()
+    # The second batch keeps the first batch's open and widens high/low
+    assert rows == [(2, 10.0, 12.0, 8.0, 8.0, 7, 64.0, 3), (3, 11.0, 11.0, 11.0, 11.0, 1, 11.0, 1)]
+    assert writer.connection.execute(
+        'SELECT price, quantity, ts FROM latest_trade WHERE stock = ?', ("AAPL",)).fetchone() == (11.0, 1, 185.0)
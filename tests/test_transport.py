@@ -0,0 +1,159 @@
+import pika
+import pytest
+
+import transport
+from transport import LocalBroker, _topic_matches
+
+
+@pytest.fixture
+def connection():
+    connection = LocalBroker().connect()
+    yield connection
+    connection.close()
+
+
+def fill(channel, queue, count):
+    channel.queue_declare(queue=queue)
+    for n in range(count):
+        channel.basic_publish(exchange='', routing_key=queue, body=str(n).encode())
+
+
+def consumer(channel, queue, auto_ack=False):
+    received = []
+    channel.basic_consume(queue, lambda ch, method, properties, body: received.append((method, body)),
+                          auto_ack=auto_ack)
+    return received
+
+
+def test_prefetch_limits_unacked_deliveries(connection):
+    channel = connection.channel()
+    fill(channel, "q", 5)
+    channel.basic_qos(prefetch_count=2)
+    received = consumer(channel, "q")
+    connection.process_data_events()
+    assert [body for _, body in received] == [b"0", b"1"]
+    channel.basic_ack(delivery_tag=received[0][0].delivery_tag)
+    connection.process_data_events()
+    assert [body for _, body in received] == [b"0", b"1", b"2"]
+
+
+def test_deliveries_alternate_between_consumers(connection):
+    channel = connection.channel()
+    channel.queue_declare(queue="q")
+    first = consumer(channel, "q", auto_ack=True)
+    second = consumer(channel, "q", auto_ack=True)
+    fill(channel, "q", 4)
+    connection.process_data_events()
+    assert [body for _, body in first] == [b"0", b"2"]
+    assert [body for _, body in second] == [b"1", b"3"]
+
+
+def test_multiple_ack_settles_every_earlier_tag(connection):
+    channel = connection.channel()
+    fill(channel, "q", 3)
+    received = consumer(channel, "q")
+    connection.process_data_events()
+    channel.basic_ack(delivery_tag=received[1][0].delivery_tag, multiple=True)
+    assert list(channel.unacked) == [received[2][0].delivery_tag]
+    assert connection.broker.queues["q"].unacked == 1
+    assert not connection.broker.idle("q")
+    channel.basic_ack(delivery_tag=0, multiple=True)
+    assert connection.broker.idle("q")
+
+
+def test_unacked_messages_are_requeued_in_order_when_a_channel_closes(connection):
+    channel = connection.channel()
+    fill(channel, "q", 3)
+    received = consumer(channel, "q")
+    connection.process_data_events()
+    channel.basic_ack(delivery_tag=received[0][0].delivery_tag)
+    channel.close()
+
+    other = connection.channel()
+    redelivered = consumer(other, "q")
+    connection.process_data_events()
+    assert [(method.redelivered, body) for method, body in redelivered] == [(True, b"1"), (True, b"2")]
+
+
+def test_nack_requeues_and_reject_drops(connection):
+    channel = connection.channel()
+    fill(channel, "q", 2)
+    received = consumer(channel, "q")
+    connection.process_data_events()
+    channel.basic_reject(delivery_tag=received[0][0].delivery_tag, requeue=False)
+    channel.basic_nack(delivery_tag=received[1][0].delivery_tag)
+    connection.process_data_events()
+    assert [(method.redelivered, body) for method, body in received[2:]] == [(True, b"1")]
+
+
+@pytest.mark.parametrize("pattern, key, matches", [
+    ("depth.*", "depth.AAPL", True),
+    ("depth.*", "depth.AAPL.extra", False),
+    ("depth.*", "depth", False),
+    ("#", "anything.at.all", True),
+    ("#", "", True),
+    ("a.#.z", "a.z", True),
+    ("a.#.z", "a.b.c.z", True),
+    ("a.#.z", "a.b.c", False),
+    ("*.b", "a.b", True),
+])
+def test_topic_patterns(pattern, key, matches):
+    assert _topic_matches(pattern.split('.'), key.split('.')) is matches
+
+
+def test_topic_exchange_routes_to_each_bound_queue_once(connection):
+    channel = connection.channel()
+    channel.exchange_declare(exchange="rooms", exchange_type="topic")
+    for queue, key in (("all", "#"), ("general", "general"), ("star", "*")):
+        channel.queue_declare(queue=queue)
+        channel.queue_bind(queue=queue, exchange="rooms", routing_key=key)
+    channel.queue_bind(queue="all", exchange="rooms", routing_key="general")
+    assert connection.broker.publish("rooms", "general", None, b"hi") == 3
+    assert connection.broker.publish("rooms", "random.sub", None, b"hi") == 1
+    assert [len(connection.broker.queues[name].messages) for name in ("all", "general", "star")] == [2, 1, 1]
+
+
+def test_mandatory_unroutable_publish_raises_only_with_confirms(connection):
+    channel = connection.channel()
+    channel.basic_publish(exchange='', routing_key="missing", body=b"x", mandatory=True)
+    channel.confirm_delivery()
+    with pytest.raises(pika.exceptions.UnroutableError):
+        channel.basic_publish(exchange='', routing_key="missing", body=b"x", mandatory=True)
+    fill(channel, "q", 1)
+    channel.basic_publish(exchange='', routing_key="q", body=b"x", mandatory=True)
+
+
+def test_publishing_to_a_missing_exchange_closes_the_channel(connection):
+    channel = connection.channel()
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker):
+        channel.basic_publish(exchange="missing", routing_key="q", body=b"x")
+    assert channel.is_closed
+
+
+def test_transaction_holds_publishes_until_commit(connection):
+    channel = connection.channel()
+    channel.queue_declare(queue="q")
+    channel.tx_select()
+    channel.basic_publish(exchange='', routing_key="q", body=b"dropped")
+    channel.tx_rollback()
+    channel.basic_publish(exchange='', routing_key="q", body=b"kept")
+    assert not connection.broker.queues["q"].messages
+    channel.tx_commit()
+    assert [message[3] for message in connection.broker.queues["q"].messages] == [b"kept"]
+
+
+def test_call_gets_the_correlated_reply_and_leaves_properties_alone(connection):
+    channel = connection.channel()
+    channel.queue_declare(queue="rpc")
+
+    def respond(ch, method, properties, body):
+        ch.basic_publish(exchange='', routing_key=properties.reply_to, body=body.upper(),
+                         properties=pika.BasicProperties(correlation_id=properties.correlation_id))
+
+    channel.basic_consume("rpc", respond, auto_ack=True)
+    properties = pika.BasicProperties(content_type="text/plain")
+    reply_properties, body = transport.call(connection, channel, "rpc", b"ping", timeout=1.0, properties=properties)
+    assert body == b"PING"
+    assert properties.reply_to is None and properties.correlation_id is None
+    assert reply_properties.correlation_id is not None
+    assert [name for name in connection.broker.queues if name.startswith("amq.gen-")] == []
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import wire_format
+from wire_format import BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE
+
+ORDERS = [
+    {"type": "buy", "stock": "AAPL", "price": 101.25, "quantity": 10, "id": 42},
+    {"type": "sell", "stock": "TSLA", "price": 0.0001, "quantity": 1},
+    {"type": "cancel", "stock": "AAPL", "id": 42},
+    {"type": "reduce", "stock": "SYM0001", "id": 7, "quantity": 3},
+]
+
+TRADES = [
+    {"stock": "AAPL", "price": 100.5, "quantity": 3, "buy_order_id": 1, "sell_order_id": 2},
+    {"stock": "TSLA", "price": 250.0, "quantity": 1, "buy_order_id": 5},
+]
+
+
+@pytest.mark.parametrize("content_type", [JSON_CONTENT_TYPE, BINARY_CONTENT_TYPE])
+@pytest.mark.parametrize("order", ORDERS)
+def test_orders_round_trip(content_type, order):
+    body = wire_format.encode(order, content_type)
+    assert wire_format.decode(body, content_type) == order
+    assert wire_format.message_stock(body, content_type) == order["stock"]
+
+
+@pytest.mark.parametrize("content_type", [JSON_CONTENT_TYPE, BINARY_CONTENT_TYPE])
+def test_trades_round_trip(content_type):
+    for trade in TRADES:
+        assert wire_format.decode(wire_format.encode(trade, content_type), content_type) == trade
+    assert wire_format.decode(wire_format.encode(TRADES, content_type), content_type) == TRADES
+
+
+def test_binary_is_fixed_size():
+    assert len(wire_format.encode(ORDERS[0], BINARY_CONTENT_TYPE)) == wire_format.ORDER_MESSAGE.size
+    assert len(wire_format.encode(TRADES, BINARY_CONTENT_TYPE)) == (
+        wire_format.HEADER.size + wire_format.BATCH_COUNT.size + 2 * wire_format.TRADE_BODY.size)
+
+
+def test_missing_content_type_means_json():
+    body = json.dumps(ORDERS[0]).encode()
+    assert wire_format.decode(body) == ORDERS[0]
+    assert wire_format.content_type_of(None) is None
+
+
+@pytest.mark.parametrize("order", [
+    {"type": "buy", "stock": "TOOLONGSYMBOL", "price": 1.0, "quantity": 1},
+    {"type": "buy", "stock": "AAPL", "price": 1.0, "quantity": 1, "id": "abc"},
+    {"type": "cancel", "stock": "AAPL", "id": -1},
+])
+def test_binary_rejects_what_it_cannot_carry(order):
+    with pytest.raises(ValueError):
+        wire_format.encode(order, BINARY_CONTENT_TYPE)
+
+
+def test_binary_rejects_unknown_versions():
+    body = bytearray(wire_format.encode(ORDERS[0], BINARY_CONTENT_TYPE))
+    body[0] = wire_format.VERSION + 1
+    with pytest.raises(ValueError):
+        wire_format.decode(bytes(body), BINARY_CONTENT_TYPE)
+
+
+def test_binary_rejects_unknown_sides():
+    body = bytearray(wire_format.encode(ORDERS[0], BINARY_CONTENT_TYPE))
+    body[wire_format.HEADER.size + 8] = 2
+    with pytest.raises(ValueError):
+        wire_format.decode(bytes(body), BINARY_CONTENT_TYPE)
@@ -0,0 +1,273 @@
+"""Columnar archive of closed trading days, with vectorized analytics.
+
+Closed days of trades are moved out of trading.db into per-symbol, per-day
+directories of .npy column files (ts, price, quantity). The files are
+memory-mapped when read, so slicing a time range does not copy. TradeArchive
+answers queries over the archive and the live SQLite tail together.
+
+    python trade_archive.py compact
+    python trade_archive.py vwap AAPL --start 1700000000 --end 1700086400
+"""
+import os
+import time
+import calendar
+import shutil
+import sqlite3
+import argparse
+
+import numpy as np
+
+from trade_queries import DB_PATH
+
+ARCHIVE_DIR = 'archive'
+DAY = 86400
+COLUMNS = (("ts", np.float64), ("price", np.float64), ("quantity", np.int64))
+# Highest trades.id folded into a day; ids are AUTOINCREMENT, so rows above it are new
+LAST_ID = "last_id"
+
+
+def day_name(day):
+    return time.strftime("%Y-%m-%d", time.gmtime(day * DAY))
+
+
+def day_number(name):
+    return calendar.timegm(time.strptime(name, "%Y-%m-%d")) // DAY
+
+
+def _write_day(directory, ts, price, quantity, last_id):
+    """Replaces one day's column files and its last_id watermark.
+
+    The new files are written and fsynced to <day>.tmp. An existing day is
+    then renamed to <day>.old before <day>.tmp takes its place, so a crash
+    between the two renames leaves <day>.old, which readers fall back to
+    and the next compact() renames back (see _recover_day).
+    """
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for (name, dtype), values in zip(COLUMNS, (ts, price, quantity)):
+        path = os.path.join(tmp, name + ".npy")
+        with open(path, "wb") as f:
+            np.save(f, np.ascontiguousarray(values, dtype=dtype))
+            f.flush()
+            os.fsync(f.fileno())
+    with open(os.path.join(tmp, LAST_ID), "w") as f:
+        f.write(str(last_id))
+        f.flush()
+        os.fsync(f.fileno())
+    old = directory + ".old"
+    shutil.rmtree(old, ignore_errors=True)  # left by a crash after the swap
+    if os.path.exists(directory):
+        os.replace(directory, old)
+        os.replace(tmp, directory)
+        _fsync_dir(os.path.dirname(directory))
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, directory)
+        _fsync_dir(os.path.dirname(directory))
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _recover_day(directory):
+    """Finishes a swap a crash interrupted: restores <day>.old if <day> is missing, else drops it."""
+    old = directory + ".old"
+    if not os.path.exists(old):
+        return
+    if os.path.exists(directory):
+        shutil.rmtree(old)
+    else:
+        os.replace(old, directory)
+
+
+def _live_day(directory):
+    """The directory holding a day's files, <day>.old while a swap is unfinished."""
+    if not os.path.exists(directory) and os.path.exists(directory + ".old"):
+        return directory + ".old"
+    return directory
+
+
+def _read_day(directory):
+    directory = _live_day(directory)
+    return tuple(np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name, _ in COLUMNS)
+
+
+def _read_last_id(directory):
+    """The day's watermark, 0 for a day that does not exist yet."""
+    try:
+        with open(os.path.join(directory, LAST_ID)) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+def compact(db_path=DB_PATH, archive_dir=ARCHIVE_DIR, before=None):
+    """Moves trades from days that ended before `before` (default: today, UTC) into the archive.
+
+    Each (symbol, day) is written and fsynced, together with the highest
+    trade id it holds, before its rows are deleted from SQLite. If a crash
+    leaves rows behind, the next run skips those at or below that id and
+    only deletes them, so re-running never archives a trade twice. Returns
+    the number of trades archived.
+    """
+    cutoff_day = int((time.time() if before is None else before) // DAY)
+    if os.path.isdir(archive_dir):
+        for stock in os.listdir(archive_dir):
+            for name in os.listdir(os.path.join(archive_dir, stock)):
+                if name.endswith(".old"):
+                    _recover_day(os.path.join(archive_dir, stock, name[:-len(".old")]))
+    connection = sqlite3.connect(db_path)
+    archived = 0
+    try:
+        groups = connection.execute(
+            'SELECT DISTINCT stock, CAST(ts / ? AS INTEGER) FROM trades WHERE ts IS NOT NULL AND ts < ?',
+            (DAY, cutoff_day * DAY)).fetchall()
+        for stock, day in groups:
+            start, end = day * DAY, (day + 1) * DAY
+            directory = os.path.join(archive_dir, stock, day_name(day))
+            last_id = _read_last_id(directory)
+            rows = connection.execute(
+                'SELECT id, ts, price, quantity FROM trades WHERE stock = ? AND ts >= ? AND ts < ? AND id > ? '
+                'ORDER BY ts', (stock, start, end, last_id)).fetchall()
+            if rows:
+                ids, ts, price, quantity = (np.array(column) for column in zip(*rows))
+                if os.path.exists(directory):
+                    # Late trades for an already archived day: merge and keep time order
+                    old = _read_day(directory)
+                    ts, price, quantity = (np.concatenate([o, n]) for o, n in zip(old, (ts, price, quantity)))
+                    order = np.argsort(ts, kind="stable")
+                    ts, price, quantity = ts[order], price[order], quantity[order]
+                last_id = int(ids.max())
+                os.makedirs(os.path.dirname(directory), exist_ok=True)
+                _write_day(directory, ts, price, quantity, last_id)
+            # Also clears rows a crash left behind after an earlier run archived them
+            with connection:
+                connection.execute('DELETE FROM trades WHERE stock = ? AND ts >= ? AND ts < ? AND id <= ?',
+                                   (stock, start, end, last_id))
+            archived += len(rows)
+    finally:
+        connection.close()
+    return archived
+
+
+class TradeArchive:
+    """Vectorized queries over archived days plus the live SQLite tail."""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, db_path=DB_PATH):
+        self.archive_dir = archive_dir
+        self.db_path = db_path
+
+    def days(self, stock):
+        directory = os.path.join(self.archive_dir, stock)
+        if not os.path.isdir(directory):
+            return []
+        names = os.listdir(directory)
+        # A day only present as .old is mid-swap after a crash; _read_day reads it from there
+        return sorted({day_number(name[:-len(".old")] if name.endswith(".old") else name)
+                       for name in names if not name.endswith(".tmp")})
+
+    def load(self, stock, start=None, end=None):
+        """Returns (ts, price, quantity) arrays for trades in [start, end).
+
+        A range inside a single archived day returns memory-mapped views
+        with no copying; wider ranges are concatenated.
+        """
+        parts = []
+        for day in self.days(stock):
+            if start is not None and (day + 1) * DAY <= start:
+                continue
+            if end is not None and day * DAY >= end:
+                continue
+            ts, price, quantity = _read_day(os.path.join(self.archive_dir, stock, day_name(day)))
+            lo = np.searchsorted(ts, start, "left") if start is not None else 0
+            hi = np.searchsorted(ts, end, "left") if end is not None else len(ts)
+            parts.append((ts[lo:hi], price[lo:hi], quantity[lo:hi]))
+
+        if self.db_path is not None and os.path.exists(self.db_path):
+            connection = sqlite3.connect(self.db_path)
+            try:
+                rows = connection.execute(
+                    'SELECT ts, price, quantity FROM trades WHERE stock = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                    (stock, start if start is not None else float("-inf"),
+                     end if end is not None else float("inf"))).fetchall()
+            finally:
+                connection.close()
+            if rows:
+                parts.append(tuple(np.array(column, dtype=dtype) for column, (_, dtype) in zip(zip(*rows), COLUMNS)))
+
+        if not parts:
+            return tuple(np.empty(0, dtype=dtype) for _, dtype in COLUMNS)
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def vwap(self, stock, start=None, end=None):
+        _, price, quantity = self.load(stock, start, end)
+        volume = quantity.sum()
+        return float(np.dot(price, quantity) / volume) if volume else None
+
+    def rolling_volatility(self, stock, window=100, start=None, end=None):
+        """Rolling standard deviation of log returns over `window` trades.
+
+        Returns (ts, volatility) aligned to the last trade of each window.
+        """
+        ts, price, _ = self.load(stock, start, end)
+        if len(price) <= window:
+            return np.empty(0), np.empty(0)
+        returns = np.diff(np.log(price))
+        sums = np.concatenate(([0.0], np.cumsum(returns)))
+        squares = np.concatenate(([0.0], np.cumsum(returns * returns)))
+        total = sums[window:] - sums[:-window]
+        total_sq = squares[window:] - squares[:-window]
+        variance = np.maximum(total_sq / window - (total / window) ** 2, 0.0)
+        return ts[window:], np.sqrt(variance)
+
+    def volume_profile(self, stock, bucket_size, start=None, end=None):
+        """Traded volume per price bucket: returns (bucket lower bounds, volumes)."""
+        _, price, quantity = self.load(stock, start, end)
+        if not len(price):
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        buckets = np.floor(price / bucket_size).astype(np.int64)
+        first = buckets.min()
+        volumes = np.bincount(buckets - first, weights=quantity).astype(np.int64)
+        nonzero = np.nonzero(volumes)[0]
+        return (nonzero + first) * bucket_size, volumes[nonzero]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar trade archive")
+    parser.add_argument("command", choices=["compact", "vwap", "profile", "volatility"])
+    parser.add_argument("stock", nargs="?")
+    parser.add_argument("--start", type=float)
+    parser.add_argument("--end", type=float)
+    parser.add_argument("--bucket", type=float, default=1.0, help="price bucket for profile")
+    parser.add_argument("--window", type=int, default=100, help="trades per volatility window")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--archive", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(f"Archived {compact(args.db, args.archive)} trades")
+        return
+    if not args.stock:
+        parser.error("a stock symbol is required")
+    archive = TradeArchive(args.archive, args.db)
+    if args.command == "vwap":
+        print(archive.vwap(args.stock, args.start, args.end))
+    elif args.command == "profile":
+        for bucket, volume in zip(*archive.volume_profile(args.stock, args.bucket, args.start, args.end)):
+            print(f"{bucket:>12.4f} {volume:>12}")
+    else:
+        ts, volatility = archive.rolling_volatility(args.stock, args.window, args.start, args.end)
+        for t, v in zip(ts, volatility):
+            print(f"{t:.3f} {v:.6f}")
+
+
+if __name__ == "__main__":
+    main()
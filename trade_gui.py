@@ -1,44 +1,210 @@
 import tkinter as tk
+from tkinter import ttk
+import pika
+import queue
 import sqlite3
 import threading
 import time
+import os
+from urllib.request import pathname2url
+from collections import deque
+import trade_queries
+import wire_format
+import transport
+from trade_publisher import TRADES_EXCHANGE
 
-def fetch_latest_trade(stock):
-    connection = sqlite3.connect('trading.db') # Connects to SQLite database
+RECENT_TRADES = 20     # last-N trades kept per symbol
+MAX_FPS = 10           # cap on how often Tk is updated
 
-    cursor = connection.cursor()
-    query = "SELECT price from trades where stock = ? Order by id Desc Limit 1"
-    cursor.execute(query, (stock,))
-    result = cursor.fetchone()
-    connection.close()
-    return result[0] if result else "No Trades Yet"
+class SymbolState:
+    __slots__ = ("price", "quantity", "time", "count", "recent")
 
-def update_price():
-    stock = stock_entry.get().upper()
+    def __init__(self):
+        self.price = None
+        self.quantity = None
+        self.time = None
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_TRADES)
 
-    if stock not in ["AAPL", "TSLA"]:
-        price_label.config(text="Invalid stock symbol. Please use AAPL or TSLA.")
-        return
-    
-    latest_price = fetch_latest_trade(stock)
+class PriceWatcher:
+    """Keeps a latest-price / last-N-trades cache for every symbol from the live trade stream.
 
-    price_label.config(text=f"Latest price for {stock}: ${latest_price}")
+    A background thread consumes its own exclusive queue bound to the
+    trades exchange and hands trades to the Tk thread through a
+    thread-safe queue. The Tk thread calls drain() once per frame, so
+    a burst of trades on one symbol costs one redraw.
+    """
 
-    root.after(5000, update_price)
+    def __init__(self, host=None, db_path=trade_queries.DB_PATH):
+        self.host = host
+        self.db_path = db_path
+        self.symbols = {}
+        self.incoming = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
 
-# GUI Setup
-root = tk.Tk()
-root.title("Latest Trade Price Viewer")
-root.geometry("800x400")
+    def warm(self, watchlist=()):
+        """Fills the cache from SQLite once: latest price for every symbol, recent trades for the watchlist."""
+        try:
+            # Read-only, so a viewer started before the logger does not create an empty database
+            connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro", uri=True)
+        except sqlite3.Error:
+            return
+        try:
+            for stock, price, quantity, ts in connection.execute(
+                    'SELECT stock, price, quantity, ts FROM latest_trade'):
+                state = self.symbols.setdefault(stock, SymbolState())
+                state.price, state.quantity, state.time = price, quantity, ts
+            for stock in watchlist:
+                rows = connection.execute(
+                    'SELECT ts, price, quantity FROM trades WHERE stock = ? ORDER BY ts DESC LIMIT ?',
+                    (stock, RECENT_TRADES)).fetchall()
+                state = self.symbols.setdefault(stock, SymbolState())
+                state.recent.extend(reversed(rows))
+        except sqlite3.Error as e:
+            # No trades logged yet: start from an empty cache
+            print(f"Could not warm cache from {self.db_path}: {e}")
+        finally:
+            connection.close()
 
-tk.Label(root, text="Enter Stock Symbol (e.g., AAPL or TSLA): ").pack(pady=10)
+    def start(self):
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
 
-stock_entry = tk.Entry(root, font=("Arial", 16))
-stock_entry.pack(pady=5)
+    def stop(self):
+        self.stop_event.set()
 
-tk.Button(root, text="Fetch latest price", command=update_price, font=("Arial", 14)).pack(pady=10)
+    def _consume(self):
+        while not self.stop_event.is_set():
+            try:
+                connection = transport.connect(self.host)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=TRADES_EXCHANGE, exchange_type='fanout', durable=True)
+                queue_name = channel.queue_declare(queue='', exclusive=True).method.queue
+                channel.queue_bind(exchange=TRADES_EXCHANGE, queue=queue_name)
+                for method, properties, body in channel.consume(queue_name, auto_ack=True, inactivity_timeout=0.5):
+                    if self.stop_event.is_set():
+                        break
+                    if body is None:
+                        continue
+                    message = wire_format.decode(body, wire_format.content_type_of(properties))
+                    now = time.time()
+                    trades = message if isinstance(message, list) else [message]
+                    self.incoming.put([(t["stock"], t["price"], t["quantity"], now) for t in trades])
+                connection.close()
+            except pika.exceptions.AMQPError as e:
+                print(f"Trade stream unavailable ({e}), retrying...")
+                self.stop_event.wait(2)
 
-price_label = tk.Label(root, text="", font=("Arial", 20), fg="green")
-price_label.pack(pady=10)
+    def drain(self):
+        """Applies queued trades to the cache. Returns the set of symbols that changed."""
+        changed = set()
+        while True:
+            try:
+                batch = self.incoming.get_nowait()
+            except queue.Empty:
+                return changed
+            for stock, price, quantity, ts in batch:
+                state = self.symbols.get(stock)
+                if state is None:
+                    state = self.symbols[stock] = SymbolState()
+                state.price, state.quantity, state.time = price, quantity, ts
+                state.count += 1
+                state.recent.append((ts, price, quantity))
+                changed.add(stock)
 
-root.mainloop()
+class TradeViewer:
+    """Watchlist of symbols whose rows update only when their price changes."""
+
+    def __init__(self, watcher, watchlist=()):
+        self.watcher = watcher
+        self.root = tk.Tk()
+        self.root.title("Latest Trade Price Viewer")
+        self.root.geometry("800x500")
+        self.rows = {}
+        self.setup_ui()
+        for stock in watchlist:
+            self.add_symbol(stock)
+
+    def setup_ui(self):
+        controls = tk.Frame(self.root)
+        controls.pack(fill=tk.X, pady=10)
+        tk.Label(controls, text="Add symbols (comma separated): ").pack(side=tk.LEFT, padx=5)
+        self.stock_entry = tk.Entry(controls, font=("Arial", 14))
+        self.stock_entry.pack(side=tk.LEFT, padx=5)
+        self.stock_entry.bind("<Return>", lambda event: self.add_from_entry())
+        tk.Button(controls, text="Watch", command=self.add_from_entry).pack(side=tk.LEFT, padx=5)
+        tk.Button(controls, text="Remove", command=self.remove_selected).pack(side=tk.LEFT, padx=5)
+
+        columns = ("price", "quantity", "trades", "updated")
+        self.table = ttk.Treeview(self.root, columns=columns, height=15)
+        self.table.heading("#0", text="Symbol")
+        for column in columns:
+            self.table.heading(column, text=column.capitalize())
+        self.table.pack(fill=tk.BOTH, expand=True, padx=10)
+        self.table.bind("<<TreeviewSelect>>", lambda event: self.show_recent())
+
+        self.recent_label = tk.Label(self.root, text="", font=("Courier", 11), justify=tk.LEFT, anchor="w")
+        self.recent_label.pack(fill=tk.X, padx=10, pady=10)
+
+    def _values(self, stock):
+        state = self.watcher.symbols.get(stock)
+        if state is None or state.price is None:
+            return ("No Trades Yet", "", 0, "")
+        updated = time.strftime("%H:%M:%S", time.localtime(state.time)) if state.time else ""
+        return (f"${state.price}", state.quantity, state.count, updated)
+
+    def add_symbol(self, stock):
+        stock = stock.strip().upper()
+        if stock and stock not in self.rows:
+            self.rows[stock] = self.table.insert("", tk.END, text=stock, values=self._values(stock))
+
+    def add_from_entry(self):
+        for stock in self.stock_entry.get().split(","):
+            self.add_symbol(stock)
+        self.stock_entry.delete(0, tk.END)
+
+    def remove_selected(self):
+        for item in self.table.selection():
+            stock = self.table.item(item, "text")
+            self.table.delete(item)
+            self.rows.pop(stock, None)
+
+    def show_recent(self):
+        selection = self.table.selection()
+        if not selection:
+            self.recent_label.config(text="")
+            return
+        stock = self.table.item(selection[0], "text")
+        state = self.watcher.symbols.get(stock)
+        lines = [f"Recent trades for {stock}:"]
+        if state is not None:
+            for ts, price, quantity in reversed(state.recent):
+                stamp = time.strftime("%H:%M:%S", time.localtime(ts)) if ts else "--:--:--"
+                lines.append(f"{stamp}  {quantity:>8} @ ${price}")
+        self.recent_label.config(text="\n".join(lines[:8]))
+
+    def refresh(self):
+        # One pass per frame: only rows whose symbol traded since the last frame are touched
+        changed = self.watcher.drain()
+        for stock in changed:
+            item = self.rows.get(stock)
+            if item is not None:
+                self.table.item(item, values=self._values(stock))
+        selection = self.table.selection()
+        if selection and self.table.item(selection[0], "text") in changed:
+            self.show_recent()
+        self.root.after(1000 // MAX_FPS, self.refresh)
+
+    def run(self):
+        self.refresh()
+        self.root.mainloop()
+        self.watcher.stop()
+
+if __name__ == "__main__":
+    import sys
+    watchlist = [stock.upper() for stock in sys.argv[1:]] or ["AAPL", "TSLA"]
+    watcher = PriceWatcher()
+    watcher.warm(watchlist)
+    watcher.start()
+    TradeViewer(watcher, watchlist).run()
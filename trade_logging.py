@@ -1,14 +1,26 @@
-import pika
-import json
+import math
+import time
+import struct
 import sqlite3
+import wire_format
+import transport
+import metrics
+from trade_queries import DB_PATH, INTERVALS
+from trade_publisher import TRADES_QUEUE, declare_trades
+
+log = metrics.get_logger("trade_logging")
+flush_seconds = metrics.histogram("sqlite_flush_seconds")
+trades_logged = metrics.counter("trades_logged_total")
+
+# Opens the trades database and runs schema setup once
+def connect(path=DB_PATH):
+    connection = sqlite3.connect(path)  # SQLite file-based database
+    # WAL lets readers (trade_gui) run alongside the writer; FULL keeps each commit durable
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=FULL')
 
-# Function to save trades in SQLite
-def save_trade_to_sqlite(trade):
-    connection = sqlite3.connect('trading.db')  # SQLite file-based database
-    cursor = connection.cursor()
-    
     # Create the trades table if it doesn't exist
-    cursor.execute('''
+    connection.execute('''
         CREATE TABLE IF NOT EXISTS trades (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             stock TEXT,
@@ -17,31 +29,204 @@ def save_trade_to_sqlite(trade):
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Insert the trade into the table
-    cursor.execute('''
-        INSERT INTO trades (stock, price, quantity) VALUES (?, ?, ?)
-    ''', (trade["stock"], trade["price"], trade["quantity"]))
-    
+    # Epoch seconds of each trade; added to databases created before the rollups existed
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(trades)')]
+    if 'ts' not in columns:
+        connection.execute('ALTER TABLE trades ADD COLUMN ts REAL')
+    # Covers per-symbol time-range scans without touching the table rows
+    connection.execute('CREATE INDEX IF NOT EXISTS trades_stock_ts ON trades (stock, ts, price, quantity)')
+
+    # OHLCV rollups per symbol for every interval in INTERVALS; vwap = notional / volume
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS candles (
+            stock TEXT,
+            interval INTEGER,
+            bucket INTEGER,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            notional REAL,
+            trades INTEGER,
+            PRIMARY KEY (stock, interval, bucket)
+        ) WITHOUT ROWID
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS latest_trade (
+            stock TEXT PRIMARY KEY,
+            price REAL,
+            quantity INTEGER,
+            ts REAL
+        ) WITHOUT ROWID
+    ''')
     connection.commit()
-    connection.close()
-    print(f"Trade saved to SQLite: {trade}")
+    return connection
+
+def rollup(rows):
+    """Aggregates (stock, price, quantity, ts) rows into candle and latest-trade rows."""
+    candles = {}
+    latest = {}
+    for stock, price, quantity, ts in rows:
+        latest[stock] = (stock, price, quantity, ts)
+        for seconds in INTERVALS.values():
+            key = (stock, seconds, int(ts // seconds))
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = [price, price, price, price, quantity, price * quantity, 1]
+            else:
+                if price > candle[1]:
+                    candle[1] = price
+                if price < candle[2]:
+                    candle[2] = price
+                candle[3] = price
+                candle[4] += quantity
+                candle[5] += price * quantity
+                candle[6] += 1
+    return [key + tuple(candle) for key, candle in candles.items()], list(latest.values())
+
+class TradeWriter:
+    """Long-lived SQLite writer that inserts trades in batches.
+
+    Trades accumulate with the delivery tag of the message that carried
+    them. flush() writes them all with executemany in one transaction and
+    returns the last tag covered, which may then be acked. The same
+    transaction folds the batch into the candle and latest_trade tables.
+    """
+
+    def __init__(self, path=DB_PATH, max_batch=1000, max_delay=0.2):
+        self.connection = connect(path)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.rows = []
+        self.last_tag = None
+        self.first_pending = None
+        self.flushed_trades = 0
+
+    def add(self, trades, delivery_tag=None):
+        if not self.rows:
+            self.first_pending = time.monotonic()
+        now = time.time()
+        self.rows.extend((trade["stock"], trade["price"], trade["quantity"], now) for trade in trades)
+        if delivery_tag is not None:
+            self.last_tag = delivery_tag
+
+    def full(self):
+        return len(self.rows) >= self.max_batch
+
+    def due(self):
+        return bool(self.rows) and time.monotonic() - self.first_pending >= self.max_delay
+
+    def flush(self):
+        """Commits pending trades. Returns the delivery tag to ack up to, or None."""
+        tag, self.last_tag = self.last_tag, None
+        if self.rows:
+            candles, latest = rollup(self.rows)
+            with flush_seconds.time(), self.connection:  # one transaction, one fsync
+                self.connection.executemany(
+                    'INSERT INTO trades (stock, price, quantity, ts) VALUES (?, ?, ?, ?)', self.rows)
+                # Open is kept from the existing candle; everything else merges with the batch
+                self.connection.executemany('''
+                    INSERT INTO candles (stock, interval, bucket, open, high, low, close, volume, notional, trades)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (stock, interval, bucket) DO UPDATE SET
+                        high = max(high, excluded.high),
+                        low = min(low, excluded.low),
+                        close = excluded.close,
+                        volume = volume + excluded.volume,
+                        notional = notional + excluded.notional,
+                        trades = trades + excluded.trades
+                ''', candles)
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO latest_trade (stock, price, quantity, ts) VALUES (?, ?, ?, ?)', latest)
+            self.flushed_trades += len(self.rows)
+            trades_logged.inc(len(self.rows))
+            self.rows = []
+        return tag
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+_writer = None
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        _writer = TradeWriter()
+    return _writer
+
+# Function to save trades in SQLite
+def save_trade_to_sqlite(trade):
+    writer = get_writer()
+    writer.add([trade])
+    writer.flush()
+    log.debug("Trade saved to SQLite: %s", trade)
+
+def flush_and_ack(channel):
+    tag = get_writer().flush()
+    if tag is not None:
+        channel.basic_ack(delivery_tag=tag, multiple=True)
+
+def validate_trades(message):
+    """Returns the trades carried by a message if they are well formed, else raises ValueError."""
+    # The matching engine publishes fills in batches (a list of trades)
+    trades = message if isinstance(message, list) else [message]
+    for trade in trades:
+        if not isinstance(trade, dict):
+            raise ValueError("trade is not an object")
+        if not isinstance(trade.get("stock"), str) or not trade["stock"]:
+            raise ValueError("missing stock")
+        price = trade.get("price")
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or not math.isfinite(price):
+            raise ValueError(f"bad price {price!r}")
+        quantity = trade.get("quantity")
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            raise ValueError(f"bad quantity {quantity!r}")
+    return trades
 
 # Function to process RabbitMQ messages
 def log_trade(ch, method, properties, body):
-    trade = json.loads(body.decode())  # Deserialize message
-    print(f"Logging trade: {trade}")
-    save_trade_to_sqlite(trade)  # Save trade to SQLite
+    try:
+        trades = validate_trades(wire_format.decode(body, wire_format.content_type_of(properties)))
+    except (ValueError, struct.error) as e:
+        # Requeueing would redeliver it forever; dead-lettered if the queue has a DLX
+        log.warning("Rejecting malformed trade message %r: %s", body, e)
+        ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    writer = get_writer()
+    writer.add(trades, method.delivery_tag)
+    if writer.full():
+        flush_and_ack(ch)
 
 # Set up RabbitMQ consumer
-def setup_rabbitmq():
-    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+def setup_rabbitmq(max_batch=1000, max_delay=0.2, path=DB_PATH):
+    global _writer
+    _writer = TradeWriter(path, max_batch=max_batch, max_delay=max_delay)
+    metrics.start()
+    metrics.gauge("pending_trades", lambda: len(_writer.rows))
+    connection = transport.connect()
     channel = connection.channel()
-    channel.queue_declare(queue='trades', durable=True)
-    channel.basic_consume(queue='trades', on_message_callback=log_trade, auto_ack=True)
-    
+    declare_trades(channel)
+    # Enough unacked messages in flight to fill a batch
+    transport.set_prefetch(channel, max_batch * 2)
+    channel.basic_consume(queue=TRADES_QUEUE, on_message_callback=metrics.instrument("trade_logging", log_trade))
+
+    # Trades are acked only after the transaction holding them has committed
+    def flush_timer():
+        if _writer.due():
+            flush_and_ack(channel)
+        connection.call_later(max_delay / 2, flush_timer)
+    connection.call_later(max_delay / 2, flush_timer)
+
     print("Waiting for trades...")
-    channel.start_consuming()
+    try:
+        channel.start_consuming()
+    finally:
+        if connection.is_open:
+            flush_and_ack(channel)
+            connection.close()
+        _writer.close()
 
 # Start the consumer script
 if __name__ == "__main__":
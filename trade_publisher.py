@@ -0,0 +1,107 @@
+import pika
+import time
+import struct
+import wire_format
+import transport
+import metrics
+
+TRADES_QUEUE = 'trades'
+# Fanout exchange every trade batch goes through; the logger's durable queue
+# and any live viewers bind to it
+TRADES_EXCHANGE = 'trade_events'
+
+
+def declare_trades(channel, queue=TRADES_QUEUE):
+    """Declares the trades exchange and the durable logger queue bound to it."""
+    channel.exchange_declare(exchange=TRADES_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=queue, durable=True)
+    channel.queue_bind(exchange=TRADES_EXCHANGE, queue=queue)
+
+
+class TradePublisher:
+    """Long-lived trade publisher owned by the matching process.
+
+    Fills are buffered and published as one message per batch (a JSON
+    array, or a binary trade batch) on a single confirmed channel. A batch
+    is only dropped from the buffer once the broker has confirmed it, so a
+    failed publish is retried instead of being silently lost.
+    """
+
+    def __init__(self, connection=None, host=None, queue=TRADES_QUEUE,
+                 max_batch=500, max_delay=0.0, retries=3, content_type=wire_format.JSON_CONTENT_TYPE):
+        self.connection = connection
+        self.owns_connection = connection is None
+        self.host = host
+        self.queue = queue
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retries = retries
+        self.content_type = content_type
+        self.channel = None
+        self.buffer = []
+        self.first_buffered = None
+        self.published_batches = 0
+        self.published_trades = 0
+
+    def _open_channel(self):
+        if self.connection is None or self.connection.is_closed:
+            if not self.owns_connection:
+                raise pika.exceptions.AMQPConnectionError("Shared connection is closed")
+            self.connection = transport.connect(self.host)
+        self.channel = self.connection.channel()
+        declare_trades(self.channel, self.queue)
+        self.channel.confirm_delivery()
+        return self.channel
+
+    def publish(self, trade):
+        """Buffers a trade; flushes when the batch is full."""
+        if not self.buffer:
+            self.first_buffered = time.monotonic()
+        self.buffer.append(trade)
+        if len(self.buffer) >= self.max_batch:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flushes the buffer once it is older than max_delay."""
+        if self.buffer and time.monotonic() - self.first_buffered >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Publishes all buffered trades as one confirmed message."""
+        if not self.buffer:
+            return
+        content_type = self.content_type
+        try:
+            body = wire_format.encode(self.buffer, content_type)
+        except (ValueError, struct.error):
+            # e.g. client-chosen string ids, which the binary layout cannot carry
+            content_type = wire_format.JSON_CONTENT_TYPE
+            body = wire_format.encode(self.buffer, content_type)
+        properties = metrics.stamp(pika.BasicProperties(content_type=content_type,
+                                                        delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE))
+        for attempt in range(self.retries + 1):
+            try:
+                channel = self.channel if self.channel is not None and self.channel.is_open else self._open_channel()
+                channel.basic_publish(exchange=TRADES_EXCHANGE, routing_key='', body=body,
+                                      properties=properties, mandatory=True)
+                break
+            except pika.exceptions.AMQPError as e:
+                # Covers nacks and unroutable returns as well as dropped connections
+                self.channel = None
+                if attempt == self.retries:
+                    raise
+                print(f"Trade publish failed ({e}), retrying")
+        self.published_batches += 1
+        self.published_trades += len(self.buffer)
+        self.buffer = []
+        self.first_buffered = None
+
+    def close(self):
+        """Flushes pending trades and releases the channel."""
+        try:
+            self.flush()
+        finally:
+            if self.channel is not None and self.channel.is_open:
+                self.channel.close()
+            if self.owns_connection and self.connection is not None and self.connection.is_open:
+                self.connection.close()
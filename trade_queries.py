@@ -0,0 +1,72 @@
+import sqlite3
+
+DB_PATH = 'trading.db'
+
+# Rollup intervals maintained by trade_logging, in seconds
+INTERVALS = {"1s": 1, "1m": 60, "1h": 3600}
+
+
+def open_db(path=DB_PATH):
+    """Opens the trades database for reading."""
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def latest_trade(connection, stock):
+    """Returns the latest trade for a stock as a dict, or None."""
+    row = connection.execute(
+        'SELECT stock, price, quantity, ts FROM latest_trade WHERE stock = ?', (stock,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def latest_prices(connection, stocks=None):
+    """Returns {stock: price} for the given stocks, or for every stock traded."""
+    if stocks is None:
+        rows = connection.execute('SELECT stock, price FROM latest_trade')
+    else:
+        stocks = list(stocks)
+        placeholders = ",".join("?" * len(stocks))
+        rows = connection.execute(
+            f'SELECT stock, price FROM latest_trade WHERE stock IN ({placeholders})', stocks)
+    return {stock: price for stock, price in rows}
+
+
+def candles(connection, stock, interval="1m", start=None, end=None, limit=None):
+    """Returns OHLCV + VWAP candles for a stock, oldest first.
+
+    `interval` is one of INTERVALS; `start`/`end` are epoch seconds. With
+    `limit`, only the most recent `limit` candles in the range are returned.
+    """
+    seconds = INTERVALS[interval]
+    query = ('SELECT bucket, open, high, low, close, volume, notional, trades FROM candles '
+             'WHERE stock = ? AND interval = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket DESC')
+    params = [stock, seconds,
+              int(start // seconds) if start is not None else -1,
+              int(end // seconds) if end is not None else 2 ** 62]
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    result = []
+    for bucket, open_, high, low, close, volume, notional, trades in connection.execute(query, params):
+        result.append({"time": bucket * seconds, "open": open_, "high": high, "low": low, "close": close,
+                       "volume": volume, "vwap": notional / volume if volume else None, "trades": trades})
+    result.reverse()
+    return result
+
+
+def vwap(connection, stock, start, end, interval="1m"):
+    """VWAP over [start, end) from the rollups at the given granularity."""
+    seconds = INTERVALS[interval]
+    volume, notional = connection.execute(
+        'SELECT sum(volume), sum(notional) FROM candles '
+        'WHERE stock = ? AND interval = ? AND bucket >= ? AND bucket < ?',
+        (stock, seconds, int(start // seconds), int(end // seconds))).fetchone()
+    return notional / volume if volume else None
+
+
+def trades_between(connection, stock, start, end):
+    """Raw trades for a stock in [start, end), served by the (stock, ts) covering index."""
+    return connection.execute(
+        'SELECT ts, price, quantity FROM trades WHERE stock = ? AND ts >= ? AND ts < ? ORDER BY ts',
+        (stock, start, end)).fetchall()
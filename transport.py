@@ -0,0 +1,617 @@
+"""Shared message transport: RabbitMQ, or an in-process broker.
+
+Services get their connections from connect(). The backend is chosen by
+PBT_TRANSPORT: "rabbitmq" (the default) or "local". RabbitMQ is reached at
+RABBITMQ_HOST:RABBITMQ_PORT. Both backends hand out objects with the
+subset of pika's BlockingConnection / BlockingChannel API that the
+services use, so service code is the same on either.
+
+The local backend routes messages between the connections of one process.
+Nothing is serialized or copied: a consumer receives the very body and
+properties objects that were published. Each connection delivers to its
+callbacks on the thread that runs its start_consuming() or
+process_data_events(), as pika does. With it, the whole order -> match ->
+log pipeline or the contact tracker can be run and profiled in one
+process (see bench_pipeline.py).
+"""
+import os
+import copy
+import heapq
+import itertools
+import threading
+import time
+import uuid
+import weakref
+from collections import deque, OrderedDict
+from types import SimpleNamespace
+
+import pika
+
+TRANSPORT = os.environ.get('PBT_TRANSPORT', 'rabbitmq')
+RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'localhost')
+RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
+# Overrides every consumer's own prefetch choice when set
+PREFETCH = int(os.environ['PBT_PREFETCH']) if os.environ.get('PBT_PREFETCH') else None
+
+
+def use(backend):
+    """Switches the backend for connections opened from now on."""
+    global TRANSPORT
+    if backend not in ('rabbitmq', 'local'):
+        raise ValueError(f"Unknown transport: {backend}")
+    TRANSPORT = backend
+
+
+def parameters(host=None, port=None):
+    """pika connection parameters for the configured RabbitMQ server."""
+    return pika.ConnectionParameters(host=host or RABBITMQ_HOST, port=port or RABBITMQ_PORT)
+
+
+def connect(host=None, port=None):
+    """Opens a connection on the configured backend."""
+    if TRANSPORT == 'local':
+        return local_broker().connect()
+    return pika.BlockingConnection(parameters(host, port))
+
+
+def set_prefetch(channel, count):
+    """Sets a consumer channel's prefetch to `count`, unless PBT_PREFETCH overrides it."""
+    channel.basic_qos(prefetch_count=PREFETCH if PREFETCH is not None else count)
+
+
+_pool = threading.local()
+
+
+def pooled_channel(name='default', host=None, setup=None):
+    """A channel kept open for reuse by the calling thread.
+
+    Channels are pooled per thread because blocking connections must not
+    be shared between threads. All of a thread's pooled channels share
+    one connection. `setup(channel)` runs each time the channel is
+    (re)opened, e.g. to declare queues.
+    """
+    channels = getattr(_pool, 'channels', None)
+    if channels is None:
+        channels = _pool.channels = {}
+        _pool.connection = None
+    channel = channels.get(name)
+    if channel is None or not channel.is_open:
+        if _pool.connection is None or not _pool.connection.is_open:
+            _pool.connection = connect(host)
+        channel = channels[name] = _pool.connection.channel()
+        if setup is not None:
+            setup(channel)
+    return channel
+
+
+def close_pooled():
+    """Closes the calling thread's pooled connection and channels."""
+    connection = getattr(_pool, 'connection', None)
+    if connection is not None and connection.is_open:
+        connection.close()
+    _pool.connection = None
+    _pool.channels = {}
+
+
+def call(connection, channel, routing_key, body, timeout=5.0, properties=None, exchange=''):
+    """Request/reply: publishes a request and waits for the correlated answer.
+
+    The answer comes back on a private exclusive queue. Returns
+    (properties, body), or None if no answer came within `timeout` seconds.
+    """
+    reply_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    correlation_id = uuid.uuid4().hex
+    answers = []
+
+    def on_reply(ch, method, reply_properties, reply_body):
+        if reply_properties.correlation_id == correlation_id:
+            answers.append((reply_properties, reply_body))
+
+    consumer_tag = channel.basic_consume(queue=reply_queue, on_message_callback=on_reply, auto_ack=True)
+    # A copy, so the caller's properties are left as they were
+    properties = copy.copy(properties) if properties is not None else pika.BasicProperties()
+    properties.reply_to = reply_queue
+    properties.correlation_id = correlation_id
+    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+    deadline = time.monotonic() + timeout
+    while not answers and time.monotonic() < deadline:
+        connection.process_data_events(time_limit=deadline - time.monotonic())
+    channel.basic_cancel(consumer_tag)
+    channel.queue_delete(queue=reply_queue)
+    return answers[0] if answers else None
+
+
+# In-process backend
+
+def _topic_matches(pattern, words):
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(_topic_matches(pattern[1:], words[i:]) for i in range(len(words) + 1))
+    return bool(words) and pattern[0] in ('*', words[0]) and _topic_matches(pattern[1:], words[1:])
+
+
+class LocalQueue:
+    __slots__ = ("name", "messages", "consumers", "owner", "auto_delete", "unacked", "next_consumer")
+
+    def __init__(self, name, owner=None, auto_delete=False):
+        self.name = name
+        self.messages = deque()  # (exchange, routing_key, properties, body, redelivered)
+        self.consumers = []
+        self.owner = owner
+        self.auto_delete = auto_delete
+        self.unacked = 0
+        self.next_consumer = 0
+
+
+class LocalConsumer:
+    __slots__ = ("tag", "queue", "channel", "callback", "auto_ack")
+
+    def __init__(self, tag, queue, channel, callback, auto_ack):
+        self.tag = tag
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.auto_ack = auto_ack
+
+
+class LocalBroker:
+    """Exchanges, queues and bindings shared by every local connection.
+
+    Supports the default, direct, fanout and topic exchanges, prefetch,
+    manual and multiple acks, requeue of unacked messages when a channel
+    closes, exclusive and auto-delete queues, publisher confirms with
+    mandatory publishes, and transactions (publishes held until tx_commit).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.exchanges = {'': 'direct'}
+        self.bindings = {}  # exchange -> [(routing key, queue name)]
+        self.routes = {}  # (exchange, routing key) -> [LocalQueue], cleared when bindings change
+        self.queues = {}
+        self.connections = weakref.WeakSet()
+        self.tags = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+
+    def connect(self):
+        connection = LocalConnection(self)
+        self.connections.add(connection)
+        return connection
+
+    def _route(self, exchange, routing_key):
+        key = (exchange, routing_key)
+        queues = self.routes.get(key)
+        if queues is None:
+            kind = self.exchanges[exchange]
+            if exchange == '':
+                names = [routing_key] if routing_key in self.queues else []
+            elif kind == 'fanout':
+                names = [name for _, name in self.bindings.get(exchange, ())]
+            elif kind == 'topic':
+                words = routing_key.split('.')
+                names = [name for pattern, name in self.bindings.get(exchange, ())
+                         if _topic_matches(pattern.split('.'), words)]
+            else:
+                names = [name for bound_key, name in self.bindings.get(exchange, ()) if bound_key == routing_key]
+            queues = self.routes[key] = [self.queues[name] for name in dict.fromkeys(names)]
+        return queues
+
+    def publish(self, exchange, routing_key, properties, body):
+        """Routes a message; returns the number of queues it reached."""
+        with self.lock:
+            if exchange not in self.exchanges:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+            queues = self._route(exchange, routing_key)
+            self.published += 1
+            for queue in queues:
+                queue.messages.append((exchange, routing_key, properties, body, False))
+                self.dispatch(queue)
+            return len(queues)
+
+    def dispatch(self, queue):
+        """Hands ready messages to consumers with prefetch room, round-robin."""
+        consumers = queue.consumers
+        while queue.messages and consumers:
+            for attempt in range(len(consumers)):
+                consumer = consumers[(queue.next_consumer + attempt) % len(consumers)]
+                channel = consumer.channel
+                if consumer.auto_ack or not channel.prefetch or len(channel.unacked) < channel.prefetch:
+                    break
+            else:
+                return  # every consumer is at its prefetch limit
+            queue.next_consumer = (queue.next_consumer + attempt + 1) % len(consumers)
+            exchange, routing_key, properties, body, redelivered = queue.messages.popleft()
+            tag = channel.next_tag
+            channel.next_tag += 1
+            if not consumer.auto_ack:
+                channel.unacked[tag] = (queue, exchange, routing_key, properties, body)
+                queue.unacked += 1
+            method = SimpleNamespace(delivery_tag=tag, routing_key=routing_key, exchange=exchange,
+                                     redelivered=redelivered, consumer_tag=consumer.tag)
+            self.delivered += 1
+            channel.connection._deliver((consumer, method, properties, body))
+
+    def _bindings_changed(self):
+        self.routes.clear()
+
+    def delete_queue(self, name):
+        queue = self.queues.pop(name, None)
+        if queue is None:
+            return 0
+        for exchange, bindings in self.bindings.items():
+            bindings[:] = [binding for binding in bindings if binding[1] != name]
+        self._bindings_changed()
+        return len(queue.messages)
+
+    def idle(self, *names):
+        """True when the named queues (or all queues) hold no ready or unacked messages."""
+        with self.lock:
+            queues = [self.queues[name] for name in names if name in self.queues] if names else self.queues.values()
+            return all(not queue.messages and not queue.unacked for queue in queues)
+
+    def stop_all(self):
+        """Asks every open connection to stop consuming, from any thread."""
+        for connection in list(self.connections):
+            if connection.is_open:
+                connection.add_callback_threadsafe(connection._stop_consuming)
+
+
+_local_broker = None
+
+
+def local_broker():
+    """The process-wide in-process broker."""
+    global _local_broker
+    if _local_broker is None:
+        _local_broker = LocalBroker()
+    return _local_broker
+
+
+def reset_local():
+    """Replaces the in-process broker with an empty one and returns it."""
+    global _local_broker
+    _local_broker = LocalBroker()
+    return _local_broker
+
+
+class LocalConnection:
+    """In-process stand-in for pika.BlockingConnection."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.channels = []
+        self.condition = threading.Condition()
+        self.deliveries = deque()
+        self.callbacks = deque()  # added with add_callback_threadsafe
+        self.timers = []  # heap of (deadline, number, callback)
+        self.timer_numbers = itertools.count()
+        self.cancelled_timers = set()
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError("Connection is closed")
+        channel = LocalChannel(self, len(self.channels) + 1)
+        self.channels.append(channel)
+        return channel
+
+    def _deliver(self, delivery):
+        with self.condition:
+            self.deliveries.append(delivery)
+            self.condition.notify()
+
+    def call_later(self, delay, callback):
+        number = next(self.timer_numbers)
+        heapq.heappush(self.timers, (time.monotonic() + delay, number, callback))
+        return number
+
+    def remove_timeout(self, timeout_id):
+        self.cancelled_timers.add(timeout_id)
+
+    def add_callback_threadsafe(self, callback):
+        with self.condition:
+            self.callbacks.append(callback)
+            self.condition.notify()
+
+    def _run_ready(self):
+        """Runs everything that is ready now; returns how many events ran."""
+        ran = 0
+        with self.condition:
+            callbacks, self.callbacks = self.callbacks, deque()
+            count = len(self.deliveries)
+        for callback in callbacks:
+            callback()
+            ran += 1
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, number, callback = heapq.heappop(self.timers)
+            if number in self.cancelled_timers:
+                self.cancelled_timers.discard(number)
+                continue
+            callback()
+            ran += 1
+        # Only what was queued on entry, so a busy queue cannot starve timers
+        for _ in range(count):
+            if not self.is_open:
+                break
+            with self.condition:
+                consumer, method, properties, body = self.deliveries.popleft()
+            if consumer.channel.is_open and consumer.tag in consumer.channel.consumers:
+                consumer.callback(consumer.channel, method, properties, body)
+                ran += 1
+        return ran
+
+    def process_data_events(self, time_limit=0):
+        """Runs ready callbacks, waiting up to time_limit seconds (None: no limit) for some."""
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        while self.is_open:
+            if self._run_ready():
+                return
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            wait = None if deadline is None else deadline - now
+            if self.timers:
+                until_timer = max(0.0, self.timers[0][0] - now)
+                wait = until_timer if wait is None else min(wait, until_timer)
+            with self.condition:
+                if not self.deliveries and not self.callbacks:
+                    self.condition.wait(wait)
+
+    def sleep(self, duration):
+        deadline = time.monotonic() + duration
+        while self.is_open:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.process_data_events(time_limit=remaining)
+
+    def _stop_consuming(self):
+        for channel in self.channels:
+            if channel.is_open:
+                channel.stop_consuming()
+
+    def close(self):
+        if not self.is_open:
+            return
+        for channel in self.channels:
+            channel.close()
+        with self.broker.lock:
+            for name in [name for name, queue in self.broker.queues.items() if queue.owner is self]:
+                self.broker.delete_queue(name)
+        self.is_open = False
+        with self.condition:
+            self.condition.notify_all()
+
+
+class LocalChannel:
+    """In-process stand-in for pika's BlockingChannel."""
+
+    def __init__(self, connection, number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = number
+        self.is_open = True
+        self.prefetch = 0
+        self.confirming = False
+        self.transaction = None  # publishes held until tx_commit() once tx_select() was called
+        self.next_tag = 1
+        self.unacked = OrderedDict()  # delivery tag -> (queue, exchange, routing key, properties, body)
+        self.consumers = {}
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def _check_open(self):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError("Channel is closed")
+
+    def _close_by_broker(self, error):
+        self.close()
+        raise error
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False, auto_delete=False,
+                         internal=False, arguments=None):
+        self._check_open()
+        with self.broker.lock:
+            if exchange not in self.broker.exchanges:
+                if passive:
+                    self._close_by_broker(pika.exceptions.ChannelClosedByBroker(
+                        404, f"NOT_FOUND - no exchange '{exchange}'"))
+                self.broker.exchanges[exchange] = getattr(exchange_type, 'value', exchange_type)
+
+    def queue_declare(self, queue='', passive=False, durable=False, exclusive=False, auto_delete=False,
+                      arguments=None):
+        self._check_open()
+        with self.broker.lock:
+            name = queue or f"amq.gen-{uuid.uuid4().hex}"
+            local_queue = self.broker.queues.get(name)
+            if local_queue is None:
+                if passive:
+                    self._close_by_broker(pika.exceptions.ChannelClosedByBroker(
+                        404, f"NOT_FOUND - no queue '{name}'"))
+                local_queue = self.broker.queues[name] = LocalQueue(
+                    name, self.connection if exclusive else None, auto_delete)
+                self.broker._bindings_changed()  # the default exchange now reaches it
+            return SimpleNamespace(method=SimpleNamespace(queue=name, message_count=len(local_queue.messages),
+                                                          consumer_count=len(local_queue.consumers)))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        with self.broker.lock:
+            if exchange not in self.broker.exchanges or queue not in self.broker.queues:
+                self._close_by_broker(pika.exceptions.ChannelClosedByBroker(
+                    404, f"NOT_FOUND - cannot bind '{queue}' to '{exchange}'"))
+            binding = (queue if routing_key is None else routing_key, queue)
+            bindings = self.broker.bindings.setdefault(exchange, [])
+            if binding not in bindings:
+                bindings.append(binding)
+                self.broker._bindings_changed()
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self._check_open()
+        with self.broker.lock:
+            binding = (queue if routing_key is None else routing_key, queue)
+            bindings = self.broker.bindings.get(exchange, [])
+            if binding in bindings:
+                bindings.remove(binding)
+                self.broker._bindings_changed()
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        self._check_open()
+        with self.broker.lock:
+            local_queue = self.broker.queues.get(queue)
+            if local_queue is not None:
+                for consumer in list(local_queue.consumers):
+                    consumer.channel.consumers.pop(consumer.tag, None)
+            return SimpleNamespace(method=SimpleNamespace(message_count=self.broker.delete_queue(queue)))
+
+    def queue_purge(self, queue):
+        self._check_open()
+        with self.broker.lock:
+            local_queue = self.broker.queues[queue]
+            count = len(local_queue.messages)
+            local_queue.messages.clear()
+            return SimpleNamespace(method=SimpleNamespace(message_count=count))
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        with self.broker.lock:
+            self.prefetch = prefetch_count
+            for consumer in self.consumers.values():
+                self.broker.dispatch(consumer.queue)
+
+    def confirm_delivery(self):
+        self._check_open()
+        self.confirming = True
+
+    def tx_select(self):
+        self._check_open()
+        self.transaction = []
+
+    def tx_commit(self):
+        self._check_open()
+        held, self.transaction = self.transaction, []
+        for exchange, routing_key, body, properties in held:
+            try:
+                self.broker.publish(exchange, routing_key, properties, body)
+            except pika.exceptions.ChannelClosedByBroker as e:
+                self._close_by_broker(e)
+
+    def tx_rollback(self):
+        self._check_open()
+        self.transaction = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if self.transaction is not None:
+            self.transaction.append((exchange, routing_key, body, properties))
+            return
+        try:
+            routed = self.broker.publish(exchange, routing_key, properties, body)
+        except pika.exceptions.ChannelClosedByBroker as e:
+            self._close_by_broker(e)
+        if mandatory and not routed and self.confirming:
+            raise pika.exceptions.UnroutableError([])
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False, consumer_tag=None,
+                      arguments=None):
+        self._check_open()
+        with self.broker.lock:
+            local_queue = self.broker.queues.get(queue)
+            if local_queue is None:
+                self._close_by_broker(pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'"))
+            tag = consumer_tag or f"ctag{next(self.broker.tags)}"
+            consumer = LocalConsumer(tag, local_queue, self, on_message_callback, auto_ack)
+            self.consumers[tag] = consumer
+            local_queue.consumers.append(consumer)
+            self.broker.dispatch(local_queue)
+            return tag
+
+    def basic_cancel(self, consumer_tag=''):
+        with self.broker.lock:
+            consumer = self.consumers.pop(consumer_tag, None)
+            if consumer is None:
+                return []
+            queue = consumer.queue
+            if consumer in queue.consumers:
+                queue.consumers.remove(consumer)
+            if queue.auto_delete and not queue.consumers:
+                self.broker.delete_queue(queue.name)
+            return []
+
+    def _settle(self, delivery_tag, multiple, requeue=None):
+        with self.broker.lock:
+            if multiple:
+                tags = [tag for tag in self.unacked if tag <= delivery_tag] if delivery_tag else list(self.unacked)
+            else:
+                tags = [delivery_tag] if delivery_tag in self.unacked else []
+            queues = set()
+            requeued = []
+            for tag in tags:
+                queue, exchange, routing_key, properties, body = self.unacked.pop(tag)
+                queue.unacked -= 1
+                queues.add(queue)
+                if requeue:
+                    requeued.append((queue, (exchange, routing_key, properties, body, True)))
+            for queue, message in reversed(requeued):
+                if queue.name in self.broker.queues:
+                    queue.messages.appendleft(message)
+            for queue in queues:
+                if queue.name in self.broker.queues:
+                    self.broker.dispatch(queue)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._check_open()
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._check_open()
+        self._settle(delivery_tag, multiple, requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._check_open()
+        self._settle(delivery_tag, False, requeue)
+
+    def start_consuming(self):
+        """Delivers to this channel's consumers until stop_consuming() or the connection closes."""
+        while self.is_open and self.connection.is_open and self.consumers:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag=None):
+        for tag in [consumer_tag] if consumer_tag else list(self.consumers):
+            self.basic_cancel(tag)
+
+    def consume(self, queue, auto_ack=False, exclusive=False, arguments=None, inactivity_timeout=None):
+        """Generator of (method, properties, body); (None, None, None) after inactivity_timeout idle seconds."""
+        received = deque()
+        tag = self.basic_consume(queue, lambda ch, method, properties, body: received.append(
+            (method, properties, body)), auto_ack=auto_ack)
+        try:
+            while tag in self.consumers and self.is_open:
+                if not received:
+                    self.connection.process_data_events(time_limit=inactivity_timeout)
+                if received:
+                    yield received.popleft()
+                elif inactivity_timeout is not None:
+                    yield None, None, None
+        finally:
+            self.basic_cancel(tag)
+
+    def cancel(self):
+        self.stop_consuming()
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.stop_consuming()
+        # Whatever was delivered but never acked goes back to its queue
+        self._settle(0, True, requeue=True)
+        self.is_open = False
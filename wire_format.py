@@ -0,0 +1,159 @@
+import json
+import struct
+
+# Content types; the AMQP content_type property selects the decoder, and
+# messages without one are treated as JSON so older producers keep working
+JSON_CONTENT_TYPE = 'application/json'
+BINARY_CONTENT_TYPE = 'application/x-pbt-binary'
+
+VERSION = 1
+
+# Prices travel as integer ticks of 1/PRICE_SCALE
+PRICE_SCALE = 10000
+
+ORDER = 1
+TRADE = 2
+CANCEL = 3
+REDUCE = 4
+TRADE_BATCH = 5
+
+SIDES = {"buy": 0, "sell": 1}
+SIDE_NAMES = ("buy", "sell")
+
+# Every message starts with (version, message type); symbols are 8 NUL-padded bytes
+HEADER = struct.Struct("<BB")
+ORDER_BODY = struct.Struct("<8sBqQQ")      # symbol, side, price ticks, quantity, order id
+TRADE_BODY = struct.Struct("<8sqQQQ")      # symbol, price ticks, quantity, buy id, sell id
+CANCEL_BODY = struct.Struct("<8sQ")        # symbol, order id
+REDUCE_BODY = struct.Struct("<8sQQ")       # symbol, order id, quantity
+BATCH_COUNT = struct.Struct("<H")
+
+ORDER_MESSAGE = struct.Struct("<BB8sBqQQ")
+TRADE_MESSAGE = struct.Struct("<BB8sqQQQ")
+CANCEL_MESSAGE = struct.Struct("<BB8sQ")
+REDUCE_MESSAGE = struct.Struct("<BB8sQQ")
+
+
+def to_ticks(price):
+    return round(price * PRICE_SCALE)
+
+
+def from_ticks(ticks):
+    return ticks / PRICE_SCALE
+
+
+def _symbol(stock):
+    raw = stock.encode("ascii")
+    if len(raw) > 8:
+        raise ValueError(f"Symbol too long for the binary format: {stock}")
+    return raw
+
+
+def _order_id(order_id):
+    # 0 means "no id"; ids must be unsigned integers to fit the fixed layout
+    if order_id is None:
+        return 0
+    if not isinstance(order_id, int) or order_id <= 0:
+        raise ValueError(f"Binary format needs positive integer order ids, got {order_id!r}")
+    return order_id
+
+
+def encode_order(order):
+    """Encodes an order, cancel or reduce message dict."""
+    order_type = order["type"]
+    if order_type == "cancel":
+        return CANCEL_MESSAGE.pack(VERSION, CANCEL, _symbol(order["stock"]), _order_id(order["id"]))
+    if order_type == "reduce":
+        return REDUCE_MESSAGE.pack(VERSION, REDUCE, _symbol(order["stock"]), _order_id(order["id"]),
+                                   order["quantity"])
+    return ORDER_MESSAGE.pack(VERSION, ORDER, _symbol(order["stock"]), SIDES[order_type],
+                              to_ticks(order["price"]), order["quantity"], _order_id(order.get("id")))
+
+
+def _trade_fields(trade):
+    return (_symbol(trade["stock"]), to_ticks(trade["price"]), trade["quantity"],
+            _order_id(trade.get("buy_order_id")), _order_id(trade.get("sell_order_id")))
+
+
+def encode_trade(trade):
+    return TRADE_MESSAGE.pack(VERSION, TRADE, *_trade_fields(trade))
+
+
+def encode_trades(trades):
+    """Encodes a batch of trades as one message."""
+    if len(trades) > 0xFFFF:
+        raise ValueError("Too many trades for one binary batch")
+    parts = [HEADER.pack(VERSION, TRADE_BATCH), BATCH_COUNT.pack(len(trades))]
+    for trade in trades:
+        parts.append(TRADE_BODY.pack(*_trade_fields(trade)))
+    return b"".join(parts)
+
+
+def _decode_trade(symbol, ticks, quantity, buy_id, sell_id):
+    trade = {"stock": symbol.rstrip(b"\0").decode("ascii"), "price": from_ticks(ticks), "quantity": quantity}
+    if buy_id:
+        trade["buy_order_id"] = buy_id
+    if sell_id:
+        trade["sell_order_id"] = sell_id
+    return trade
+
+
+def decode_binary(body):
+    """Decodes a binary message into the same dicts (or list of dicts) as the JSON format."""
+    version, message_type = HEADER.unpack_from(body)
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire format version: {version}")
+    offset = HEADER.size
+    if message_type == ORDER:
+        symbol, side, ticks, quantity, order_id = ORDER_BODY.unpack_from(body, offset)
+        if side >= len(SIDE_NAMES):
+            raise ValueError(f"Unknown order side: {side}")
+        order = {"type": SIDE_NAMES[side], "stock": symbol.rstrip(b"\0").decode("ascii"),
+                 "price": from_ticks(ticks), "quantity": quantity}
+        if order_id:
+            order["id"] = order_id
+        return order
+    if message_type == TRADE:
+        return _decode_trade(*TRADE_BODY.unpack_from(body, offset))
+    if message_type == TRADE_BATCH:
+        count, = BATCH_COUNT.unpack_from(body, offset)
+        offset += BATCH_COUNT.size
+        return [_decode_trade(*fields) for fields in
+                TRADE_BODY.iter_unpack(body[offset:offset + count * TRADE_BODY.size])]
+    if message_type == CANCEL:
+        symbol, order_id = CANCEL_BODY.unpack_from(body, offset)
+        return {"type": "cancel", "stock": symbol.rstrip(b"\0").decode("ascii"), "id": order_id}
+    if message_type == REDUCE:
+        symbol, order_id, quantity = REDUCE_BODY.unpack_from(body, offset)
+        return {"type": "reduce", "stock": symbol.rstrip(b"\0").decode("ascii"), "id": order_id,
+                "quantity": quantity}
+    raise ValueError(f"Unknown message type: {message_type}")
+
+
+def encode(message, content_type=JSON_CONTENT_TYPE):
+    """Encodes an order dict, trade dict or list of trades in the given format."""
+    if content_type == BINARY_CONTENT_TYPE:
+        if isinstance(message, list):
+            return encode_trades(message)
+        if "type" in message:
+            return encode_order(message)
+        return encode_trade(message)
+    return json.dumps(message).encode()
+
+
+def decode(body, content_type=None):
+    """Decodes a message body according to its AMQP content type."""
+    if content_type == BINARY_CONTENT_TYPE:
+        return decode_binary(body)
+    return json.loads(body)
+
+
+def content_type_of(properties):
+    return getattr(properties, "content_type", None)
+
+
+def message_stock(body, content_type=None):
+    """Returns the symbol of an order message without decoding the rest of it."""
+    if content_type == BINARY_CONTENT_TYPE:
+        return body[HEADER.size:HEADER.size + 8].rstrip(b"\0").decode("ascii")
+    return json.loads(body)["stock"]